@@ -0,0 +1,41 @@
+""" Architecture of the DNN and options of the TMVA training.
+The DNN is a sequence of fully connected layers with the number of
+nodes given in ``hidden_layers`` followed by a softmax output layer
+with one node for the signal and one for the background.
+"""
+
+DNN_MODEL = {
+    "hidden_layers": [12, 12, 12],
+    "activation": "relu",
+    "loss": "categorical_crossentropy",
+    "optimizer": "adam",
+    "epochs": 20,
+    "batch_size": 128
+}
+
+TMVA_OPTIONS = {
+    "factory": "!V:!Silent:Color:DrawProgressBar:Transformations=D,G:AnalysisType=Classification",
+    "dataloader": "SplitMode=Random:NormMode=NumEvents:!V",
+    "method": "H:!V:VarTransform=D,G"
+}
+
+# Subsampling of the training set of ``ml_sampling.py``, enabled with
+# ``--trainingSize``: seed of the sampling
+TRAINING_SAMPLING = {
+    "seed": 12345
+}
+
+# Engines available to evaluate the trained DNN: the NumPy runtime
+# of ``ml_inference.py`` or the TMVA reader with the PyKeras method
+INFERENCE_ENGINES = ["numpy", "tmva"]
+
+# Values of the architecture and of the training explored by the scan
+# of ``ml_scan.py``: each configuration is a combination of them, while
+# the values not listed here are taken from ``DNN_MODEL``. The variables
+# are the names of the sets defined in ``variables_ml_def.py``
+SCAN_GRID = {
+    "hidden_layers": [[12, 12, 12], [24, 24], [32, 16, 8], [64, 64, 64]],
+    "epochs": [20, 40],
+    "batch_size": [128, 512],
+    "variables": ["tot", "angles"]
+}
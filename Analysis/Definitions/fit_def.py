@@ -0,0 +1,32 @@
+""" Options of the fit of the mass of the Higgs candidate in ``fit_mass.py``.
+"""
+
+# Backends evaluating the likelihood of the fits: the vectorized
+# batch evaluation of RooFit or the scalar evaluation, event by event
+FIT_BACKENDS = ["cpu", "legacy"]
+
+# Maximum difference between the parameters fitted with the selected
+# backend and with the scalar one, in units of their uncertainty,
+# checked with ``--validateFit``
+FIT_TOLERANCE = 0.01
+
+# Grid on which the KDE of the background is tabulated with ``--kdeCache``:
+# number of bins over the range of the fit and order of the interpolation
+KDE_GRID = {
+    "bins": 1000,
+    "interpolation": 2
+}
+
+# Pseudo-experiments of ``toy_study.py``, enabled with ``--toys``: seed from
+# which the seed of each toy is derived and number of toys of each job
+TOYS = {
+    "seed": 20120704,
+    "chunk_size": 25
+}
+
+# Scan of the mass hypothesis of ``mass_scan.py``, enabled with ``--massScan``:
+# range of the masses and distance between two points of the grid, in GeV
+MASS_SCAN = {
+    "range": [110., 140.],
+    "step": 0.5
+}
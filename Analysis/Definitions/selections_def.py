@@ -1,8 +1,31 @@
 """ The keys of the dictionary specify whether or not the events
-are requested to have a DNN discriminant above the 0.5 threshold,
-while the values specify the name of the tree where the data are stored.
+are requested to have a DNN discriminant above the optimal threshold,
+while the values are the filters applied to the events of the skims
+(an empty string means no filter). The filters use the bitmask
+``DNNSelectionMask`` written by ``ml_selection.py``: the first bit is set
+when the discriminant is above the optimal threshold and the following
+ones when it is above the working points in ``DNN_WORKING_POINTS``,
+so that e.g. ``(DNNSelectionMask & 4) != 0`` selects the second working point.
 """
 SELECTIONS = {
-    "NoSelection" : "Events",
-    "DNNSelection" : "EventsDNNSelection",
-}
\ No newline at end of file
+    "NoSelection" : "",
+    "DNNSelection" : "(DNNSelectionMask & 1) != 0",
+}
+
+# Additional thresholds on the DNN discriminant stored in the bitmask
+DNN_WORKING_POINTS = [0.2, 0.4, 0.6, 0.8]
+
+# Name of the friend TTree with the bitmask of the selections
+SELECTION_TREE = "EventsSelection"
+
+# Configuration of the scan of the threshold on the DNN discriminant of ``ml_optimize.py``:
+# number of bins of the discriminant, minimum expected background after the cut
+# and edges of the bins of Higgs_mass used with ``--massBins``
+SIGNIFICANCE_SCAN = {
+    "n_bins": 1000,
+    "min_background": 0.1,
+    "mass_bins": [70., 110., 120., 130., 140., 180.]
+}
+
+# Definitions of the significance available for the optimization
+SIGNIFICANCE_METRICS = ["asimov", "s_sqrt_sb", "s_sqrt_b"]
@@ -0,0 +1,12 @@
+""" Formats in which the intermediate datasets (skims and selections)
+can be stored. The first entry is the default one. The TTree is the
+classic ROOT columnar format, while the RNTuple is its successor,
+designed for a higher read throughput and a smaller disk footprint.
+The RNTuple needs a recent ROOT release, so it's available only
+when the installed ROOT supports it.
+"""
+
+STORAGE_FORMATS = ["ttree", "rntuple"]
+
+# First ROOT release able to read and write the RNTuple through RDataFrame
+RNTUPLE_ROOT_VERSION = "6.32"
@@ -54,4 +54,30 @@ VARIABLES_COMPLETE["Discriminant"] = (40, 0, 1, "DNN Discriminant", "")
 VARIABLES_DICT = {
         "part" : VARIABLES,
         "tot" : VARIABLES_COMPLETE
-}
\ No newline at end of file
+}
+
+# Variables of the sparse cubes of ``histogram_cube.py`` with the number
+# of their fine bins, within the limits given in ``VARIABLES_COMPLETE``
+CUBE_VARIABLES = {
+        "Higgs_mass": 440,
+        "Z1_mass": 240,
+        "Z2_mass": 296,
+        "Higgs_pt": 200,
+        "cos_theta_star": 100,
+        "Phi": 100,
+        "Discriminant": 200,
+}
+
+# Configuration of the binning proposed by ``binning.py``: the method
+# ("equal_population" or "freedman_diaconis"), the number of bins of the
+# equal population binning, the maximum number of bins, the quantiles
+# delimiting the range of the histograms, the size of the quantile sketches
+# and the number of values added to a sketch at once
+BINNING = {
+        "method": "equal_population",
+        "n_bins": 36,
+        "max_bins": 100,
+        "quantile_range": (0.005, 0.995),
+        "sketch_size": 400,
+        "chunk_size": 100000,
+}
@@ -5,4 +5,7 @@ VARIABLES_ML_DICT = {
     "tot" : ["Z1_mass", "Z2_mass", "cos_theta_star", "Phi", "Phi1", "cos_theta1", "cos_theta2"],
     "angles" : ["cos_theta_star", "Phi", "Phi1", "cos_theta1", "cos_theta2"],
     "higgs" : ["Higgs_mass"]
-}
\ No newline at end of file
+}
+# Variables hashed to assign each event to a fold of the k-fold training,
+# so that the assignment doesn't depend on the order of the events
+KFOLD_VARIABLES = ["Higgs_mass", "Higgs_pt", "Higgs_eta", "Higgs_phi"]
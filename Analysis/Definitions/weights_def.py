@@ -21,3 +21,6 @@ WEIGHTS = {
 	"Run2012B_DoubleElectron": 1.0,
 	"Run2012C_DoubleElectron": 1.0
 }
+
+# Seed of the Poisson bootstrap replicas of the histograms
+BOOTSTRAP_SEED = 20120411
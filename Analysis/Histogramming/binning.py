@@ -0,0 +1,471 @@
+""" Data driven binning of the histograms of ``make_histo.py``.
+The distribution of each variable of ``VARIABLES`` in the skims of the
+simulated samples is summarised with a single event loop over each skim:
+each thread of the loop buffers the values in chunks, which are fed to a
+KLL quantile sketch of fixed size for each variable, so the memory doesn't
+grow with the size of the skims. The sketches are mergeable, so those of the
+threads are combined in the sketch of each final state, and those of the
+final states in the sketch of all of them. The edges proposed from the sketches, either
+with an equal population of the bins or with the width of Freedman-Diaconis,
+are saved in ``Histograms/binning.json``, which ``make_histo.py`` uses with
+``--binning`` in place of the binning of ``variables_def.py``.
+The sketches count the events without their weights.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import ROOT
+
+sys.path.append(os.path.join("..","..", ""))
+
+from Analysis import cache_tools, dataset_io, set_up
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.variables_def import BINNING, VARIABLES
+from Analysis.Histogramming import bootstrap
+
+# Sketches filled inside the event loop, one for each thread and variable,
+# with the same compaction of ``update_sketch`` and the random offsets drawn
+# with the counter-based generator of the bootstrap
+SKETCH_CODE = """
+#ifndef BINNING_SKETCHES_H
+#define BINNING_SKETCHES_H
+#include <algorithm>
+#include <cmath>
+#include <cstddef>
+#include <cstdint>
+#include <limits>
+#include <vector>
+#include "ROOT/RVec.hxx"
+class BinningSketches {
+public:
+    BinningSketches(unsigned int n_slots, unsigned int n_vars, std::size_t size,
+                    std::size_t chunk_size, std::uint64_t seed)
+        : fSize(size), fChunkSize(chunk_size), fSeed(seed),
+          fBuffers(n_slots, std::vector<std::vector<double>>(n_vars)),
+          fSketches(n_slots, std::vector<Sketch>(n_vars)) {}
+    bool Fill(unsigned int slot, const ROOT::RVec<double>& values) {
+        for (std::size_t var = 0; var < values.size(); ++var) {
+            if (!std::isfinite(values[var])) continue;
+            auto& buffer = fBuffers[slot][var];
+            buffer.push_back(values[var]);
+            if (buffer.size() >= fChunkSize) Flush(slot, var);
+        }
+        return true;
+    }
+    void Finish() {
+        for (std::size_t slot = 0; slot < fBuffers.size(); ++slot) {
+            for (std::size_t var = 0; var < fBuffers[slot].size(); ++var) Flush(slot, var);
+        }
+    }
+    ULong64_t Count(unsigned int slot, unsigned int var) const {
+        return fSketches[slot][var].count;
+    }
+    double Min(unsigned int slot, unsigned int var) const { return fSketches[slot][var].min; }
+    double Max(unsigned int slot, unsigned int var) const { return fSketches[slot][var].max; }
+    std::size_t Levels(unsigned int slot, unsigned int var) const {
+        return fSketches[slot][var].levels.size();
+    }
+    std::size_t LevelSize(unsigned int slot, unsigned int var, std::size_t level) const {
+        return fSketches[slot][var].levels[level].size();
+    }
+    void CopyLevel(unsigned int slot, unsigned int var, std::size_t level, double* items) const {
+        const auto& values = fSketches[slot][var].levels[level];
+        std::copy(values.begin(), values.end(), items);
+    }
+private:
+    struct Sketch {
+        std::vector<std::vector<double>> levels{1};
+        ULong64_t count = 0;
+        double min = std::numeric_limits<double>::infinity();
+        double max = -std::numeric_limits<double>::infinity();
+        std::uint64_t compactions = 0;
+    };
+    std::size_t Capacity(const Sketch& sketch, std::size_t level) const {
+        const double depth = sketch.levels.size() - 1 - level;
+        return std::max<std::size_t>(2, static_cast<std::size_t>(
+            std::ceil(fSize * std::pow(2. / 3., depth))));
+    }
+    void Flush(unsigned int slot, unsigned int var) {
+        auto& buffer = fBuffers[slot][var];
+        if (buffer.empty()) return;
+        auto& sketch = fSketches[slot][var];
+        sketch.count += buffer.size();
+        const auto range = std::minmax_element(buffer.begin(), buffer.end());
+        sketch.min = std::min(sketch.min, *range.first);
+        sketch.max = std::max(sketch.max, *range.second);
+        sketch.levels[0].insert(sketch.levels[0].end(), buffer.begin(), buffer.end());
+        buffer.clear();
+        for (std::size_t level = 0; level < sketch.levels.size(); ++level) {
+            if (sketch.levels[level].size() <= Capacity(sketch, level)) continue;
+            if (level + 1 == sketch.levels.size()) sketch.levels.emplace_back();
+            auto items = std::move(sketch.levels[level]);
+            std::sort(items.begin(), items.end());
+            // With an odd number of items one of them stays in the level
+            std::vector<double> kept;
+            if (items.size() % 2) {
+                kept.push_back(items.back());
+                items.pop_back();
+            }
+            const std::uint64_t key = fSeed ^ bootstrapMix((std::uint64_t(slot) << 32) ^ var);
+            const std::size_t offset = bootstrapMix(key + sketch.compactions++) & 1;
+            for (std::size_t i = offset; i < items.size(); i += 2) {
+                sketch.levels[level + 1].push_back(items[i]);
+            }
+            sketch.levels[level] = std::move(kept);
+        }
+    }
+    std::size_t fSize;
+    std::size_t fChunkSize;
+    std::uint64_t fSeed;
+    std::vector<std::vector<std::vector<double>>> fBuffers;
+    std::vector<std::vector<Sketch>> fSketches;
+};
+#endif
+"""
+
+
+def declare_sketches():
+    """ Compile the sketches filled inside the event loop with the ROOT interpreter.
+    """
+
+    bootstrap.declare_bootstrap()
+    if not hasattr(ROOT, "BinningSketches"):
+        ROOT.gInterpreter.Declare(SKETCH_CODE)
+
+def new_sketch(size):
+    """ Create an empty KLL quantile sketch.
+
+    :param size: Capacity of the top level of the sketch
+    :type size: int
+    :return: Sketch, with the items of each level (an item of level h
+        stands for 2^h values), the number of values and their range
+    :rtype: dict
+    """
+
+    return {"size": size, "levels": [np.empty(0)], "count": 0,
+            "min": math.inf, "max": -math.inf}
+
+def _capacity(sketch, level):
+    """ Capacity of a level of the sketch, decreasing geometrically from the top level.
+    """
+
+    depth = len(sketch["levels"]) - 1 - level
+    return max(2, int(math.ceil(sketch["size"] * (2. / 3.) ** depth)))
+
+def _compress(sketch, rng):
+    """ Compact the levels of the sketch above their capacity: the sorted items
+    are halved keeping every other one, with a random offset, and the kept ones
+    are promoted to the next level with twice their weight.
+    """
+
+    levels = sketch["levels"]
+    level = 0
+    while level < len(levels):
+        if len(levels[level]) > _capacity(sketch, level):
+            if level + 1 == len(levels):
+                levels.append(np.empty(0))
+            items = np.sort(levels[level])
+            # With an odd number of items one of them stays in the level
+            kept = items[len(items) - len(items) % 2:]
+            items = items[:len(items) - len(items) % 2]
+            levels[level + 1] = np.concatenate([levels[level + 1], items[rng.integers(2)::2]])
+            levels[level] = kept
+        level += 1
+
+def update_sketch(sketch, values, rng):
+    """ Add a chunk of values to the sketch. The non finite values are ignored.
+
+    :param sketch: Quantile sketch, updated in place
+    :type sketch: dict
+    :param values: Values to be added
+    :type values: numpy.ndarray
+    :param rng: Random number generator
+    :type rng: numpy.random.Generator
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return
+    sketch["count"] += len(values)
+    sketch["min"] = min(sketch["min"], float(values.min()))
+    sketch["max"] = max(sketch["max"], float(values.max()))
+    sketch["levels"][0] = np.concatenate([sketch["levels"][0], values])
+    _compress(sketch, rng)
+
+def merge_sketches(sketches, rng):
+    """ Merge some sketches in a new one, summarising all their values.
+
+    :param sketches: Quantile sketches with the same size
+    :type sketches: list(dict)
+    :param rng: Random number generator
+    :type rng: numpy.random.Generator
+    :return: Merged sketch
+    :rtype: dict
+    """
+
+    merged = new_sketch(sketches[0]["size"])
+    n_levels = max(len(sketch["levels"]) for sketch in sketches)
+    merged["levels"] = [np.concatenate([sketch["levels"][level] for sketch in sketches
+                                        if level < len(sketch["levels"])])
+                        for level in range(n_levels)]
+    merged["count"] = sum(sketch["count"] for sketch in sketches)
+    merged["min"] = min(sketch["min"] for sketch in sketches)
+    merged["max"] = max(sketch["max"] for sketch in sketches)
+    _compress(merged, rng)
+    return merged
+
+def fill_sketches(rdf, variables, size, chunk_size, seed, rng):
+    """ Fill the quantile sketches of some variables in a single event loop,
+    in which each thread feeds its own sketches with chunks of values.
+    The non finite values are ignored.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :param variables: Names of the variables
+    :type variables: list(str)
+    :param size: Capacity of the top level of the sketches
+    :type size: int
+    :param chunk_size: Number of values added to a sketch at once
+    :type chunk_size: int
+    :param seed: Seed of the random offsets of the compactions inside the loop
+    :type seed: int
+    :param rng: Random number generator of the merge of the sketches of the threads
+    :type rng: numpy.random.Generator
+    :return: Sketch of each variable
+    :rtype: dict(str, dict)
+    """
+
+    declare_sketches()
+    n_slots = max(ROOT.ROOT.GetThreadPoolSize(), 1)
+    collector = ROOT.BinningSketches(n_slots, len(variables), size, chunk_size, seed)
+    values = ", ".join(f"(double){var}" for var in variables)
+    rdf.Define("BinningValues", f"ROOT::RVec<double>{{{values}}}")\
+       .Filter(f"((BinningSketches*){ROOT.addressof(collector)})->Fill(rdfslot_, "
+               "BinningValues)").Count().GetValue()
+    collector.Finish()
+
+    sketches = {}
+    for i, var in enumerate(variables):
+        by_slot = []
+        for slot in range(n_slots):
+            sketch = new_sketch(size)
+            sketch["levels"] = []
+            for level in range(collector.Levels(slot, i)):
+                items = np.empty(collector.LevelSize(slot, i, level))
+                if len(items):
+                    collector.CopyLevel(slot, i, level, items)
+                sketch["levels"].append(items)
+            sketch["count"] = int(collector.Count(slot, i))
+            sketch["min"] = float(collector.Min(slot, i))
+            sketch["max"] = float(collector.Max(slot, i))
+            by_slot.append(sketch)
+        sketches[var] = merge_sketches(by_slot, rng)
+    return sketches
+
+def sketch_quantiles(sketch, probs):
+    """ Estimate some quantiles of the values summarised by the sketch.
+
+    :param sketch: Quantile sketch
+    :type sketch: dict
+    :param probs: Probabilities of the quantiles, in [0, 1]
+    :type probs: list(float)
+    :return: Estimated quantiles
+    :rtype: numpy.ndarray
+    """
+
+    items = np.concatenate(sketch["levels"])
+    weights = np.concatenate([np.full(len(items_level), 2.**level)
+                              for level, items_level in enumerate(sketch["levels"])])
+    order = np.argsort(items)
+    items = items[order]
+    cumulative = np.cumsum(weights[order])
+    index = np.searchsorted(cumulative, np.asarray(probs) * cumulative[-1], side="left")
+    quantiles = items[np.minimum(index, len(items) - 1)]
+    # The extremes are known exactly
+    quantiles = np.where(np.asarray(probs) <= 0., sketch["min"], quantiles)
+    return np.where(np.asarray(probs) >= 1., sketch["max"], quantiles)
+
+def propose_edges(sketch, method, n_bins, max_bins, quantile_range):
+    """ Propose the edges of the bins of a variable from its quantile sketch.
+
+    :param sketch: Quantile sketch of the variable
+    :type sketch: dict
+    :param method: Either ``equal_population``, with ``n_bins`` bins holding the
+        same number of events, or ``freedman_diaconis``, with bins of width
+        2 IQR / n^(1/3)
+    :type method: str
+    :param n_bins: Number of bins of the equal population binning
+    :type n_bins: int
+    :param max_bins: Maximum number of bins
+    :type max_bins: int
+    :param quantile_range: Quantiles of the lower and upper edges, the events
+        outside go in the underflow and overflow
+    :type quantile_range: tuple(float)
+    :raises ValueError: Raised when the method is unknown
+    :return: Increasing edges of the bins, None if the sketch is empty
+    :rtype: list(float)
+    """
+
+    if sketch["count"] == 0:
+        return None
+    low, high = sketch_quantiles(sketch, quantile_range)
+    if high <= low:
+        return None
+
+    if method == "equal_population":
+        probs = np.linspace(quantile_range[0], quantile_range[1], min(n_bins, max_bins) + 1)
+        edges = sketch_quantiles(sketch, probs)
+    elif method == "freedman_diaconis":
+        q_25, q_75 = sketch_quantiles(sketch, [0.25, 0.75])
+        width = 2. * (q_75 - q_25) / sketch["count"] ** (1. / 3.)
+        n_fd = int(math.ceil((high - low) / width)) if width > 0 else max_bins
+        edges = np.linspace(low, high, min(max(n_fd, 1), max_bins) + 1)
+    else:
+        raise ValueError(f"Unknown binning method {method}")
+
+    # Repeated quantiles of discrete variables would give empty bins
+    edges = np.unique(edges)
+    return [float(edge) for edge in edges] if len(edges) > 1 else None
+
+def binning_path(output):
+    """ Path of the file of the proposed binning.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Path to the file
+    :rtype: str
+    """
+
+    return os.path.join(output, "Histograms", "binning.json")
+
+def load_binning(output, logger):
+    """ Read the edges of the proposed binning to be used in place of
+    those of ``variables_def.py``.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Edges of the bins of each variable, common to all the final states
+    :rtype: dict(str, list(float))
+    """
+
+    file_path = binning_path(output)
+    if not os.path.exists(file_path):
+        logger.warning("The binning file %s can't be found, the binning of "
+                       "variables_def.py is used", file_path)
+        return {}
+    edges = cache_tools.load_manifest(file_path).get("edges", {})
+    # The final states are summed in the plots, so they share the same binning
+    return {variable: by_state["Combined"] for variable, by_state in edges.items()
+            if "Combined" in by_state}
+
+def make_binning(args, logger):
+    """ Main function of the proposal of the binning: the quantile sketches of
+    the variables are filled in a single pass over the skims of the simulated
+    samples and the proposed edges are written in ``Histograms/binning.json``.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    rng = np.random.default_rng(0)
+    sketches = {}
+    simulated_samples = {k: v for k, v in SAMPLES.items() if not k.startswith("Run")}
+    for sample_name, final_states in simulated_samples.items():
+        # Check if the sample is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
+                continue
+
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+            try:
+                if not os.path.exists(file_name):
+                    raise FileNotFoundError
+                rdf = dataset_io.open_dataset("Events", file_name)
+            except FileNotFoundError as not_found_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_found_err, stack_info=True)
+                continue
+
+            variables = [var for var in VARIABLES if var != "Weight" and rdf.HasColumn(var)]
+            if not variables:
+                logger.debug("Sample %s final state %s: no variable to be binned",
+                             sample_name, final_state)
+                continue
+            state_sketches = sketches.setdefault(final_state, {})
+            seed = zlib.crc32(os.path.basename(file_name).encode("utf8"))
+            skim_sketches = fill_sketches(rdf, variables, BINNING["sketch_size"],
+                                          BINNING["chunk_size"], seed, rng)
+            for var, sketch in skim_sketches.items():
+                state_sketches[var] = merge_sketches([state_sketches[var], sketch], rng) \
+                                      if var in state_sketches else sketch
+            logger.debug("Sample %s final state %s summarised", sample_name, final_state)
+
+    if not sketches:
+        logger.error("No skim of the simulated samples can be found")
+        return
+
+    edges = {}
+    variables = dict.fromkeys(var for by_var in sketches.values() for var in by_var)
+    for var in variables:
+        by_state = {final_state: by_var[var] for final_state, by_var in sketches.items()
+                    if var in by_var}
+        by_state["Combined"] = merge_sketches(list(by_state.values()), rng)
+        edges[var] = {}
+        for final_state, sketch in by_state.items():
+            proposal = propose_edges(sketch, BINNING["method"], BINNING["n_bins"],
+                                     BINNING["max_bins"], BINNING["quantile_range"])
+            if proposal is not None:
+                edges[var][final_state] = proposal
+        if "Combined" in edges[var]:
+            logger.info("%s: %s bins in [%.4g, %.4g]", var, len(edges[var]["Combined"]) - 1,
+                        edges[var]["Combined"][0], edges[var]["Combined"][-1])
+
+    os.makedirs(os.path.dirname(binning_path(args.output)), exist_ok=True)
+    cache_tools.save_manifest(binning_path(args.output),
+                              {"method": BINNING["method"], "edges": edges})
+    logger.info("Created file %s", binning_path(args.output))
+
+    logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-f", "--finalState",   default="all", type=str,
+                            help="comma separated list of the final states to analyse: \
+                            FourMuons,FourElectrons,TwoMuonsTwoElectrons" )
+    parser.add_argument("-s", "--sample",    default="all", type=str,
+                        help="string with comma separated list of samples to analyse: \
+                        Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
+                        Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+
+    make_binning(args_main, logger_main)
@@ -0,0 +1,142 @@
+""" Poisson bootstrap of the histograms, to estimate the statistical
+uncertainty of their shapes in a single event loop. Each event gets
+N weights ``k_i * Weight``, with ``k_i`` drawn from a Poisson distribution
+of mean 1, and the N replicas of a histogram are filled at once in a 2D
+histogram (bin of the variable, replica). The ``k_i`` are obtained from a
+counter-based generator keyed by the entry of the event, so the replicas
+are the same in every run, with or without the implicit multi-threading.
+"""
+
+import zlib
+
+import numpy as np
+import ROOT
+
+from Analysis.Definitions.weights_def import BOOTSTRAP_SEED
+from Analysis.Histogramming.histogramming_functions import histogram_to_numpy
+
+# SplitMix64 finaliser used as counter-based generator, and
+# inversion of the cumulative distribution of Poisson(1)
+BOOTSTRAP_CODE = """
+#ifndef BOOTSTRAP_WEIGHTS_H
+#define BOOTSTRAP_WEIGHTS_H
+#include <cmath>
+#include <cstdint>
+#include "ROOT/RVec.hxx"
+inline std::uint64_t bootstrapMix(std::uint64_t x) {
+    x += 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+inline ROOT::RVec<double> bootstrapWeights(ULong64_t entry, double weight,
+                                           unsigned int n, std::uint64_t seed) {
+    ROOT::RVec<double> weights(n);
+    const std::uint64_t key = bootstrapMix(seed ^ bootstrapMix(entry));
+    for (unsigned int i = 0; i < n; ++i) {
+        const double u = (bootstrapMix(key + i) >> 11) / 9007199254740992.;
+        double p = std::exp(-1.), cdf = p;
+        int k = 0;
+        while (u > cdf && k < 20) {
+            ++k;
+            p /= k;
+            cdf += p;
+        }
+        weights[i] = k * weight;
+    }
+    return weights;
+}
+inline ROOT::RVec<double> bootstrapIndex(unsigned int n) {
+    ROOT::RVec<double> index(n);
+    for (unsigned int i = 0; i < n; ++i) index[i] = i;
+    return index;
+}
+#endif
+"""
+
+
+def declare_bootstrap():
+    """ Compile the functions of the bootstrap with the ROOT interpreter.
+    """
+
+    if not hasattr(ROOT, "bootstrapWeights"):
+        ROOT.gInterpreter.Declare(BOOTSTRAP_CODE)
+
+def bootstrap_seed(sample_name, final_state):
+    """ Seed of the replicas of a dataset, so that different
+    datasets have independent replicas.
+
+    :param sample_name: Name of the sample
+    :type sample_name: str
+    :param final_state: Final state of the sample
+    :type final_state: str
+    :return: Seed of the generator
+    :rtype: int
+    """
+
+    return BOOTSTRAP_SEED ^ zlib.crc32(f"{sample_name}_{final_state}".encode("utf8"))
+
+def define_replicas(rdf, variables, n_replicas, seed):
+    """ Define the bootstrap weights of each event and the values of the
+    variables repeated for each replica.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :param variables: Names of the variables to be histogrammed
+    :type variables: list(str)
+    :param n_replicas: Number of replicas
+    :type n_replicas: int
+    :param seed: Seed of the generator
+    :type seed: int
+    :return: RDataFrame with the new columns
+    :rtype: ROOT.RDataFrame
+    """
+
+    declare_bootstrap()
+    rdf = rdf.Define("BootstrapWeights",
+                     f"bootstrapWeights(rdfentry_, Weight, {n_replicas}, {seed}ULL)")
+    rdf = rdf.Define("BootstrapIndex", f"bootstrapIndex({n_replicas})")
+    for variable in variables:
+        rdf = rdf.Define(f"{variable}_bootstrap",
+                         f"ROOT::RVec<double>({n_replicas}, (double){variable})")
+    return rdf
+
+def book_bootstrap(rdf, variable, range_, n_replicas):
+    """ Book the 2D histogram of the replicas of a variable, with the bins of
+    the variable on the x axis and the replicas on the y axis.
+
+    :param rdf: Input RDataFrame, with the columns of ``define_replicas``
+    :type rdf: ROOT.RDataFrame
+    :param variable: Name of the variable
+    :type variable: str
+    :param range_: Tuple that contains the number of bins and
+        the lower and upper limits of the histogram, or list of the edges of the bins
+    :type range_: tuple(int) or list(float)
+    :param n_replicas: Number of replicas
+    :type n_replicas: int
+    :return: Booked histogram
+    :rtype: ROOT.RDF.RResultPtr
+    """
+
+    name = f"{variable}_bootstrap"
+    replicas = np.arange(n_replicas + 1, dtype=np.float64) - 0.5
+    if isinstance(range_, list):
+        edges = np.asarray(range_, dtype=np.float64)
+    else:
+        edges = np.linspace(range_[1], range_[2], range_[0] + 1)
+    return rdf.Histo2D(ROOT.RDF.TH2DModel(name, name, len(edges) - 1, edges,
+                                          n_replicas, replicas),
+                       name, "BootstrapIndex", "BootstrapWeights")
+
+def bootstrap_errors(histo):
+    """ Statistical uncertainty of each bin of a histogram, given by the
+    standard deviation of its bootstrap replicas.
+
+    :param histo: 2D histogram of the replicas of ``book_bootstrap``
+    :type histo: ROOT.TH2
+    :return: Uncertainty of each bin of the variable, including underflow and overflow
+    :rtype: numpy.ndarray
+    """
+
+    replicas = histogram_to_numpy(histo)[1:-1]
+    return replicas.std(axis=0, ddof=1)
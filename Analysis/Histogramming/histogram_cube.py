@@ -0,0 +1,205 @@
+""" Weighted sparse N-dimensional histograms ("cubes") of the skims.
+A cube is filled once per sample and final state over the variables
+of ``CUBE_VARIABLES`` in ``variables_def.py``, with a fine binning, and
+only the bins that contain events are stored (their coordinates, sum of
+the weights and sum of the squared weights) in ``Histograms/Cubes/``.
+Any 1D or 2D projection, with coarser bins or with cuts on the other
+variables (e.g. a threshold on the discriminant), is then obtained from
+the cube with NumPy, without a new event loop over the skims.
+The bin 0 and the bin n+1 of each axis are the underflow and the overflow,
+as in ROOT.
+"""
+
+import os
+from array import array
+
+import numpy as np
+import ROOT
+
+from Analysis.Definitions.variables_def import CUBE_VARIABLES, VARIABLES_COMPLETE
+
+
+def cube_edges(variable):
+    """ Edges of the fine bins of a variable of the cube.
+
+    :param variable: Name of the variable
+    :type variable: str
+    :return: Edges of the bins
+    :rtype: numpy.ndarray
+    """
+
+    _, low, high = VARIABLES_COMPLETE[variable][:3]
+    return np.linspace(low, high, CUBE_VARIABLES[variable] + 1)
+
+def cube_path(output, sample_name, final_state):
+    """ Path of the cube of a given sample and final state.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param sample_name: Name of the sample
+    :type sample_name: str
+    :param final_state: Final state of the sample
+    :type final_state: str
+    :return: Path to the cube
+    :rtype: str
+    """
+
+    return os.path.join(output, "Histograms", "Cubes", f"{sample_name}_{final_state}.npz")
+
+def fill_cube(arrays, variables, weights):
+    """ Fill a sparse cube with the events read in memory.
+
+    :param arrays: Columns of the dataset
+    :type arrays: dict(str, numpy.ndarray)
+    :param variables: Names of the variables of the cube
+    :type variables: list(str)
+    :param weights: Weight of each event
+    :type weights: numpy.ndarray
+    :return: Variables, edges, coordinates of the filled bins, sum of the
+        weights and sum of the squared weights in each of them
+    :rtype: dict
+    """
+
+    edges = [cube_edges(var) for var in variables]
+    shape = [len(edge) + 1 for edge in edges]
+    # With side="right" the upper edge goes in the overflow, as in ROOT
+    indices = [np.searchsorted(edge, np.asarray(arrays[var]), side="right")
+               for var, edge in zip(variables, edges)]
+    linear = np.ravel_multi_index(indices, shape)
+    filled, inverse = np.unique(linear, return_inverse=True)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    return {
+        "variables": list(variables),
+        "edges": edges,
+        "coords": np.stack(np.unravel_index(filled, shape), axis=1).astype(np.int32),
+        "sumw": np.bincount(inverse, weights=weights, minlength=len(filled)),
+        "sumw2": np.bincount(inverse, weights=weights**2, minlength=len(filled)),
+    }
+
+def save_cube(cube, file_path, fingerprint):
+    """ Write a cube to file.
+
+    :param cube: Sparse cube
+    :type cube: dict
+    :param file_path: Path to the file
+    :type file_path: str
+    :param fingerprint: Fingerprint of the inputs of the cube
+    :type fingerprint: str
+    """
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    edges = {f"edges_{i}": edge for i, edge in enumerate(cube["edges"])}
+    np.savez(file_path, variables=np.array(cube["variables"]), coords=cube["coords"],
+             sumw=cube["sumw"], sumw2=cube["sumw2"], fingerprint=np.array(fingerprint), **edges)
+
+def load_cube(file_path):
+    """ Read a cube from file.
+
+    :param file_path: Path to the file
+    :type file_path: str
+    :return: Sparse cube, with the fingerprint of its inputs
+    :rtype: dict
+    """
+
+    with np.load(file_path) as data:
+        variables = [str(var) for var in data["variables"]]
+        return {
+            "variables": variables,
+            "edges": [data[f"edges_{i}"] for i in range(len(variables))],
+            "coords": data["coords"],
+            "sumw": data["sumw"],
+            "sumw2": data["sumw2"],
+            "fingerprint": str(data["fingerprint"]),
+        }
+
+def project(cube, axes, cuts=None, rebin=None):
+    """ Project the cube on one or more of its variables.
+    The cuts select the bins entirely inside the given range, so they
+    are exact when the limits are edges of the fine bins.
+
+    :param cube: Sparse cube
+    :type cube: dict
+    :param axes: Names of the variables of the projection
+    :type axes: list(str)
+    :param cuts: Range ``(low, high)`` of some of the variables, ``None`` for no limit
+    :type cuts: dict(str, tuple(float))
+    :param rebin: Number of fine bins merged in each bin of the projection
+    :type rebin: dict(str, int)
+    :raises ValueError: Raised when a number of bins isn't a multiple of the rebinning
+    :return: Sum of the weights, their uncertainty and edges of each axis
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, list(numpy.ndarray))
+    """
+
+    cuts = cuts or {}
+    rebin = rebin or {}
+    coords = cube["coords"]
+    keep = np.ones(len(coords), dtype=bool)
+    for var, (low, high) in cuts.items():
+        axis = cube["variables"].index(var)
+        edges = np.concatenate([[-np.inf], cube["edges"][axis], [np.inf]])
+        # Lower and upper edges of the bins, including underflow and overflow
+        lower, upper = edges[coords[:, axis]], edges[coords[:, axis] + 1]
+        if low is not None:
+            keep &= lower >= low
+        if high is not None:
+            keep &= upper <= high
+
+    axis_idx = [cube["variables"].index(var) for var in axes]
+    shape = [len(cube["edges"][axis]) + 1 for axis in axis_idx]
+    index = tuple(coords[keep][:, axis] for axis in axis_idx)
+    values = np.zeros(shape)
+    variances = np.zeros(shape)
+    np.add.at(values, index, cube["sumw"][keep])
+    np.add.at(variances, index, cube["sumw2"][keep])
+
+    out_edges = []
+    for dim, (var, axis) in enumerate(zip(axes, axis_idx)):
+        factor = rebin.get(var, 1)
+        edges = cube["edges"][axis]
+        n_bins = len(edges) - 1
+        if n_bins % factor:
+            raise ValueError(f"{n_bins} bins of {var} can't be merged in groups of {factor}")
+        if factor > 1:
+            values = _merge_bins(values, dim, factor)
+            variances = _merge_bins(variances, dim, factor)
+        out_edges.append(edges[::factor])
+    return values, np.sqrt(variances), out_edges
+
+def _merge_bins(values, dim, factor):
+    """ Merge groups of adjacent bins along one axis, keeping underflow and overflow.
+    """
+
+    values = np.moveaxis(values, dim, 0)
+    inner = values[1:-1]
+    inner = inner.reshape((len(inner) // factor, factor) + inner.shape[1:]).sum(axis=1)
+    merged = np.concatenate([values[:1], inner, values[-1:]])
+    return np.moveaxis(merged, 0, dim)
+
+def to_histogram(name, values, errors, edges):
+    """ Convert a 1D or 2D projection of the cube to a ROOT histogram.
+
+    :param name: Name of the histogram
+    :type name: str
+    :param values: Sum of the weights in each bin, including underflow and overflow
+    :type values: numpy.ndarray
+    :param errors: Uncertainty of each bin
+    :type errors: numpy.ndarray
+    :param edges: Edges of the bins of each axis
+    :type edges: list(numpy.ndarray)
+    :return: Histogram
+    :rtype: ROOT.TH1D or ROOT.TH2D
+    """
+
+    if len(edges) == 1:
+        histo = ROOT.TH1D(name, name, len(edges[0]) - 1, array("d", edges[0]))
+    else:
+        histo = ROOT.TH2D(name, name, len(edges[0]) - 1, array("d", edges[0]),
+                          len(edges[1]) - 1, array("d", edges[1]))
+    histo.SetDirectory(ROOT.nullptr)
+    for idx in np.ndindex(values.shape):
+        global_bin = histo.GetBin(*[int(i) for i in idx])
+        histo.SetBinContent(global_bin, values[idx])
+        histo.SetBinError(global_bin, errors[idx])
+    histo.SetEntries(values.sum())
+    return histo
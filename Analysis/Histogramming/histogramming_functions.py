@@ -1,8 +1,15 @@
 """ Definitions of the functions used in the histogramming step of the analysis.
 """
 
+from array import array
+
+import numpy as np
 import ROOT
 
+# Arrays storing the contents of the histograms and type of their elements
+HISTOGRAM_ARRAYS = [(ROOT.TArrayD, np.float64), (ROOT.TArrayF, np.float32),
+                    (ROOT.TArrayI, np.int32), (ROOT.TArrayS, np.int16), (ROOT.TArrayC, np.int8)]
+
 
 def book_histogram_1d(rdf, variable, range_):
     """ Book a 1D histogram for a specific variable.
@@ -12,12 +19,16 @@ def book_histogram_1d(rdf, variable, range_):
     :param variable: Name of the variable in the histogram
     :type variable: str
     :param range_: Tuple that contains the number of bins and
-        the lower and upper limits of the histogram
-    :type range_: tuple(int)
+        the lower and upper limits of the histogram, or list of the edges of the bins
+    :type range_: tuple(int) or list(float)
     :return: Generated histogram
     :rtype: ROOT.TH1D
     """
 
+    if isinstance(range_, list):
+        return rdf.Histo1D(ROOT.ROOT.RDF.TH1DModel(variable, variable,\
+                            len(range_) - 1, array("d", range_)),\
+                            variable, "Weight")
     return rdf.Histo1D(ROOT.ROOT.RDF.TH1DModel(variable, variable,\
                         range_[0], range_[1], range_[2]),\
                         variable, "Weight")
@@ -56,4 +67,30 @@ def write_histogram(histo, name):
     """
 
     histo.SetName(name)
-    histo.Write()
+    histo.Write("", ROOT.TObject.kOverwrite)
+
+def histogram_to_numpy(histo):
+    """ Read the content of a histogram in a NumPy array, including
+    the underflow and overflow bins. For a 2D histogram the first
+    index runs over the bins of the y axis and the second over the x axis.
+
+    :param histo: Input histogram
+    :type histo: ROOT.TH1
+    :return: Content of the bins
+    :rtype: numpy.ndarray
+    """
+
+    # The contents are read from the array of the histogram in one go;
+    # the profiles store the sums of the bins, so they are read bin by bin
+    dtype = None
+    if not isinstance(histo, (ROOT.TProfile, ROOT.TProfile2D)):
+        dtype = next((element for base, element in HISTOGRAM_ARRAYS
+                      if isinstance(histo, base)), None)
+    if dtype is not None:
+        contents = np.frombuffer(histo.GetArray(), dtype=dtype,
+                                 count=histo.GetNcells()).astype(np.float64)
+    else:
+        contents = np.array([histo.GetBinContent(i) for i in range(histo.GetNcells())])
+    if histo.GetDimension() == 2:
+        return contents.reshape(histo.GetNbinsY() + 2, histo.GetNbinsX() + 2)
+    return contents
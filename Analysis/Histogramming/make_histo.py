@@ -1,4 +1,20 @@
 """ The histogramming step produces histograms for each variable in each dataset.
+The histograms of all the selections of ``selections_def.py`` are booked
+as filters on the same dataset, so that each skim is read only once.
+The histograms are kept in a persistent store: the manifest
+``Histograms/histogram_manifest.json`` records a fingerprint of the inputs
+of each histogram (dataset, selection, binning and weight), and only the
+histograms that are missing or stale are filled again.
+With ``--partial`` the histograms are written in a partial result, to be
+combined with the others by ``merge_histo.py``.
+With ``--bootstrap N`` the N Poisson bootstrap replicas of each histogram,
+described in ``bootstrap.py``, are filled in the same event loop.
+With ``--binning`` the edges proposed by ``binning.py`` are used in place
+of the binning of ``variables_def.py``.
+With ``--cube`` a sparse N-dimensional histogram of each dataset is also
+filled in the same event loop, as described in ``histogram_cube.py``.
+With ``--inGraphDNN`` the discriminant of the datasets where it isn't stored
+is computed on the fly by the C++ code generated in ``ml_codegen.py``.
 """
 
 import argparse
@@ -10,13 +26,38 @@ import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import cache_tools, dataset_io, set_up
 from Analysis.Definitions.samples_def import SAMPLES
-from Analysis.Definitions.selections_def import SELECTIONS
-from Analysis.Definitions.variables_def import VARIABLES_DICT
-from Analysis.Histogramming import histogramming_functions
+from Analysis.Definitions.selections_def import SELECTION_TREE, SELECTIONS
+from Analysis.Definitions.variables_def import CUBE_VARIABLES, VARIABLES_DICT
+from Analysis.Histogramming import (binning, bootstrap, histogram_cube, histogramming_functions,
+                                    merge_histo)
+from Analysis.Machine_Learning import ml_codegen, ml_selection
 
 
+def histogram_fingerprint(inputs, expression, variable, binning, dnn_expression=None):
+    """ Fingerprint of the inputs of a histogram.
+
+    :param inputs: Fingerprints of the dataset and of the selection mask
+    :type inputs: dict(str, str)
+    :param expression: Filter of the selection, empty for no selection
+    :type expression: str
+    :param variable: Name of the variable
+    :type variable: str
+    :param binning: Number of bins and limits of the histogram, or edges of the bins
+    :type binning: tuple or list(float)
+    :param dnn_expression: Expression computing the discriminant on the fly, if any
+    :type dnn_expression: str
+    :return: Fingerprint of the histogram
+    :rtype: str
+    """
+
+    uses_dnn = bool(expression) or variable == "Discriminant"
+    return cache_tools.make_fingerprint(
+        inputs["events"], inputs["mask"] if expression else None,
+        expression, variable, list(binning), "Weight",
+        dnn_expression if uses_dnn else None)
+
 def make_histo(args, logger):
     """ Main function of the histogramming step.
     The function loops over the outputs from the skimming step and produces the
@@ -47,8 +88,20 @@ def make_histo(args, logger):
     except FileExistsError:
         logger.debug("The directory %s/ already exists", dir_name)
 
+    # The histograms of the previous runs are kept unless all must be filled again
     outfile_path = os.path.join(dir_name, "Histograms.root")
-    outfile = ROOT.TFile(outfile_path, "RECREATE")
+    manifest_path = os.path.join(dir_name, "histogram_manifest.json")
+    if args.partial:
+        outfile_path, manifest_path = merge_histo.partial_paths(args.output, args.partial)
+        os.makedirs(os.path.dirname(outfile_path), exist_ok=True)
+        logger.info("Partial histograms written in %s", outfile_path)
+    if args.force or not os.path.exists(outfile_path):
+        manifest = {}
+        outfile = ROOT.TFile(outfile_path, "RECREATE")
+    else:
+        manifest = cache_tools.load_manifest(manifest_path)
+        outfile = ROOT.TFile(outfile_path, "UPDATE")
+    n_reused = 0
 
     if args.ml :
         var_dict = VARIABLES_DICT["tot"]
@@ -56,60 +109,135 @@ def make_histo(args, logger):
         var_dict = VARIABLES_DICT["angles"]
 
     variables = var_dict.keys()
+    edges = binning.load_binning(args.output, logger) if args.binning else {}
 
-    # Loop over the possible selections
-    for selection, tree_name in SELECTIONS.items():
+    # Compile the DNN to compute the discriminant inside the event loop
+    dnn_expression = None
+    if args.ml and args.inGraphDNN:
+        try:
+            dnn_expression = ml_codegen.declare_model(args.output, logger)
+        except FileNotFoundError as not_found_err:
+            logger.warning("Unable to generate the DNN code %s", not_found_err)
+    thresholds = ml_selection.load_thresholds(args.output, logger) if args.ml else None
+    # Columns from which the variables are read
+    columns = {variable: variable
+               for variable in list(variables) + list(CUBE_VARIABLES) + ["Weight"]}
+    columns["Discriminant"] = ml_codegen.discriminant_column(dnn_expression)
 
-        # Loop through skimmed datasets and final states
-        # to produce histograms of all variables.
-        for sample_name, final_states in SAMPLES.items():
-            # Check if the sample to plot is one of those requested by the user
-            if sample_name not in args.sample and args.sample != "all":
+    # Loop through skimmed datasets and final states
+    # to produce histograms of all variables.
+    for sample_name, final_states in SAMPLES.items():
+        # Check if the sample to plot is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
                 continue
-            for final_state in final_states:
-                # Check if the final state is one of those requested by the user
-                if final_state not in args.finalState and args.finalState != "all":
-                    continue
-                logger.info(">>> Process sample %s and final state %s with %s",
-                            sample_name, final_state, selection)
-
-                start_time = time.time()
-
-                file_name = os.path.join(args.output, "Skim_data",
-                                             f"{sample_name}{final_state}Skim.root")
-
-                # Check if file exists or not
-                try:
-                    if not os.path.exists(file_name):
-                        raise FileNotFoundError
-                    rdf = ROOT.RDataFrame(tree_name, file_name)
-                except FileNotFoundError as not_fund_err:
-                    logger.debug("Sample %s final state %s: File %s can't be found %s",
-                                    sample_name, final_state, file_name,
-                                    not_fund_err,  stack_info=True)
+            logger.info(">>> Process sample %s and final state %s", sample_name, final_state)
+
+            start_time = time.time()
+
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+
+            # Check if file exists or not
+            try:
+                if not os.path.exists(file_name):
+                    raise FileNotFoundError
+                if args.ml:
+                    rdf = ml_selection.open_selection(file_name, thresholds, dnn_expression)
+                else:
+                    rdf = dataset_io.open_dataset("Events", file_name)
+            except FileNotFoundError as not_fund_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_fund_err,  stack_info=True)
+                continue
+
+            inputs = {
+                "events": cache_tools.key_fingerprint(file_name, ["Events"]),
+                "mask": cache_tools.make_fingerprint(
+                    cache_tools.key_fingerprint(file_name, [SELECTION_TREE]), thresholds),
+            }
+
+            if args.bootstrap > 0:
+                seed = bootstrap.bootstrap_seed(sample_name, final_state)
+                rdf = bootstrap.define_replicas(rdf, [columns[var] for var in variables
+                                                      if var != "Weight"
+                                                      and rdf.HasColumn(columns[var])],
+                                                args.bootstrap, seed)
+
+            # Book the missing or stale histograms of all the selections,
+            # which are then filled in a single event loop over the dataset
+            histos = {}
+            fingerprints = {}
+            for selection, expression in SELECTIONS.items():
+                if expression and not rdf.HasColumn("DNNSelectionMask"):
+                    logger.debug("Selection %s isn't available for %s %s",
+                                 selection, sample_name, final_state)
                     continue
+                rdf_selection = rdf.Filter(expression, selection) if expression else rdf
+                for variable in variables:
+                    # Check if the variable to plot is one of those requested by the user
+                    if (variable not in args.variableDistribution and
+                        args.variableDistribution != "all") or variable == "Weight":
+                        continue
+                    name = f"{sample_name}_{final_state}_{variable}_{selection}"
+                    bins = edges.get(variable, var_dict[variable][:3])
+                    fingerprints[name] = histogram_fingerprint(inputs, expression, variable,
+                                                               bins, dnn_expression)
+                    if args.bootstrap > 0:
+                        fingerprints[f"{name}_bootstrap"] = cache_tools.make_fingerprint(
+                            fingerprints[name], args.bootstrap, seed)
+                        if manifest.get(f"{name}_bootstrap") != fingerprints[f"{name}_bootstrap"] \
+                                or not outfile.GetKey(f"{name}_bootstrap"):
+                            histos[f"{name}_bootstrap"] = bootstrap.book_bootstrap(
+                                rdf_selection, columns[variable], bins, args.bootstrap)
+                    if manifest.get(name) == fingerprints[name] and outfile.GetKey(name):
+                        n_reused += 1
+                        continue
+                    histos[name] = histogramming_functions.book_histogram_1d\
+                                            (rdf_selection, columns[variable], bins)
+
+            # Read the variables of the cube in the same event loop of the histograms
+            cube_result = None
+            if args.cube:
+                cube_vars = [var for var in CUBE_VARIABLES if rdf.HasColumn(columns[var])]
+                cube_key = f"cube_{sample_name}_{final_state}"
+                fingerprints[cube_key] = cache_tools.make_fingerprint(
+                    inputs["events"], {var: CUBE_VARIABLES[var] for var in cube_vars},
+                    dnn_expression if "Discriminant" in cube_vars else None)
+                cube_file = histogram_cube.cube_path(args.output, sample_name, final_state)
+                if manifest.get(cube_key) != fingerprints[cube_key] or \
+                        not os.path.exists(cube_file):
+                    cube_result = rdf.AsNumpy([columns[var] for var in cube_vars] + ["Weight"],
+                                              lazy=True)
+
+            # Write the histograms to the output file
+            try:
+                for name, histo in histos.items():
+                    histogramming_functions.write_histogram(histo, name)
+                    manifest[name] = fingerprints[name]
+            except TypeError:
+                logger.debug("Sample %s final state %s is empty", sample_name, final_state)
+
+            if cube_result is not None:
+                arrays = cube_result.GetValue()
+                arrays = {var: arrays[columns[var]] for var in cube_vars + ["Weight"]}
+                histogram_cube.save_cube(histogram_cube.fill_cube(arrays, cube_vars,
+                                                                  arrays["Weight"]),
+                                         cube_file, fingerprints[cube_key])
+                manifest[cube_key] = fingerprints[cube_key]
+                logger.debug("Filled the cube %s", cube_file)
 
-                # Book histograms and write them to output file.
-                histos = {}
-                try:
-                    for variable in variables:
-                        # Check if the variable to plot is one of those requested by the user
-                        if (variable not in args.variableDistribution and
-                            args.variableDistribution != "all") or variable == "Weight":
-                            continue
-                        histos[variable] = histogramming_functions.book_histogram_1d\
-                                                (rdf, variable, var_dict[variable])
-                        histogramming_functions.write_histogram(histos[variable],
-                                            f"{sample_name}_{final_state}_{variable}_{selection}")
-                except TypeError:
-                    logger.debug("Sample %s final state %s is empty", sample_name, final_state)
-
-                logger.info(">>> Execution time for %s %s %s: %s s \n",
-                            selection, sample_name, final_state, (time.time() - start_time))
+            logger.info(">>> Execution time for %s %s: %s s \n",
+                        sample_name, final_state, (time.time() - start_time))
 
+    logger.info(">>> Histograms reused from the previous runs: %s", n_reused)
     logger.info(">>> Total Execution time: %s s \n",(time.time() - start_time_tot))
 
     outfile.Close()
+    cache_tools.save_manifest(manifest_path, manifest)
 
 
 if __name__ == "__main__":
@@ -137,6 +265,22 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--variableDistribution",    default="all", type=str,
                         help="string with comma separated list of the variables to plot. \
                             The complete list is defined in 'variables_def.py'")
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="fills again all the histograms")
+    parser.add_argument("--partial",    default="", type=str,
+                        help="name of the partial result in 'Histograms/Partials' where \
+                            the histograms are written, to be merged by 'merge_histo.py'")
+    parser.add_argument("--bootstrap",   default=0, type=int,
+                        help="number of Poisson bootstrap replicas filled with each histogram")
+    parser.add_argument("--binning",   default=False,   action="store_const",
+                        const=True, help="uses the binning proposed from the quantiles \
+                            of the simulated samples in 'Histograms/binning.json'")
+    parser.add_argument("--cube",   default=False,   action="store_const",
+                        const=True, help="fills a sparse N-dimensional histogram of each \
+                            dataset, from which any projection can be obtained")
+    parser.add_argument("--inGraphDNN",   default=False,   action="store_const",
+                        const=True, help="computes the DNN discriminant inside the \
+                            event loop with generated C++ code instead of storing it")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
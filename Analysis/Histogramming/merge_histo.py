@@ -0,0 +1,182 @@
+""" Merge of the partial results of the histogramming step.
+With ``--partial NAME`` the histogramming step writes the histograms of the
+requested samples and final states in ``Histograms/Partials/NAME.root``, with
+the same names of ``Histograms.root`` and with their own manifest, so that
+shards of the datasets, new run periods or new simulated samples can be
+filled independently, even on different machines.
+This step combines the partial files in the ``Histograms.root`` read by the
+plotting step: the histograms with the same name are summed, which is
+associative, with a tree reduction over the partials taken in alphabetical
+order, so that the result doesn't depend on the order of the inputs.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+import ROOT
+
+sys.path.append(os.path.join("..","..", ""))
+
+from Analysis import cache_tools, set_up
+from Analysis.Histogramming import histogramming_functions
+
+
+def partial_paths(output, partial):
+    """ Paths of the histograms and of the manifest of a partial result.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param partial: Name of the partial result
+    :type partial: str
+    :return: Paths to the ROOT file and to the manifest
+    :rtype: tuple(str, str)
+    """
+
+    dir_name = os.path.join(output, "Histograms", "Partials")
+    return os.path.join(dir_name, f"{partial}.root"), os.path.join(dir_name, f"{partial}.json")
+
+def read_partial(file_name):
+    """ Read in memory all the histograms of a file.
+
+    :param file_name: Path to the file
+    :type file_name: str
+    :raises FileNotFoundError: Raised when the file can't be opened
+    :return: Histograms by name
+    :rtype: dict(str, ROOT.TH1)
+    """
+
+    infile = ROOT.TFile.Open(file_name, "READ")
+    if not infile or infile.IsZombie():
+        raise FileNotFoundError(f"Failed to open {file_name}")
+    histos = {}
+    for key in infile.GetListOfKeys():
+        histo = key.ReadObj()
+        if isinstance(histo, ROOT.TH1):
+            histo.SetDirectory(ROOT.nullptr)
+            histos[key.GetName()] = histo
+    infile.Close()
+    return histos
+
+def merge_pair(first, second):
+    """ Sum two sets of histograms: the histograms with the same name are
+    added, the others are kept as they are.
+
+    :param first: Histograms by name, updated in place
+    :type first: dict(str, ROOT.TH1)
+    :param second: Histograms by name
+    :type second: dict(str, ROOT.TH1)
+    :return: Summed histograms by name
+    :rtype: dict(str, ROOT.TH1)
+    """
+
+    for name, histo in second.items():
+        if name in first:
+            first[name].Add(histo)
+        else:
+            first[name] = histo
+    return first
+
+def tree_reduce(partials):
+    """ Sum the partial results pairwise, level by level, until one is left.
+
+    :param partials: Histograms by name of each partial result
+    :type partials: list(dict(str, ROOT.TH1))
+    :return: Summed histograms by name
+    :rtype: dict(str, ROOT.TH1)
+    """
+
+    if not partials:
+        return {}
+    while len(partials) > 1:
+        partials = [merge_pair(*partials[i:i + 2]) if i + 1 < len(partials) else partials[i]
+                    for i in range(0, len(partials), 2)]
+    return partials[0]
+
+def merge_manifests(manifests):
+    """ Manifest of the merged histograms. The fingerprint of a histogram
+    is kept only if it comes from a single partial result, since a sum
+    doesn't correspond to the inputs of any of them.
+
+    :param manifests: Manifests of the partial results
+    :type manifests: list(dict(str, str))
+    :return: Manifest of the merged histograms
+    :rtype: dict(str, str)
+    """
+
+    counts = {}
+    for manifest in manifests:
+        for name in manifest:
+            counts[name] = counts.get(name, 0) + 1
+    return {name: fingerprint for manifest in manifests
+            for name, fingerprint in manifest.items() if counts[name] == 1}
+
+def merge_histo(args, logger):
+    """ Main function of the merge of the partial results of the histogramming.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    dir_name = os.path.join(args.output, "Histograms")
+    if args.partials:
+        file_names = sorted(partial_paths(args.output, partial)[0]
+                            for partial in args.partials.split(","))
+    else:
+        file_names = sorted(glob.glob(os.path.join(dir_name, "Partials", "*.root")))
+    if not file_names:
+        logger.error("No partial histograms can be found in %s",
+                     os.path.join(dir_name, "Partials"))
+        return
+
+    partials = []
+    manifests = []
+    for file_name in file_names:
+        try:
+            partials.append(read_partial(file_name))
+        except FileNotFoundError as not_found_err:
+            logger.exception("Partial histograms %s can't be read %s", file_name,
+                             not_found_err, stack_info=True)
+            return
+        manifests.append(cache_tools.load_manifest(f"{os.path.splitext(file_name)[0]}.json"))
+        logger.debug("Read %s histograms from %s", len(partials[-1]), file_name)
+
+    histos = tree_reduce(partials)
+
+    outfile = ROOT.TFile(os.path.join(dir_name, "Histograms.root"), "RECREATE")
+    for name in sorted(histos):
+        histogramming_functions.write_histogram(histos[name], name)
+    outfile.Close()
+    cache_tools.save_manifest(os.path.join(dir_name, "histogram_manifest.json"),
+                              merge_manifests(manifests))
+
+    logger.info("Merged %s histograms from %s partial results", len(histos), len(file_names))
+    logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-i", "--partials",    default="", type=str,
+                        help="comma separated list of the partial results to merge, \
+                            all those in 'Histograms/Partials' if empty")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+
+    merge_histo(args_main, logger_main)
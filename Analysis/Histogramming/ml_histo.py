@@ -1,7 +1,8 @@
 """ In this step 2D histograms of Mass 4 leptons VS DNN Discriminant
 are created, one for the combination of all the simulated background,
 one for all the simulated signal and one for each possible final state
-of the data.
+of the data. With ``--inGraphDNN`` the discriminant is computed
+on the fly by the C++ code generated in ``ml_codegen.py``.
 """
 
 import argparse
@@ -13,10 +14,48 @@ import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import dataset_io, set_up
 from Analysis.Definitions.samples_def import SAMPLES
 from Analysis.Histogramming import histogramming_functions
+from Analysis.Machine_Learning import ml_codegen
 
+# Variables and binning of the 2D histograms
+HISTO_VARIABLES = ["Higgs_mass", "Discriminant"]
+RANGES_X = [40, 100., 180.]
+RANGES_Y = [40, -0.03, 1]
+
+
+def histo_variables(dnn_expression=None):
+    """ Columns of the variables of the 2D histograms.
+
+    :param dnn_expression: Expression returned by ``ml_codegen.declare_model``
+        if the discriminant is computed on the fly, or None
+    :type dnn_expression: str
+    :return: Columns of the x and y axes
+    :rtype: list(str)
+    """
+
+    return [HISTO_VARIABLES[0], ml_codegen.discriminant_column(dnn_expression)]
+
+def dataset_group(sample_name, final_state):
+    """ Group of datasets to which a sample and final state contribute.
+
+    :param sample_name: Name of the sample
+    :type sample_name: str
+    :param final_state: Final state of the sample
+    :type final_state: str
+    :return: Name of the group, or None if the sample doesn't belong to any
+    :rtype: str
+    """
+
+    if sample_name.startswith("SM"):
+        return "signal"
+    if sample_name.startswith("ZZ"):
+        return "background"
+    if sample_name.startswith("Run"):
+        return {"FourElectrons": "data_el", "FourMuons": "data_mu",
+                "TwoMuonsTwoElectrons": "data_elmu"}.get(final_state)
+    return None
 
 def ml_histo(args, logger):
     """The function produces the 2D histograms of Mass 4 leptons VS DNN Discriminant.
@@ -48,11 +87,13 @@ def ml_histo(args, logger):
     outfile_path = os.path.join(dir_name, "Histograms_discriminant.root")
     outfile = ROOT.TFile(outfile_path, "RECREATE")
 
-    sig_chain= ROOT.TChain("Events")
-    bkg_chain= ROOT.TChain("Events")
-    data_el_chain= ROOT.TChain("Events")
-    data_mu_chain= ROOT.TChain("Events")
-    data_elmu_chain= ROOT.TChain("Events")
+    files = {
+        "signal" : [],
+        "background" : [],
+        "data_el" : [],
+        "data_mu" : [],
+        "data_elmu" : []
+    }
 
     for sample_name, final_states in SAMPLES.items():
         # Check if the sample to plot is one of those requested by the user
@@ -65,8 +106,7 @@ def ml_histo(args, logger):
             logger.info(">>> Process sample %s and final state %s", sample_name, final_state)
 
             # Get the input file name
-            file_name = os.path.join(args.output, "Skim_data",
-                                     f"{sample_name}{final_state}Skim.root")
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
 
             # Check if file exists or not
             try:
@@ -77,45 +117,32 @@ def ml_histo(args, logger):
                                 sample_name, final_state, file_name, not_fund_err,  stack_info=True)
                 continue
 
-            if sample_name.startswith("SM"):
-                sig_chain.Add(file_name)
-
-            elif sample_name.startswith("ZZ"):
-                bkg_chain.Add(file_name)
-
-            elif sample_name.startswith("Run"):
-                if final_state == "FourElectrons":
-                    data_el_chain.Add(file_name)
-                elif final_state == "FourMuons":
-                    data_mu_chain.Add(file_name)
-                elif final_state == "TwoMuonsTwoElectrons":
-                    data_elmu_chain.Add(file_name)
-
-    sig_rdf = ROOT.ROOT.RDataFrame(sig_chain)
-    bkg_rdf = ROOT.RDataFrame(bkg_chain)
-    data_el_rdf = ROOT.RDataFrame(data_el_chain)
-    data_mu_rdf = ROOT.RDataFrame(data_mu_chain)
-    data_elmu_rdf = ROOT.RDataFrame(data_elmu_chain)
-
-    rdfs = {
-        "signal" : sig_rdf,
-        "background" : bkg_rdf,
-        "data_el" : data_el_rdf,
-        "data_mu" : data_mu_rdf,
-        "data_elmu" :  data_elmu_rdf
-    }
+            group = dataset_group(sample_name, final_state)
+            if group is not None:
+                files[group].append(file_name)
+
+    # Compile the DNN to compute the discriminant inside the event loop
+    dnn_expression = None
+    if args.inGraphDNN:
+        try:
+            dnn_expression = ml_codegen.declare_model(args.output, logger)
+        except FileNotFoundError as not_found_err:
+            logger.exception("Unable to generate the DNN code %s", not_found_err, stack_info=True)
+            logger.exception("Exit the program")
+            outfile.Close()
+            return
 
     histos = {}
-    variables = ["Higgs_mass", "Discriminant"]
-    ranges_x = [40, 100., 180.]
-    ranges_y = [40, -0.03, 1]
-    for dataset, rdf in rdfs.items():
+    for dataset, file_names in files.items():
         logger.info(">>> Process sample: %s", dataset)
         try:
+            rdf = dataset_io.open_dataset("Events", file_names)
+            if args.inGraphDNN:
+                rdf = ml_codegen.define_discriminant(rdf, dnn_expression)
             histos[dataset] = histogramming_functions.book_histogram_2d(dataset,
-                                                    rdf, variables, ranges_x, ranges_y)
+                                    rdf, histo_variables(dnn_expression), RANGES_X, RANGES_Y)
             histogramming_functions.write_histogram(histos[dataset], dataset)
-        except TypeError:
+        except (TypeError, FileNotFoundError):
             logger.debug("Dataset %s is empty", dataset)
 
     outfile.Close()
@@ -143,6 +170,9 @@ if __name__ == "__main__":
                         help="string with comma separated list of samples to analyse: \
                         Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
                         Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("--inGraphDNN",   default=False,   action="store_const",
+                        const=True, help="computes the DNN discriminant inside the \
+                            event loop with generated C++ code instead of storing it")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
@@ -0,0 +1,251 @@
+""" Generation of C++ inference code for the trained DNN, in the spirit
+of TMVA SOFIE. The model exported by ``ml_export.py`` is turned into a
+header with an inline ``float dnnScore(...)`` function, which applies the
+TMVA input transformations and the dense layers. The function is compiled
+by the ROOT interpreter, so that the discriminant can be computed inside
+the RDataFrame event loop with a ``Define``, also with implicit multi-threading,
+instead of being stored in the skimmed datasets by ``ml_evaluation.py``.
+After a k-fold training, ``dnnScore`` dispatches each event to the model
+of the fold it belongs to.
+"""
+
+import os
+
+import ROOT
+
+from Analysis import cache_tools
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES
+from Analysis.Machine_Learning import ml_inference, ml_kfold
+
+# Namespaces of the models already compiled by the interpreter
+_DECLARED = set()
+
+# Column of the discriminant computed inside the event loop. It differs from the
+# stored ``Discriminant``, which can't be redefined before ROOT 6.26
+INGRAPH_COLUMN = "DiscriminantInGraph"
+
+# Activations of the hidden layers in C++
+CPP_ACTIVATIONS = {
+    "relu": "std::max(sum, 0.)",
+    "sigmoid": "1. / (1. + std::exp(-sum))",
+    "tanh": "std::tanh(sum)",
+    "linear": "sum",
+}
+
+
+def cpp_array(values):
+    """ Write an array as a C++ initializer list.
+
+    :param values: Array to be written
+    :type values: numpy.ndarray
+    :return: C++ initializer list
+    :rtype: str
+    """
+
+    if values.ndim > 1:
+        return "{" + ", ".join(cpp_array(row) for row in values) + "}"
+    return "{" + ", ".join(repr(float(value)) for value in values) + "}"
+
+def generate_code(model, namespace):
+    """ Generate the C++ code computing the discriminant of the DNN.
+
+    :param model: Parameters of the model, as returned by ``ml_inference.load_model``
+    :type model: dict
+    :param namespace: Namespace containing the generated code
+    :type namespace: str
+    :raises ValueError: Raised when the model can't be translated in C++
+    :return: C++ code
+    :rtype: str
+    """
+
+    n_vars = len(model["variables"])
+    lines = [
+        "// Generated by ml_codegen.py from dnn_model.npz: do not edit",
+        f"#ifndef {namespace.upper()}_H",
+        f"#define {namespace.upper()}_H",
+        "",
+        "#include <algorithm>",
+        "#include <cmath>",
+        "",
+        '#include "TMath.h"',
+        "",
+        f"namespace {namespace} {{",
+        "",
+        f"constexpr double kDecorr[{n_vars}][{n_vars}] = {cpp_array(model['decorr'])};",
+    ]
+    for i, (x_points, y_points) in enumerate(model["cdf"]):
+        lines.append(f"constexpr double kCdfX{i}[{len(x_points)}] = {cpp_array(x_points)};")
+        lines.append(f"constexpr double kCdfY{i}[{len(y_points)}] = {cpp_array(y_points)};")
+    for i, (kernel, bias, _) in enumerate(model["layers"]):
+        lines.append(f"constexpr double kKernel{i}[{kernel.shape[0]}][{kernel.shape[1]}] = "
+                     f"{cpp_array(kernel)};")
+        lines.append(f"constexpr double kBias{i}[{len(bias)}] = {cpp_array(bias)};")
+
+    lines += [
+        "",
+        "// Gaussianisation of TMVA: linear interpolation of the cumulative",
+        "// distribution followed by the inverse of the Gaussian one",
+        "inline double gauss(double x, const double *xs, const double *ys, int n) {",
+        "    int idx = std::lower_bound(xs, xs + n, x) - xs - 1;",
+        "    idx = std::min(std::max(idx, 0), n - 2);",
+        "    double cumulant = ys[idx] + (ys[idx + 1] - ys[idx]) / (xs[idx + 1] - xs[idx]) * (x - xs[idx]);",
+        f"    double arg = std::min(std::max(2. * cumulant - 1., -{ml_inference.MAX_ERFINV_ARG}), "
+        f"{ml_inference.MAX_ERFINV_ARG});",
+        "    return std::sqrt(2.) * TMath::ErfInverse(arg);",
+        "}",
+        "",
+        "inline float dnnScore(" + ", ".join(f"float {var}" for var in model["variables"]) + ") {",
+        f"    const double in[{n_vars}] = {{" + ", ".join(model["variables"]) + "};",
+        f"    double x0[{n_vars}];",
+        f"    for (int i = 0; i < {n_vars}; ++i) {{",
+        "        double sum = 0.;",
+        f"        for (int j = 0; j < {n_vars}; ++j) sum += kDecorr[i][j] * in[j];",
+        "        x0[i] = sum;",
+        "    }",
+    ]
+    for i, (x_points, _) in enumerate(model["cdf"]):
+        lines.append(f"    x0[{i}] = gauss(x0[{i}], kCdfX{i}, kCdfY{i}, {len(x_points)});")
+
+    n_layers = len(model["layers"])
+    for i, (kernel, _, act) in enumerate(model["layers"]):
+        n_in, n_out = kernel.shape
+        last = i == n_layers - 1
+        if last and act != "softmax":
+            raise ValueError(f"The output layer must be a softmax, not {act}")
+        if not last and act not in CPP_ACTIVATIONS:
+            raise ValueError(f"Activation {act} is not supported")
+        lines += [
+            f"    double x{i + 1}[{n_out}];",
+            f"    for (int j = 0; j < {n_out}; ++j) {{",
+            f"        double sum = kBias{i}[j];",
+            f"        for (int k = 0; k < {n_in}; ++k) sum += x{i}[k] * kKernel{i}[k][j];",
+            f"        x{i + 1}[j] = {'sum' if last else CPP_ACTIVATIONS[act]};",
+            "    }",
+        ]
+
+    # The discriminant is the softmax output of the signal node
+    lines += [
+        f"    double max = *std::max_element(x{n_layers}, x{n_layers} + {n_out});",
+        "    double norm = 0.;",
+        f"    for (int j = 0; j < {n_out}; ++j) norm += std::exp(x{n_layers}[j] - max);",
+        f"    return std::exp(x{n_layers}[0] - max) / norm;",
+        "}",
+        "",
+        f"}} // namespace {namespace}",
+        "",
+        "#endif",
+        "",
+    ]
+    return "\n".join(lines)
+
+def generate_fold_code(models, namespace):
+    """ Generate the C++ code computing the discriminant of a k-fold
+    training, where each event is scored by the model of its fold.
+
+    :param models: Parameters of the model of each fold
+    :type models: list(dict)
+    :param namespace: Namespace containing the generated code
+    :type namespace: str
+    :return: C++ code and names of the arguments of ``dnnScore``
+    :rtype: tuple(str, list(str))
+    """
+
+    variables = models[0]["variables"]
+    arguments = variables + [var for var in KFOLD_VARIABLES if var not in variables]
+
+    code = [ml_kfold.FOLD_INDEX_CODE]
+    code += [generate_code(model, f"{namespace}_fold{fold}") for fold, model in enumerate(models)]
+    code += [
+        f"namespace {namespace} {{",
+        "",
+        "inline float dnnScore(" + ", ".join(f"float {var}" for var in arguments) + ") {",
+        f"    switch (kfoldIndex({', '.join(KFOLD_VARIABLES)}, {len(models)})) {{",
+    ]
+    for fold in range(len(models)):
+        code.append(f"        case {fold}: return {namespace}_fold{fold}::dnnScore("
+                    f"{', '.join(variables)});")
+    code += [
+        "    }",
+        "    return -1.;",
+        "}",
+        "",
+        f"}} // namespace {namespace}",
+        "",
+    ]
+    return "\n".join(code), arguments
+
+def declare_model(output, log):
+    """ Generate the header ``ML_output/dnn_score.h`` from the exported
+    DNN and compile it with the ROOT interpreter. Each model gets its own
+    namespace, so that a new model can be declared in the same session.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :raises FileNotFoundError: Raised when the DNN hasn't been exported
+    :return: Expression computing the discriminant
+    :rtype: str
+    """
+
+    folds = ml_kfold.load_folds(output)
+    if folds is not None:
+        model_paths = [os.path.join(ml_kfold.folds_dir(output), f"fold{fold}", "dnn_model.npz")
+                       for fold in range(folds["k_folds"])]
+    else:
+        model_paths = [os.path.join(output, "ML_output", "dnn_model.npz")]
+    for model_path in model_paths:
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"The exported DNN {model_path} can't be found")
+
+    models = [ml_inference.load_model(model_path) for model_path in model_paths]
+    namespace = "dnn_" + cache_tools.make_fingerprint(
+        [cache_tools.file_checksum(model_path) for model_path in model_paths])[:12]
+    if folds is not None:
+        code, arguments = generate_fold_code(models, namespace)
+    else:
+        code, arguments = generate_code(models[0], namespace), models[0]["variables"]
+
+    header_path = os.path.join(output, "ML_output", "dnn_score.h")
+    try:
+        with open(header_path, "r", encoding="utf8") as file:
+            up_to_date = file.read() == code
+    except FileNotFoundError:
+        up_to_date = False
+    if not up_to_date:
+        with open(header_path, "w", encoding="utf8") as file:
+            file.write(code)
+        log.debug("Generated %s", header_path)
+
+    if namespace not in _DECLARED:
+        ROOT.gInterpreter.Declare(code)
+        _DECLARED.add(namespace)
+        log.debug("Compiled the DNN in the namespace %s", namespace)
+
+    return f"{namespace}::dnnScore({', '.join(arguments)})"
+
+def define_discriminant(rdf, expression):
+    """ Compute the discriminant of the DNN inside the event loop, in the
+    column ``INGRAPH_COLUMN``, next to the ``Discriminant`` possibly stored in the dataset.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :param expression: Expression returned by ``declare_model``
+    :type expression: str
+    :return: RDataFrame with the ``INGRAPH_COLUMN`` column
+    :rtype: ROOT.RDataFrame
+    """
+
+    return rdf.Define(INGRAPH_COLUMN, expression)
+
+def discriminant_column(expression):
+    """ Column from which the discriminant is read.
+
+    :param expression: Expression returned by ``declare_model``,
+        or None if the discriminant stored in the dataset is used
+    :type expression: str
+    :return: Name of the column
+    :rtype: str
+    """
+
+    return INGRAPH_COLUMN if expression is not None else "Discriminant"
@@ -1,21 +1,40 @@
 """ In this step the trained DNN is evaluated on the various datasets
 and the resulting discriminant is saved in a new branch of the TTree.
+By default the DNN is evaluated with the NumPy runtime of ``ml_inference.py``,
+which doesn't need to load Keras, while the TMVA reader can still be
+used with ``--inferenceEngine tmva``. After a k-fold training each event
+is scored by the model of the fold it belongs to, which hasn't seen it.
+The skims are evaluated concurrently by a pool of ``--nWorkers`` worker
+processes, each of which loads the model once and scores whole files.
+The manifest ``ML_output/score_manifest.json`` records, for each skim, the
+fingerprint of the model and of the dataset of its last evaluation, so
+that only the new or changed skims are evaluated again.
 """
 
 
 import argparse
+import logging
+import multiprocessing
 import os
 import sys
 import time
 from array import array
 
+import numpy as np
 import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import cache_tools, dataset_io, parallel_tools, set_up
 from Analysis.Definitions.samples_def import SAMPLES
-from Analysis.Definitions.variables_ml_def import VARIABLES_ML_DICT
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES, VARIABLES_ML_DICT
+from Analysis.Machine_Learning import ml_export, ml_inference, ml_kfold
+
+# Maximum difference allowed between the NumPy runtime and the TMVA reader
+INFERENCE_TOLERANCE = 1e-4
+
+# Model and reader loaded by the worker process
+_WORKER = {}
 
 
 def modify_weights_file(output, file_path, log):
@@ -45,56 +64,432 @@ def modify_weights_file(output, file_path, log):
 
     log.debug("Path changed correctly")
 
-def ml_evaluation(args, logger):
-    """ Main function that evaluates the DNN on the whole dataset.
+def book_reader(output, variables, branches, log, update_paths=True):
+    """ Set up the TMVA reader with the trained PyKeras method.
 
-    :param args: Global configuration of the analysis.
-    :type args: argparse.Namespace
-    :param logger: Configured logger for printing messages.
-    :type logger: logging.RootLogger
+    :param output: Path to the output folder
+    :type output: str
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param branches: Dictionary filled with the arrays read by the reader,
+        which must be kept alive as long as the reader is used
+    :type branches: dict
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :param update_paths: Whether the paths to the model in the weights file are updated
+    :type update_paths: bool
+    :return: TMVA reader, or None if the weights can't be found
+    :rtype: ROOT.TMVA.Reader
     """
 
-    logger.info(">>> Executing %s \n", os.path.basename(__file__))
-
-    start_time_tot = time.time()
-
-    # Enable multi-threading
-    if args.parallel:
-        ROOT.ROOT.EnableImplicitMT()
-        thread_size = ROOT.ROOT.GetThreadPoolSize()
-        logger.info(">>> Thread pool size for parallel processing: %s", thread_size)
-
-    # Setup TMVA
     ROOT.TMVA.Tools.Instance()
     ROOT.TMVA.PyMethodBase.PyInitialize()
     reader = ROOT.TMVA.Reader("Color:Silent:!V")
 
-    # Variables used in the ML algorithm
-    variables=VARIABLES_ML_DICT[args.MLVariables]
-
-    branches = {}
     for branch_name in variables:
-        logger.debug(branch_name)
+        log.debug(branch_name)
         branches[branch_name] = array("f", [-999])
         reader.AddVariable(branch_name, branches[branch_name])
 
-    weights_path=os.path.join(args.output, "ML_output", "dataset",
+    weights_path=os.path.join(output, "ML_output", "dataset",
                 "weights", "TMVAClassification_PyKeras.weights.xml")
 
     try:
-        modify_weights_file(args.output, weights_path, logger)
+        if update_paths:
+            modify_weights_file(output, weights_path, log)
+        elif not os.path.exists(weights_path):
+            raise FileNotFoundError(weights_path)
     except FileNotFoundError as weights_err:
-        logger.exception("Unable too open weights %s",
+        log.exception("Unable too open weights %s",
                         weights_err, stack_info=True)
-        logger.exception("Exit the program")
-        return
+        return None
+
+    # Book methods
+    reader.BookMVA("PyKeras", ROOT.TString(weights_path))
+    return reader
+
+def load_numpy_model(output, variables, log):
+    """ Load the DNN exported for the NumPy runtime. The model is
+    exported again if it is missing or older than the TMVA weights.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :return: Parameters of the model, or None if it can't be exported
+    :rtype: dict
+    """
+
+    model_path = os.path.join(output, "ML_output", "dnn_model.npz")
+    weights_path = os.path.join(output, "ML_output", "dataset",
+                "weights", "TMVAClassification_PyKeras.weights.xml")
+
+    try:
+        if not os.path.exists(model_path) or \
+                os.path.getmtime(model_path) < os.path.getmtime(weights_path):
+            ml_export.export_model(os.path.join(output, "ML_output"), variables, log)
+        model = ml_inference.load_model(model_path)
+        if model["variables"] != list(variables):
+            model_path = ml_export.export_model(os.path.join(output, "ML_output"), variables, log)
+            model = ml_inference.load_model(model_path)
+    except (OSError, KeyError, RuntimeError) as export_err:
+        log.exception("Unable to export the DNN %s", export_err, stack_info=True)
+        return None
+
+    return model
+
+def validate_inference(reader, model, arrays, log, n_events=1000):
+    """ Compare the discriminant computed by the NumPy runtime with
+    the one of the TMVA reader on the first events of a dataset.
+
+    :param reader: TMVA reader with the booked PyKeras method
+    :type reader: ROOT.TMVA.Reader
+    :param model: Parameters of the model
+    :type model: dict
+    :param arrays: Columns of the dataset, including ``Discriminant``
+    :type arrays: dict(str, numpy.ndarray)
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :param n_events: Number of events compared
+    :type n_events: int
+    :return: Maximum absolute difference between the two discriminants
+    :rtype: float
+    """
+
+    n_events = min(n_events, len(arrays["Discriminant"]))
+    max_diff = 0.
+    for i in range(n_events):
+        discr_tmva = reader.EvaluateMVA([float(arrays[var][i])
+                                         for var in model["variables"]], "PyKeras")
+        max_diff = max(max_diff, abs(discr_tmva - float(arrays["Discriminant"][i])))
+
+    if max_diff > INFERENCE_TOLERANCE:
+        log.warning("ATTENTION: the NumPy runtime differs from the TMVA reader by %s", max_diff)
+    else:
+        log.info("NumPy runtime compatible with the TMVA reader: maximum difference %s "
+                 "on %s events", max_diff, n_events)
+    return max_diff
+
+def read_columns(file_path, columns=None):
+    """ Read in memory some columns of the skimmed dataset,
+    except for the discriminant of a previous evaluation.
+
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param columns: Names of the columns to be read, all of them if None
+    :type columns: list(str)
+    :return: Columns of the dataset
+    :rtype: dict(str, numpy.ndarray)
+    """
+
+    rdf = dataset_io.open_dataset("Events", file_path)
+    if columns is None:
+        columns = [str(col) for col in rdf.GetColumnNames() if str(col) != "Discriminant"]
+    return {key: np.asarray(value) for key, value in rdf.AsNumpy(list(columns)).items()}
+
+def write_columns(arrays, file_path, log):
+    """ Write again a skimmed dataset stored as RNTuple with the additional
+    ``Discriminant`` column, since an RNTuple can't be updated in place.
+    The new file replaces the old one only once it has been
+    completely written; the selections of a previous run are
+    dropped and are produced again by the selection step.
+
+    :param arrays: Columns of the dataset, including ``Discriminant``
+    :type arrays: dict(str, numpy.ndarray)
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    tmp_path = f"{file_path}.tmp"
+    dataset_io.write_dataset("rntuple", dataset_io.numpy_dataframe(arrays),
+                             "Events", tmp_path, arrays.keys())
+    os.replace(tmp_path, file_path)
+    log.debug("Created column Discriminant")
+
+def write_branch(discr, file_path, log):
+    """ Add the ``Discriminant`` branch to a copy of the skimmed TTree in the
+    same file, leaving the other objects of the file untouched.
+
+    :param discr: Discriminant of each event
+    :type discr: numpy.ndarray
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    in_file = ROOT.TFile(file_path,"UPDATE")
+    tree = in_file.Get("Events")
+
+    if tree.GetListOfBranches().FindObject("Discriminant"):
+        log.debug("Found preexisting branch Discriminant")
+        tree.SetBranchStatus("Discriminant", 0)
+
+    new_tree = tree.CloneTree()
+    discr_array = array("f", [-999])
+    branch = new_tree.Branch("Discriminant", discr_array, "Discriminant/F")
+    for value in discr:
+        discr_array[0] = value
+        branch.Fill()
+    log.debug("Created branch Discriminant")
+
+    new_tree.Write("", ROOT.TObject.kOverwrite)
+    in_file.Close()
+
+def evaluate_numpy(models, file_path, log, reader=None):
+    """ Evaluate the DNN on a dataset with the NumPy runtime,
+    scoring all the events at once.
+
+    :param models: Parameters of the model, or of the model of each fold
+    :type models: list(dict)
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :param reader: TMVA reader used to validate the result, if any
+    :type reader: ROOT.TMVA.Reader
+    """
+
+    storage = dataset_io.dataset_format(file_path, "Events")
+    # The whole dataset is needed only to write an RNTuple again
+    columns = None
+    if storage != "rntuple":
+        columns = list(dict.fromkeys([var for model in models for var in model["variables"]]
+                                     + (KFOLD_VARIABLES if len(models) > 1 else [])))
+    arrays = read_columns(file_path, columns)
+    if len(models) > 1:
+        arrays["Discriminant"] = ml_kfold.score_folds(models, arrays)
+    else:
+        arrays["Discriminant"] = ml_inference.score(models[0], arrays)
+    log.info(f"Processed {len(arrays['Discriminant'])} events in {file_path} \n")
+
+    if reader is not None:
+        validate_inference(reader, models[0], arrays, log)
+
+    if storage == "rntuple":
+        write_columns(arrays, file_path, log)
+    else:
+        write_branch(arrays["Discriminant"], file_path, log)
+
+def evaluate_rntuple(reader, variables, file_path, log):
+    """ Evaluate the DNN with the TMVA reader on a dataset stored as RNTuple.
+    Since an RNTuple can't be updated in place, the columns are read in memory and
+    the dataset is written again with the additional ``Discriminant`` column.
+
+    :param reader: TMVA reader with the booked PyKeras method
+    :type reader: ROOT.TMVA.Reader
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    arrays = read_columns(file_path)
+
+    n_entries = len(next(iter(arrays.values()))) if arrays else 0
+    discr = np.empty(n_entries, dtype=np.float32)
+    for i in range(n_entries):
+        discr[i] = reader.EvaluateMVA([float(arrays[var][i]) for var in variables], "PyKeras")
+        if i % 300 == 0:
+            log.info(f"Processed {i} events out of {n_entries} in {file_path} \n")
+    arrays["Discriminant"] = discr
+
+    write_columns(arrays, file_path, log)
+
+def evaluate_ttree(reader, variables, file_path, log):
+    """ Evaluate the DNN with the TMVA reader on a dataset stored as TTree,
+    adding the ``Discriminant`` branch to a copy of the tree in the same file.
+
+    :param reader: TMVA reader with the booked PyKeras method
+    :type reader: ROOT.TMVA.Reader
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    in_file = ROOT.TFile(file_path,"UPDATE")
+    tree = in_file.Get("Events")
+
+    br_discr = tree.GetListOfBranches().FindObject("Discriminant")
+    if br_discr:
+        log.debug("Found preexisting branch Discriminant")
+        tree.SetBranchStatus("Discriminant", 0)
+        log.debug("Preexisting branch Discriminant deactivated")
+
+    new_tree = tree.CloneTree()
+
+    discr_array = array("f", [-999])
+    branch = new_tree.Branch("Discriminant", discr_array, "Discriminant/F")
+    log.debug("Created branch Discriminant")
+
+    n_entries = tree.GetEntries()
+    for i in range(n_entries):
+        new_tree.GetEntry(i)
+        discr_array[0] = reader.EvaluateMVA([getattr(new_tree, var) for var in variables],
+                                            "PyKeras")
+        branch.Fill()
+        if i % 300 == 0:
+            log.info(f"Processed {i} events out of {n_entries} in {file_path} \n")
+
+    new_tree.Write("", ROOT.TObject.kOverwrite)
+    in_file.Close()
+
+def model_fingerprint(output, engine, folds):
+    """ Fingerprint of the model used to evaluate the datasets.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param engine: Engine used to evaluate the DNN: ``numpy`` or ``tmva``
+    :type engine: str
+    :param folds: Description of the folds, or None
+    :type folds: dict
+    :return: Fingerprint of the model
+    :rtype: str
+    """
+
+    ml_dir = os.path.join(output, "ML_output")
+    if folds is not None:
+        model_files = [os.path.join(ml_kfold.folds_dir(output), f"fold{fold}", "dnn_model.npz")
+                       for fold in range(folds["k_folds"])]
+    elif engine == "numpy":
+        model_files = [os.path.join(ml_dir, "dnn_model.npz")]
+    else:
+        model_files = [os.path.join(ml_dir, "dataset", "weights", name) for name in
+                       ["TMVAClassification_PyKeras.weights.xml", "TrainedModel_PyKeras.h5"]]
+    return cache_tools.make_fingerprint(engine, [cache_tools.file_checksum(model_file)
+                                                 for model_file in model_files])
+
+def score_fingerprint(file_path, variables):
+    """ Fingerprint of the variables and of the discriminant of an evaluated dataset.
+    The other datasets added to the file, e.g. by the selection step, don't change it.
+
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :return: Fingerprint of the dataset, or None if it hasn't been evaluated
+    :rtype: str
+    """
+
+    if not dataset_io.open_dataset("Events", file_path).HasColumn("Discriminant"):
+        return None
+    columns = list(dict.fromkeys(list(variables) + KFOLD_VARIABLES + ["Discriminant"]))
+    return cache_tools.dataset_fingerprint(file_path, "Events", columns)
+
+def init_worker(config):
+    """ Load the model, and the TMVA reader if needed, in the process
+    that evaluates the datasets.
+
+    :param config: Output folder, variables, inference engine, folds, validation,
+        number of threads and logging level
+    :type config: dict
+    """
+
+    logging.basicConfig( format="\n%(asctime)s - %(filename)s - %(message)s")
+    log = logging.getLogger()
+    log.setLevel(config["log_level"])
+
+    # The discriminant is written back by position, so the columns must be
+    # read in the order of the entries, which isn't guaranteed by the
+    # implicit multi-threading; the threads are left to the inference
+    ROOT.ROOT.DisableImplicitMT()
+
+    branches = {}
+    reader = None
+    if config["engine"] == "tmva" or config["validate"]:
+        reader = book_reader(config["output"], config["variables"], branches, log,
+                             update_paths=False)
+
+    models = None
+    if config["engine"] == "numpy" and config["folds"] is not None:
+        models = ml_kfold.load_fold_models(config["output"], config["folds"])
+    elif config["engine"] == "numpy":
+        models = [ml_inference.load_model(os.path.join(config["output"], "ML_output",
+                                                       "dnn_model.npz"))]
+
+    _WORKER.update(log=log, reader=reader, branches=branches, models=models,
+                   variables=config["variables"])
+
+def evaluate_file(file_path):
+    """ Evaluate the DNN on a skimmed dataset with the model loaded by ``init_worker``.
+
+    :param file_path: Path to the skimmed file
+    :type file_path: str
+    :return: Path to the file, fingerprint of the evaluated dataset and execution time
+    :rtype: dict
+    """
+
+    start_time = time.time()
+    log, reader, variables = _WORKER["log"], _WORKER["reader"], _WORKER["variables"]
+
+    if _WORKER["models"] is not None:
+        evaluate_numpy(_WORKER["models"], file_path, log, reader)
+    elif dataset_io.dataset_format(file_path, "Events") == "rntuple":
+        evaluate_rntuple(reader, variables, file_path, log)
     else:
-        # Book methods
-        reader.BookMVA("PyKeras", ROOT.TString(weights_path))
+        evaluate_ttree(reader, variables, file_path, log)
+
+    return {"file": file_path, "dataset": score_fingerprint(file_path, variables),
+            "time": time.time() - start_time}
+
+def ml_evaluation(args, logger):
+    """ Main function that evaluates the DNN on the whole dataset.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
 
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time_tot = time.time()
 
-    # Define a counter
-    j=1
+    # Variables used in the ML algorithm
+    variables=VARIABLES_ML_DICT[args.MLVariables]
+
+    # After a k-fold training only the NumPy runtime can select the model of each fold
+    folds = ml_kfold.load_folds(args.output)
+    if folds is not None and (args.inferenceEngine == "tmva" or args.validateInference):
+        logger.warning("ATTENTION: the DNN was trained with %s folds, which are "
+                       "evaluated only with the NumPy runtime", folds["k_folds"])
+        args.inferenceEngine = "numpy"
+        args.validateInference = False
+
+    # Prepare the files of the model once, before they are read by the workers
+    if args.inferenceEngine == "tmva" or args.validateInference:
+        try:
+            modify_weights_file(args.output, os.path.join(args.output, "ML_output", "dataset",
+                                "weights", "TMVAClassification_PyKeras.weights.xml"), logger)
+        except FileNotFoundError as weights_err:
+            logger.exception("Unable too open weights %s", weights_err, stack_info=True)
+            logger.exception("Exit the program")
+            return
+    if args.inferenceEngine == "numpy" and folds is None:
+        if load_numpy_model(args.output, variables, logger) is None:
+            logger.exception("Exit the program")
+            return
+
+    # Skims evaluated with the same model in a previous run are reused
+    try:
+        model_fp = model_fingerprint(args.output, args.inferenceEngine, folds)
+    except FileNotFoundError as not_found_err:
+        logger.warning("Unable to fingerprint the DNN, all the skims are evaluated %s",
+                       not_found_err)
+        model_fp = None
+    manifest_path = os.path.join(args.output, "ML_output", "score_manifest.json")
+    manifest = cache_tools.load_manifest(manifest_path)
+    reused = []
+    file_paths = []
 
     # Loop over the various samples
     for sample_name, final_states in SAMPLES.items():
@@ -107,13 +502,9 @@ def ml_evaluation(args, logger):
             if final_state not in args.finalState and args.finalState != "all":
                 continue
 
-            logger.info(">>> Process sample: %s and final state %s", sample_name, final_state)
-            start_time = time.time()
-
             # Check if file exists or not
             try:
-                in_file_path=os.path.join(args.output,
-                                "Skim_data", f"{sample_name}{final_state}Skim.root")
+                in_file_path=dataset_io.skim_path(args.output, sample_name, final_state)
                 if not os.path.exists(in_file_path):
                     raise FileNotFoundError
             except FileNotFoundError as not_found_err:
@@ -122,48 +513,58 @@ def ml_evaluation(args, logger):
                                 in_file_path, not_found_err,  stack_info=True)
                 continue
 
-            in_file = ROOT.TFile(in_file_path,"UPDATE")
-            tree = in_file.Get("Events")
-
-            br_discr = tree.GetListOfBranches().FindObject("Discriminant")
-            if br_discr:
-                logger.debug("Found preexisting branch Discriminant")
-                tree.SetBranchStatus("Discriminant", 0)
-                logger.debug("Preexisting branch Discriminant deactivated")
-
-
-            new_tree = tree.CloneTree()
-
-            discr_array = array("f", [-999])
-            branch = new_tree.Branch("Discriminant", discr_array, "Discriminant/F")
-            logger.debug("Created branch Discriminant")
-
-            n_entries = tree.GetEntries()
-            for i in range(n_entries):
-                new_tree.GetEntry(i)
-
-                if args.MLVariables == "tot":
-                    discr_array[0] = reader.EvaluateMVA([new_tree.Z1_mass,
-                                        new_tree.Z2_mass, new_tree.cos_theta_star,
-                                        new_tree.Phi, new_tree.Phi1, new_tree.cos_theta1,
-                                        new_tree.cos_theta2], "PyKeras")
-                if args.MLVariables == "angles":
-                    discr_array[0] = reader.EvaluateMVA([new_tree.cos_theta_star,
-                                        new_tree.Phi, new_tree.Phi1, new_tree.cos_theta1,
-                                        new_tree.cos_theta2], "PyKeras")
-                elif args.MLVariables == "higgs":
-                    discr_array[0] = reader.EvaluateMVA([new_tree.Higgs_mass], "PyKeras")
-
-                branch.Fill()
-                if i % 300 == 0:
-                    logger.info(f"Processed {i} events out of {n_entries} in sample {sample_name} and final state {final_state} ({j} / 14 in total) \n")
-
-            new_tree.Write("", ROOT.TObject.kOverwrite)
-
-            j += 1
+            entry = manifest.get(os.path.basename(in_file_path), {})
+            if not args.force and not args.validateInference and model_fp is not None and \
+                    entry.get("model") == model_fp and \
+                    entry.get("dataset") == score_fingerprint(in_file_path, variables):
+                logger.info("Reusing the discriminant of %s", in_file_path)
+                reused.append(os.path.basename(in_file_path))
+                continue
 
-            logger.info(">>> Execution time for %s %s: %s s \n",
-                        sample_name, final_state, (time.time() - start_time))
+            file_paths.append(in_file_path)
+
+    n_workers, threads = parallel_tools.worker_layout(len(file_paths),
+                                                      args.nWorkers if args.parallel else 1)
+    config = {
+        "output": args.output,
+        "variables": list(variables),
+        "engine": args.inferenceEngine,
+        "folds": folds,
+        "validate": args.validateInference,
+        "threads": threads if args.parallel else 1,
+        "log_level": logger.level,
+    }
+    logger.info(">>> Evaluating %s skims on %s workers with %s threads each",
+                len(file_paths), n_workers, config["threads"])
+
+    results = []
+    def collect(result):
+        results.append(result)
+        key = os.path.basename(result["file"])
+        manifest[key] = {"model": model_fp, "dataset": result["dataset"]}
+        cache_tools.save_manifest(manifest_path, manifest)
+        logger.info(">>> (%s / %s) Evaluated %s in %s s", len(results), len(file_paths),
+                    key, result["time"])
+
+    if file_paths and n_workers == 1:
+        init_worker(config)
+        if _WORKER["reader"] is None and (config["engine"] == "tmva" or config["validate"]):
+            logger.exception("Exit the program")
+            return
+        for file_path in file_paths:
+            collect(evaluate_file(file_path))
+    elif file_paths:
+        with parallel_tools.pinned_threads(threads), \
+                multiprocessing.get_context("spawn").Pool(
+                    n_workers, initializer=init_worker, initargs=(config,)) as pool:
+            for result in pool.imap_unordered(evaluate_file, file_paths):
+                collect(result)
+
+    evaluated = [os.path.basename(result["file"]) for result in results]
+    logger.info(">>> Evaluated skims: %s", ", ".join(evaluated) if evaluated else "none")
+    logger.info(">>> Reused skims: %s", ", ".join(reused) if reused else "none")
+    logger.info(">>> Time spent evaluating the skims: %s s, on %s workers",
+                sum(result["time"] for result in results), n_workers)
 
     logger.info(">>> Total Execution time: %s s \n", (time.time() - start_time_tot))
 
@@ -174,7 +575,7 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--parallel",   default=True,   action="store_const",
                         const=False, help="disables running in parallel")
     parser.add_argument("-n", "--nWorkers",   default=0,
-                        type=int,   help="number of workers for multi-threading" )
+                        type=int,   help="number of worker processes evaluating the datasets" )
     parser.add_argument("-a", "--MLVariables",     default="tot",
                          type=str,   help="name of the set of variables to be used in the ML \
                             algorithm defined 'variables_ml_def.py': tot, angles, higgs")
@@ -190,6 +591,13 @@ if __name__ == "__main__":
                         help="string with comma separated list of samples to analyse: \
                         Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
                         Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="evaluates again also the unchanged datasets")
+    parser.add_argument("--inferenceEngine",   default="numpy", type=str,
+                        help="engine used to evaluate the DNN: numpy, tmva")
+    parser.add_argument("--validateInference",   default=False,   action="store_const",
+                        const=True, help="compares the NumPy evaluation of the DNN \
+                            with the TMVA reader")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
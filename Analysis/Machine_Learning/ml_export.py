@@ -0,0 +1,155 @@
+""" Export of the trained DNN to a compact NumPy file, which can be
+evaluated by ``ml_inference.py`` without loading Keras or TensorFlow.
+The file contains the weights and activations of the dense layers read
+from ``TrainedModel_PyKeras.h5`` and the parameters of the TMVA
+input transformations (decorrelation and gaussianisation) read from
+``TMVAClassification_PyKeras.weights.xml``.
+"""
+
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import h5py
+import numpy as np
+
+
+def read_keras_layers(model_path):
+    """ Read weights, biases and activations of the dense layers
+    from a model saved by Keras in the HDF5 format.
+
+    :param model_path: Path to the Keras model
+    :type model_path: str
+    :raises RuntimeError: Raised when the model contains a non dense layer
+    :return: List of (kernel, bias, activation) of each layer
+    :rtype: list(tuple(numpy.ndarray, numpy.ndarray, str))
+    """
+
+    with h5py.File(model_path, "r") as h5_file:
+        config = h5_file.attrs["model_config"]
+        if isinstance(config, bytes):
+            config = config.decode("utf8")
+        activations = {layer["config"]["name"]: layer["config"].get("activation", "linear")
+                       for layer in json.loads(config)["config"]["layers"]}
+
+        weights = h5_file["model_weights"]
+        layers = []
+        for layer_name in weights.attrs["layer_names"]:
+            layer_name = layer_name.decode("utf8") if isinstance(layer_name, bytes) else layer_name
+            group = weights[layer_name]
+            weight_names = [name.decode("utf8") if isinstance(name, bytes) else name
+                            for name in group.attrs["weight_names"]]
+            if not weight_names:
+                continue
+            if len(weight_names) != 2:
+                raise RuntimeError(f"Layer {layer_name} is not a dense layer")
+            kernel = np.array(group[weight_names[0]], dtype=np.float64)
+            bias = np.array(group[weight_names[1]], dtype=np.float64)
+            layers.append((kernel, bias, activations.get(layer_name, "linear")))
+
+    return layers
+
+def read_tmva_transformations(weights_path, variables):
+    """ Read the parameters of the decorrelation and gaussianisation
+    applied by TMVA to the input variables. As in the TMVA reader,
+    the transformations computed on all the classes are used.
+
+    :param weights_path: Path to ``TMVAClassification_PyKeras.weights.xml``
+    :type weights_path: str
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :raises RuntimeError: Raised when the variables or the transformations are not the expected ones
+    :return: Decorrelation matrix and, for each variable, the points of
+        the cumulative distribution used by the gaussianisation
+    :rtype: tuple(numpy.ndarray, list(tuple(numpy.ndarray, numpy.ndarray)))
+    """
+
+    root = ET.parse(weights_path).getroot()
+
+    xml_variables = [var.get("Expression") for var in root.iter("Variable")
+                     if var.get("Expression") is not None]
+    if xml_variables != list(variables):
+        raise RuntimeError(f"The weights were trained on {xml_variables}, not on {variables}")
+
+    decorr = None
+    cumulatives = []
+    for transform in root.find("Transformations").findall("Transform"):
+        name = transform.get("Name")
+        if name == "Decorrelation":
+            # One matrix for each class followed by the one for all the classes
+            matrix = transform.findall("Matrix")[-1]
+            shape = (int(matrix.get("Rows")), int(matrix.get("Columns")))
+            decorr = np.array(matrix.text.split(), dtype=np.float64).reshape(shape)
+        elif name == "Gauss":
+            if decorr is None:
+                raise RuntimeError("The gaussianisation must follow the decorrelation")
+            for var in sorted(transform.findall("Variable"), key=lambda v: int(v.get("VarIndex"))):
+                cls_pdfs = sorted((child for child in var if child.tag.startswith("CumulativePDF")),
+                                  key=lambda child: child.tag)
+                cumulatives.append(read_tmva_pdf(cls_pdfs[-1].find("PDF")))
+        else:
+            raise RuntimeError(f"Unsupported TMVA transformation {name}")
+
+    if decorr is None or len(cumulatives) != len(variables):
+        raise RuntimeError("The weights file doesn't contain the D,G transformations")
+
+    return decorr, cumulatives
+
+def read_tmva_pdf(pdf):
+    """ Read the histogram of a TMVA PDF as a list of points (bin center, content),
+    which are linearly interpolated as done by the TMVA ``Spline1`` method.
+
+    :param pdf: XML element of the PDF
+    :type pdf: xml.etree.ElementTree.Element
+    :return: Bin centers and contents of the histogram
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    """
+
+    histo = pdf.find("Histogram")
+    n_bins = int(histo.get("NBins"))
+    contents = np.array(histo.text.split(), dtype=np.float64)[:n_bins]
+
+    binning = pdf.find("HistoBinning")
+    if binning is not None:
+        edges = np.array(binning.text.split(), dtype=np.float64)[:n_bins + 1]
+    else:
+        edges = np.linspace(float(histo.get("XMin")), float(histo.get("XMax")), n_bins + 1)
+
+    return 0.5 * (edges[1:] + edges[:-1]), contents
+
+def export_model(model_dir, variables, log):
+    """ Export the trained DNN and the input transformations
+    in ``dnn_model.npz``.
+
+    :param model_dir: Directory with the outputs of the training, e.g. ``ML_output/``
+    :type model_dir: str
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :return: Path to the exported model
+    :rtype: str
+    """
+
+    weights_dir = os.path.join(model_dir, "dataset", "weights")
+    layers = read_keras_layers(os.path.join(weights_dir, "TrainedModel_PyKeras.h5"))
+    decorr, cumulatives = read_tmva_transformations(
+        os.path.join(weights_dir, "TMVAClassification_PyKeras.weights.xml"), variables)
+
+    arrays = {
+        "variables": np.array(variables),
+        "decorr": decorr,
+        "activations": np.array([activation for _, _, activation in layers]),
+    }
+    for i, (kernel, bias, _) in enumerate(layers):
+        arrays[f"kernel_{i}"] = kernel
+        arrays[f"bias_{i}"] = bias
+    for i, (x_points, y_points) in enumerate(cumulatives):
+        arrays[f"cdf_x_{i}"] = x_points
+        arrays[f"cdf_y_{i}"] = y_points
+
+    model_path = os.path.join(model_dir, "dnn_model.npz")
+    np.savez_compressed(model_path, **arrays)
+    log.debug("Exported the DNN in %s", model_path)
+
+    return model_path
@@ -0,0 +1,146 @@
+""" Fused application of the DNN: the evaluation, selection and 2D
+histogramming steps are performed in a single event loop over each skim.
+The discriminant is computed on the fly by the C++ code generated in
+``ml_codegen.py``, the bitmask of the thresholds is written in the friend
+TTree of the skim as in ``ml_selection.py``, and the histograms of Mass
+4 leptons VS DNN Discriminant of ``ml_histo.py`` are filled in the same
+pass, so that each skim is read only once instead of three times.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import ROOT
+
+sys.path.append(os.path.join("..","..", ""))
+
+from Analysis import cache_tools, dataset_io, set_up
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.selections_def import DNN_WORKING_POINTS, SELECTION_TREE
+from Analysis.Histogramming import histogramming_functions, ml_histo
+from Analysis.Machine_Learning import ml_codegen, ml_selection
+
+
+def ml_fused(args, logger):
+    """ Main function of the fused evaluation, selection and histogramming.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time_tot = time.time()
+
+    # The friend TTree must have the same order of the events of the skim,
+    # which isn't guaranteed by the implicit multi-threading
+    ROOT.ROOT.DisableImplicitMT()
+
+    try:
+        dnn_expression = ml_codegen.declare_model(args.output, logger)
+    except FileNotFoundError as not_found_err:
+        logger.exception("Unable to generate the DNN code %s", not_found_err, stack_info=True)
+        logger.exception("Exit the program")
+        return
+
+    thresholds = [ml_selection.read_cut(args.output, logger)] + list(DNN_WORKING_POINTS)
+    cache_tools.save_manifest(ml_selection.thresholds_path(args.output),
+                              {"thresholds": thresholds})
+    logger.info("Thresholds of the bits of the selection mask: %s", thresholds)
+
+    histos = {}
+    for sample_name, final_states in SAMPLES.items():
+        # Check if the sample is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
+                continue
+            logger.info(">>> Process sample: %s and final state %s", sample_name, final_state)
+            start_time = time.time()
+
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+            try:
+                if not os.path.exists(file_name):
+                    raise FileNotFoundError
+                rdf = dataset_io.open_dataset("Events", file_name)
+            except FileNotFoundError as not_found_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_found_err, stack_info=True)
+                continue
+
+            rdf = ml_codegen.define_discriminant(rdf, dnn_expression)
+            rdf_mask = rdf.Define("DNNSelectionMask", ml_selection.mask_expression(
+                thresholds, ml_codegen.INGRAPH_COLUMN))
+
+            # Book the histogram before writing the mask, so that both happen in the same loop
+            group = ml_histo.dataset_group(sample_name, final_state)
+            histo = None
+            if group is not None:
+                histo = histogramming_functions.book_histogram_2d(
+                    f"{group}_{sample_name}_{final_state}", rdf_mask,
+                    ml_histo.histo_variables(dnn_expression), ml_histo.RANGES_X,
+                    ml_histo.RANGES_Y)
+
+            try:
+                if dataset_io.dataset_format(file_name, "Events") == "rntuple":
+                    logger.debug("The selection mask of %s is computed from the discriminant",
+                                 file_name)
+                    if histo is not None:
+                        histo.GetValue()
+                else:
+                    dataset_io.write_dataset("ttree", rdf_mask, SELECTION_TREE,
+                                             file_name, ["DNNSelectionMask"], "UPDATE")
+            except TypeError:
+                logger.debug("Sample %s final state %s is empty", sample_name, final_state)
+                continue
+
+            if histo is not None:
+                if group in histos:
+                    histos[group].Add(histo.GetPtr())
+                else:
+                    histos[group] = histo.GetValue().Clone(group)
+                    histos[group].SetDirectory(ROOT.nullptr)
+
+            logger.info(">>> Execution time for %s %s: %s s \n", sample_name,
+                        final_state, (time.time() - start_time))
+
+    # Write the histograms of the groups of datasets
+    dir_name = os.path.join(args.output, "Histograms")
+    os.makedirs(dir_name, exist_ok=True)
+    outfile = ROOT.TFile(os.path.join(dir_name, "Histograms_discriminant.root"), "RECREATE")
+    for group, histo in histos.items():
+        histogramming_functions.write_histogram(histo, group)
+    outfile.Close()
+
+    logger.info(">>> Total execution time: %s s \n",(time.time() - start_time_tot))
+
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-f", "--finalState",   default="all", type=str,
+                            help="comma separated list of the final states to analyse: \
+                            FourMuons,FourElectrons,TwoMuonsTwoElectrons" )
+    parser.add_argument("-s", "--sample",    default="all", type=str,
+                        help="string with comma separated list of samples to analyse: \
+                        Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
+                        Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+
+    ml_fused(args_main, logger_main)
@@ -0,0 +1,137 @@
+""" Lightweight inference runtime of the trained DNN, written only in NumPy.
+It evaluates the model exported by ``ml_export.py`` on batches of events
+with matrix multiplications, reproducing the decorrelation and the
+gaussianisation of the inputs applied by the TMVA reader. In this way
+the evaluation doesn't need to start Keras, TensorFlow or the Python
+interpreter embedded in TMVA.
+"""
+
+import math
+
+import numpy as np
+
+# Largest argument of the inverse error function used by TMVA
+MAX_ERFINV_ARG = 0.99999999
+
+_erf = np.vectorize(math.erf, otypes=[np.float64])
+
+
+def erfinv(arg):
+    """ Inverse error function. A first approximation is obtained
+    with the polynomial expansion by M. Giles, which is then
+    refined with a Newton step.
+
+    :param arg: Values in the range (-1, 1)
+    :type arg: numpy.ndarray
+    :return: Inverse error function of the input values
+    :rtype: numpy.ndarray
+    """
+
+    arg = np.asarray(arg, dtype=np.float64)
+    w = -np.log((1. - arg) * (1. + arg))
+
+    central = w - 2.5
+    p_central = np.full_like(arg, 2.81022636e-08)
+    for coeff in [3.43273939e-07, -3.5233877e-06, -4.39150654e-06, 0.00021858087,
+                  -0.00125372503, -0.00417768164, 0.246640727, 1.50140941]:
+        p_central = coeff + p_central * central
+
+    tail = np.sqrt(np.maximum(w, 5.)) - 3.
+    p_tail = np.full_like(arg, -0.000200214257)
+    for coeff in [0.000100950558, 0.00134934322, -0.00367342844, 0.00573950773,
+                  -0.0076224613, 0.00943887047, 1.00167406, 2.83297682]:
+        p_tail = coeff + p_tail * tail
+
+    result = np.where(w < 5., p_central, p_tail) * arg
+
+    # Newton step: d erf(x) / dx = 2 / sqrt(pi) exp(-x^2)
+    result -= (_erf(result) - arg) / (2. / math.sqrt(math.pi) * np.exp(-result**2))
+    return result
+
+def load_model(model_path):
+    """ Load the DNN exported by ``ml_export.export_model``.
+
+    :param model_path: Path to ``dnn_model.npz``
+    :type model_path: str
+    :return: Parameters of the model
+    :rtype: dict
+    """
+
+    with np.load(model_path) as npz:
+        activations = [str(act) for act in npz["activations"]]
+        model = {
+            "variables": [str(var) for var in npz["variables"]],
+            "decorr": npz["decorr"],
+            "layers": [(npz[f"kernel_{i}"], npz[f"bias_{i}"], act)
+                       for i, act in enumerate(activations)],
+        }
+        model["cdf"] = [(npz[f"cdf_x_{i}"], npz[f"cdf_y_{i}"])
+                        for i in range(len(model["variables"]))]
+    return model
+
+def transform(model, inputs):
+    """ Apply the decorrelation and the gaussianisation of TMVA to the inputs.
+
+    :param model: Parameters of the model
+    :type model: dict
+    :param inputs: Input variables, with shape (number of events, number of variables)
+    :type inputs: numpy.ndarray
+    :return: Transformed variables
+    :rtype: numpy.ndarray
+    """
+
+    decorrelated = inputs @ model["decorr"].T
+
+    gaussian = np.empty_like(decorrelated)
+    for i, (x_points, y_points) in enumerate(model["cdf"]):
+        # Linear interpolation between the bin centers, extrapolated beyond the first and last ones
+        idx = np.clip(np.searchsorted(x_points, decorrelated[:, i]) - 1, 0, len(x_points) - 2)
+        slope = (y_points[idx + 1] - y_points[idx]) / (x_points[idx + 1] - x_points[idx])
+        cumulant = y_points[idx] + slope * (decorrelated[:, i] - x_points[idx])
+        arg = np.clip(2. * cumulant - 1., -MAX_ERFINV_ARG, MAX_ERFINV_ARG)
+        gaussian[:, i] = math.sqrt(2.) * erfinv(arg)
+    return gaussian
+
+def activation(values, name):
+    """ Activation function of a dense layer.
+
+    :param values: Output of the linear part of the layer
+    :type values: numpy.ndarray
+    :param name: Name of the Keras activation
+    :type name: str
+    :raises ValueError: Raised when the activation isn't supported
+    :return: Output of the layer
+    :rtype: numpy.ndarray
+    """
+
+    if name == "relu":
+        return np.maximum(values, 0.)
+    if name == "softmax":
+        exp = np.exp(values - values.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+    if name == "sigmoid":
+        return 1. / (1. + np.exp(-values))
+    if name == "tanh":
+        return np.tanh(values)
+    if name == "linear":
+        return values
+    raise ValueError(f"Activation {name} is not supported")
+
+def score(model, arrays):
+    """ Evaluate the DNN on a batch of events. The discriminant is the
+    output of the node of the signal class, as in the TMVA reader.
+
+    :param model: Parameters of the model
+    :type model: dict
+    :param arrays: Input variables of the events, e.g. from ``RDataFrame.AsNumpy``
+    :type arrays: dict(str, numpy.ndarray)
+    :return: Discriminant of each event
+    :rtype: numpy.ndarray
+    """
+
+    inputs = np.column_stack([np.asarray(arrays[var], dtype=np.float64)
+                              for var in model["variables"]])
+    values = transform(model, inputs)
+    for kernel, bias, act in model["layers"]:
+        values = activation(values @ kernel + bias, act)
+    return values[:, 0].astype(np.float32)
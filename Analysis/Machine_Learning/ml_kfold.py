@@ -0,0 +1,206 @@
+""" Helpers for the k-fold training of the DNN. Each event is assigned
+to a fold with a hash of some of its variables, so that the assignment
+is the same in every step independently of the order of the events.
+The DNN of each fold is trained on the events of the other folds and
+is used to score the events of its own fold, which it has never seen.
+The outputs of the folds are stored in ``ML_output/Folds/fold<i>/``,
+while ``ML_output/folds.json`` describes the last k-fold training.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import ROOT
+
+from Analysis import cache_tools, dataset_io
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES
+from Analysis.Machine_Learning import ml_inference
+
+# FNV-1a hash of the bit patterns of the variables
+FOLD_INDEX_CODE = """
+#ifndef KFOLD_INDEX_H
+#define KFOLD_INDEX_H
+#include <cstdint>
+#include <cstring>
+inline int kfoldIndex(float m, float pt, float eta, float phi, int k) {
+    std::uint64_t hash = 1469598103934665603ULL;
+    for (float value : {m, pt, eta, phi}) {
+        std::uint32_t bits;
+        std::memcpy(&bits, &value, sizeof(bits));
+        hash ^= bits;
+        hash *= 1099511628211ULL;
+    }
+    return hash % k;
+}
+#endif
+"""
+
+_FNV_OFFSET = np.uint64(1469598103934665603)
+_FNV_PRIME = np.uint64(1099511628211)
+
+
+def declare_fold_index():
+    """ Compile the function ``kfoldIndex`` with the ROOT interpreter.
+    """
+
+    if not hasattr(ROOT, "kfoldIndex"):
+        ROOT.gInterpreter.Declare(FOLD_INDEX_CODE)
+
+def fold_expression(k_folds):
+    """ Expression computing the fold of the events in a RDataFrame.
+
+    :param k_folds: Number of folds
+    :type k_folds: int
+    :return: Expression of the fold index
+    :rtype: str
+    """
+
+    declare_fold_index()
+    return f"kfoldIndex({', '.join(KFOLD_VARIABLES)}, {k_folds})"
+
+def fold_index(arrays, k_folds):
+    """ Fold of the events read in memory, equal to the one
+    computed by ``kfoldIndex`` in the event loop.
+
+    :param arrays: Columns of the dataset
+    :type arrays: dict(str, numpy.ndarray)
+    :param k_folds: Number of folds
+    :type k_folds: int
+    :return: Fold index of each event
+    :rtype: numpy.ndarray
+    """
+
+    n_events = len(arrays[KFOLD_VARIABLES[0]])
+    fold_hash = np.full(n_events, _FNV_OFFSET, dtype=np.uint64)
+    for var in KFOLD_VARIABLES:
+        bits = np.ascontiguousarray(arrays[var], dtype=np.float32).view(np.uint32)
+        fold_hash ^= bits.astype(np.uint64)
+        fold_hash *= _FNV_PRIME
+    return (fold_hash % np.uint64(k_folds)).astype(np.int64)
+
+def folds_dir(output):
+    """ Directory where the outputs of the folds are stored.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Path to the directory of the folds
+    :rtype: str
+    """
+
+    return os.path.join(output, "ML_output", "Folds")
+
+def load_folds(output):
+    """ Read the description of the last k-fold training.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Description of the folds, or None if the DNN wasn't trained with k folds
+    :rtype: dict
+    """
+
+    folds = cache_tools.load_manifest(os.path.join(output, "ML_output", "folds.json"))
+    return folds if folds.get("k_folds", 1) > 1 else None
+
+def save_folds(output, folds):
+    """ Write the description of the k-fold training.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param folds: Description of the folds
+    :type folds: dict
+    """
+
+    cache_tools.save_manifest(os.path.join(output, "ML_output", "folds.json"), folds)
+
+def clear_folds(output):
+    """ Remove the outputs of a previous k-fold training.
+
+    :param output: Path to the output folder
+    :type output: str
+    """
+
+    shutil.rmtree(folds_dir(output), ignore_errors=True)
+    manifest_path = os.path.join(output, "ML_output", "folds.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+def split_folds(signal_files, bkg_files, variables, k_folds, directory):
+    """ Write, for each fold, the training and test trees of signal
+    and background. The test trees contain the events of the fold,
+    while the training trees contain those of the other folds.
+
+    :param signal_files: Paths to the skims of the signal samples
+    :type signal_files: list(str)
+    :param bkg_files: Paths to the skims of the background samples
+    :type bkg_files: list(str)
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param k_folds: Number of folds
+    :type k_folds: int
+    :param directory: Directory of the folds
+    :type directory: str
+    :return: Paths to the trees of each fold, e.g. ``trees[fold]["signal_train"]``
+    :rtype: list(dict(str, str))
+    """
+
+    option = dataset_io.snapshot_options("ttree")
+    option.fLazy = True
+
+    rdfs = {
+        "signal": dataset_io.open_dataset("Events", signal_files)
+                    .Define("fold", fold_expression(k_folds)),
+        "bkg": dataset_io.open_dataset("Events", bkg_files)
+                    .Define("fold", fold_expression(k_folds)),
+    }
+
+    trees = []
+    snapshots = []
+    for fold in range(k_folds):
+        fold_dir = os.path.join(directory, f"fold{fold}")
+        os.makedirs(fold_dir, exist_ok=True)
+        trees.append({})
+        for name, rdf in rdfs.items():
+            for split, cut in [("train", f"fold != {fold}"), ("test", f"fold == {fold}")]:
+                tree_path = os.path.join(fold_dir, f"{name}_{split}.root")
+                snapshots.append(rdf.Filter(cut).Snapshot("Events", tree_path,
+                                                          list(variables), option))
+                trees[fold][f"{name}_{split}"] = tree_path
+    ROOT.RDF.RunGraphs(snapshots)
+
+    return trees
+
+def load_fold_models(output, folds):
+    """ Load the DNN of each fold exported for the NumPy runtime.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param folds: Description of the folds
+    :type folds: dict
+    :return: Parameters of the model of each fold
+    :rtype: list(dict)
+    """
+
+    return [ml_inference.load_model(os.path.join(folds_dir(output), f"fold{fold}", "dnn_model.npz"))
+            for fold in range(folds["k_folds"])]
+
+def score_folds(models, arrays):
+    """ Evaluate the DNN on a batch of events, scoring each
+    event with the model of the fold it belongs to.
+
+    :param models: Parameters of the model of each fold
+    :type models: list(dict)
+    :param arrays: Columns of the dataset
+    :type arrays: dict(str, numpy.ndarray)
+    :return: Discriminant of each event
+    :rtype: numpy.ndarray
+    """
+
+    folds = fold_index(arrays, len(models))
+    discr = np.empty(len(folds), dtype=np.float32)
+    for fold, model in enumerate(models):
+        mask = folds == fold
+        if mask.any():
+            discr[mask] = ml_inference.score(model, {var: np.asarray(arrays[var])[mask]
+                                                     for var in model["variables"]})
+    return discr
@@ -0,0 +1,252 @@
+""" In this step the threshold on the DNN discriminant is optimized.
+Fine-binned histograms of the discriminant of the simulated signal and
+background, weighted with the normalisation of ``weights_def.py``, are
+filled in a single pass over the skims. The expected signal and
+background above every threshold are then obtained with cumulative
+sums, from which S/sqrt(B), S/sqrt(S+B) and the Asimov significance are
+computed at once. With ``--massBins`` the histograms are split in bins of
+``Higgs_mass`` and the significances of the bins are combined in quadrature.
+The threshold maximizing the metric chosen with ``--significance`` is
+saved in ``ML_output/optimal_cut.txt`` and the whole scan in
+``ML_output/significance_scan.csv``.
+"""
+
+import argparse
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+import ROOT
+
+sys.path.append(os.path.join("..","..", ""))
+
+from Analysis import dataset_io, set_up
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.selections_def import SIGNIFICANCE_SCAN
+from Analysis.Histogramming.histogramming_functions import histogram_to_numpy
+from Analysis.Machine_Learning import ml_codegen
+
+
+def book_discriminant(rdf, name, n_bins, mass_edges, column="Discriminant"):
+    """ Book the weighted histogram of the discriminant, in bins
+    of ``Higgs_mass`` if the edges of the mass bins are given.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :param name: Name of the histogram
+    :type name: str
+    :param n_bins: Number of bins of the discriminant in [0, 1]
+    :type n_bins: int
+    :param mass_edges: Edges of the bins of ``Higgs_mass``, or None
+    :type mass_edges: list(float)
+    :param column: Column of the discriminant
+    :type column: str
+    :return: Booked histogram
+    :rtype: ROOT.RDF.RResultPtr
+    """
+
+    if mass_edges is None:
+        return rdf.Histo1D(ROOT.RDF.TH1DModel(name, name, n_bins, 0., 1.),
+                           column, "Weight")
+    return rdf.Histo2D(ROOT.RDF.TH2DModel(name, name, n_bins, 0., 1.,
+                                          len(mass_edges) - 1, array("d", mass_edges)),
+                       column, "Higgs_mass", "Weight")
+
+def discriminant_yields(histo):
+    """ Content of the histogram of the discriminant as a 2D array
+    (mass bin, discriminant bin). The underflow and overflow of the discriminant
+    are added to the first and last bins, while the events outside of
+    the mass bins are dropped.
+
+    :param histo: Histogram of the discriminant
+    :type histo: ROOT.TH1
+    :return: Expected events in each bin
+    :rtype: numpy.ndarray
+    """
+
+    contents = np.atleast_2d(histogram_to_numpy(histo))
+    if histo.GetDimension() == 2:
+        contents = contents[1:-1]
+    contents[:, 1] += contents[:, 0]
+    contents[:, -2] += contents[:, -1]
+    return contents[:, 1:-1]
+
+def significance_scan(signal, background, min_background=0.):
+    """ Expected yields and significances for every threshold on the discriminant.
+    The events above a threshold are obtained with reversed cumulative sums,
+    and the significances of the mass bins are combined in quadrature.
+
+    :param signal: Expected signal in each (mass bin, discriminant bin)
+    :type signal: numpy.ndarray
+    :param background: Expected background in each (mass bin, discriminant bin)
+    :type background: numpy.ndarray
+    :param min_background: Minimum expected background for a threshold to be considered
+    :type min_background: float
+    :return: Signal, background and significances above the lower edge of each bin
+    :rtype: dict(str, numpy.ndarray)
+    """
+
+    sig = np.cumsum(signal[:, ::-1], axis=1)[:, ::-1]
+    bkg = np.cumsum(background[:, ::-1], axis=1)[:, ::-1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = {
+            "s_sqrt_b": np.where(bkg > 0, sig / np.sqrt(bkg), 0.),
+            "s_sqrt_sb": np.where(sig + bkg > 0, sig / np.sqrt(sig + bkg), 0.),
+            "asimov": np.where(bkg > 0, np.sqrt(np.maximum(
+                2. * ((sig + bkg) * np.log1p(sig / bkg) - sig), 0.)), 0.),
+        }
+
+    valid = bkg.sum(axis=0) >= min_background
+    scan = {"signal": sig.sum(axis=0), "background": bkg.sum(axis=0)}
+    for name, values in metrics.items():
+        scan[name] = np.where(valid, np.sqrt(np.sum(values**2, axis=0)), 0.)
+    return scan
+
+def write_scan(scan, thresholds, file_path):
+    """ Write the result of the scan in a CSV file.
+
+    :param scan: Signal, background and significances for every threshold
+    :type scan: dict(str, numpy.ndarray)
+    :param thresholds: Thresholds on the discriminant
+    :type thresholds: numpy.ndarray
+    :param file_path: Path to the output file
+    :type file_path: str
+    """
+
+    columns = ["signal", "background", "s_sqrt_b", "s_sqrt_sb", "asimov"]
+    np.savetxt(file_path, np.column_stack([thresholds] + [scan[col] for col in columns]),
+               delimiter=",", header=",".join(["threshold"] + columns), comments="")
+
+def ml_optimize(args, logger):
+    """ Main function of the optimization of the threshold on the discriminant.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    # Enable multi-threading
+    if args.parallel:
+        ROOT.ROOT.EnableImplicitMT(args.nWorkers)
+        thread_size = ROOT.ROOT.GetThreadPoolSize()
+        logger.info(">>> Thread pool size for parallel processing: %s", thread_size)
+
+    dnn_expression = None
+    if args.inGraphDNN:
+        try:
+            dnn_expression = ml_codegen.declare_model(args.output, logger)
+        except FileNotFoundError as not_found_err:
+            logger.exception("Unable to generate the DNN code %s", not_found_err, stack_info=True)
+            logger.exception("Exit the program")
+            return
+
+    n_bins = SIGNIFICANCE_SCAN["n_bins"]
+    mass_edges = SIGNIFICANCE_SCAN["mass_bins"] if args.massBins else None
+
+    histos = {"signal": [], "background": []}
+    simulated_samples = {k: v for k, v in SAMPLES.items() if not k.startswith("Run")}
+    for sample_name, final_states in simulated_samples.items():
+        # Check if the sample is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
+                continue
+
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+            try:
+                if not os.path.exists(file_name):
+                    raise FileNotFoundError
+                rdf = dataset_io.open_dataset("Events", file_name)
+            except FileNotFoundError as not_found_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_found_err, stack_info=True)
+                continue
+
+            if args.inGraphDNN:
+                rdf = ml_codegen.define_discriminant(rdf, dnn_expression)
+            elif not rdf.HasColumn("Discriminant"):
+                logger.warning("Sample %s final state %s hasn't been evaluated with the DNN",
+                               sample_name, final_state)
+                continue
+
+            category = "signal" if sample_name == "SMHiggsToZZTo4L" else "background"
+            histos[category].append(book_discriminant(
+                rdf, f"{sample_name}_{final_state}", n_bins, mass_edges,
+                ml_codegen.discriminant_column(dnn_expression)))
+
+    if not histos["signal"] or not histos["background"]:
+        logger.error("The optimization needs both signal and background samples")
+        return
+
+    # Fill all the histograms in a single pass over the skims
+    ROOT.RDF.RunGraphs(histos["signal"] + histos["background"])
+    logger.info(">>> Histograms filled in %s s", time.time() - start_time)
+
+    scan_start = time.time()
+    signal = sum(discriminant_yields(histo.GetValue()) for histo in histos["signal"])
+    background = sum(discriminant_yields(histo.GetValue()) for histo in histos["background"])
+    scan = significance_scan(signal, background, SIGNIFICANCE_SCAN["min_background"])
+
+    thresholds = np.linspace(0., 1., n_bins + 1)[:-1]
+    best = int(np.argmax(scan[args.significance]))
+    logger.info(">>> Scan of %s thresholds done in %s ms", n_bins,
+                1000. * (time.time() - scan_start))
+    logger.info("Optimal cut at %s: %s significance %s, signal %s, background %s",
+                thresholds[best], args.significance, scan[args.significance][best],
+                scan["signal"][best], scan["background"][best])
+
+    dir_name = os.path.join(args.output, "ML_output")
+    write_scan(scan, thresholds, os.path.join(dir_name, "significance_scan.csv"))
+    with open(os.path.join(dir_name, "optimal_cut.txt"), "w", encoding="utf8") as file:
+        file.write(str(thresholds[best]))
+    logger.debug("Created file optimal_cut.txt")
+
+    logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-p", "--parallel",   default=True,   action="store_const",
+                        const=False, help="disables running in parallel")
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of workers for multi-threading" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-f", "--finalState",   default="all", type=str,
+                            help="comma separated list of the final states to analyse: \
+                            FourMuons,FourElectrons,TwoMuonsTwoElectrons" )
+    parser.add_argument("-s", "--sample",    default="all", type=str,
+                        help="string with comma separated list of samples to analyse: \
+                        Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
+                        Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("--significance",   default="asimov", type=str,
+                        help="significance maximized by the cut on the discriminant: \
+                            asimov, s_sqrt_sb, s_sqrt_b")
+    parser.add_argument("--massBins",   default=False,   action="store_const",
+                        const=True, help="optimizes the cut on the discriminant \
+                            in bins of the mass of the Higgs candidate")
+    parser.add_argument("--inGraphDNN",   default=False,   action="store_const",
+                        const=True, help="computes the DNN discriminant inside the \
+                            event loop with generated C++ code instead of storing it")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+
+    ml_optimize(args_main, logger_main)
@@ -0,0 +1,196 @@
+""" Registry of the trained DNN models. Each entry stores the model,
+the TMVA weights and the optimal cut produced by a training, and is
+identified by a fingerprint of the training inputs (content of the
+simulated skims, variables, architecture, TMVA options, number of
+folds and subsampling of the training set). When the
+configuration doesn't change the stored outputs are restored
+instead of training the DNN again.
+"""
+
+import os
+import shutil
+import time
+
+from Analysis import cache_tools
+from Analysis.Definitions.dnn_model_def import DNN_MODEL, TMVA_OPTIONS
+from Analysis.Machine_Learning import ml_kfold
+
+# Outputs of the training w.r.t. the ML_output/ directory
+REGISTRY_FILES = [
+    "DNNmodel.h5",
+    "optimal_cut.txt",
+    "ml_roc.pdf",
+    "dnn_model.npz",
+    os.path.join("dataset", "weights", "TrainedModel_PyKeras.h5"),
+    os.path.join("dataset", "weights", "TMVAClassification_PyKeras.weights.xml"),
+    os.path.join("dataset", "weights", "TMVAClassification_PyKeras.class.C"),
+    "folds.json",
+]
+
+
+def training_fingerprint(signal_files, bkg_files, variables, k_folds=1, sampling=None):
+    """ Fingerprint of the configuration of the training.
+
+    :param signal_files: Paths to the skims of the signal samples
+    :type signal_files: list(str)
+    :param bkg_files: Paths to the skims of the background samples
+    :type bkg_files: list(str)
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param k_folds: Number of folds of the training
+    :type k_folds: int
+    :param sampling: Configuration of the subsampling of the training set, if any
+    :type sampling: dict
+    :return: Fingerprint of the training
+    :rtype: str
+    """
+
+    inputs = {
+        "signal": [cache_tools.dataset_fingerprint(file_name, "Events", variables)
+                   for file_name in sorted(signal_files)],
+        "background": [cache_tools.dataset_fingerprint(file_name, "Events", variables)
+                       for file_name in sorted(bkg_files)],
+    }
+    # The optional parameters are added only when used, so that
+    # the fingerprints of the previous configurations don't change
+    options = []
+    if k_folds > 1:
+        options.append(k_folds)
+    if sampling is not None:
+        options.append(sampling)
+    return cache_tools.make_fingerprint(inputs, variables, DNN_MODEL, TMVA_OPTIONS, *options)
+
+def training_files(output):
+    """ Outputs of the current training w.r.t. the ``ML_output/`` directory,
+    including the models of all the folds of a k-fold training.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Names of the files
+    :rtype: list(str)
+    """
+
+    files = [name for name in REGISTRY_FILES
+             if os.path.exists(os.path.join(output, "ML_output", name))]
+    for root, _, names in os.walk(ml_kfold.folds_dir(output)):
+        for name in sorted(names):
+            # The TMVA output files are large and not needed by the other steps
+            if not name.endswith(".root"):
+                files.append(os.path.relpath(os.path.join(root, name),
+                                             os.path.join(output, "ML_output")))
+    return files
+
+def clear_outputs(output):
+    """ Remove the outputs of the current training from ``ML_output/``,
+    including the models of the folds of a k-fold training.
+
+    :param output: Path to the output folder
+    :type output: str
+    """
+
+    ml_kfold.clear_folds(output)
+    for name in REGISTRY_FILES:
+        file_path = os.path.join(output, "ML_output", name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def registry_dir(output):
+    """ Directory where the registry is stored.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Path to the registry
+    :rtype: str
+    """
+
+    return os.path.join(output, "ML_output", "Registry")
+
+def restore(output, fingerprint, log):
+    """ Copy the outputs of a stored training in ``ML_output/``.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param fingerprint: Fingerprint of the training
+    :type fingerprint: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :return: True if the training was found in the registry
+    :rtype: bool
+    """
+
+    index_path = os.path.join(registry_dir(output), "registry.json")
+    index = cache_tools.load_manifest(index_path)
+    entry_dir = os.path.join(registry_dir(output), fingerprint)
+
+    if fingerprint not in index or not all(os.path.exists(os.path.join(entry_dir, name))
+                                           for name in index[fingerprint]["files"]):
+        log.debug("Training %s not found in the registry", fingerprint)
+        return False
+
+    # The outputs of a previous training must not be mixed with the restored ones
+    clear_outputs(output)
+    for name in index[fingerprint]["files"]:
+        destination = os.path.join(output, "ML_output", name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(os.path.join(entry_dir, name), destination)
+
+    index[fingerprint]["last_used"] = time.time()
+    cache_tools.save_manifest(index_path, index)
+    log.info(">>> Reusing the trained model %s from the registry", fingerprint[:12])
+    return True
+
+def store(output, fingerprint, log):
+    """ Save the outputs of the current training in the registry.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param fingerprint: Fingerprint of the training
+    :type fingerprint: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    index_path = os.path.join(registry_dir(output), "registry.json")
+    index = cache_tools.load_manifest(index_path)
+    entry_dir = os.path.join(registry_dir(output), fingerprint)
+
+    files = training_files(output)
+    for name in files:
+        source = os.path.join(output, "ML_output", name)
+        destination = os.path.join(entry_dir, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(source, destination)
+
+    now = time.time()
+    index[fingerprint] = {"created": now, "last_used": now, "files": files}
+    cache_tools.save_manifest(index_path, index)
+    log.debug("Stored training %s in the registry", fingerprint)
+
+def evict(output, max_entries, max_age, log):
+    """ Remove from the registry the entries not used for more than
+    ``max_age`` days and the least recently used ones beyond ``max_entries``.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param max_entries: Maximum number of entries kept in the registry
+    :type max_entries: int
+    :param max_age: Maximum age in days of the entries since their last use
+    :type max_age: float
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    """
+
+    index_path = os.path.join(registry_dir(output), "registry.json")
+    index = cache_tools.load_manifest(index_path)
+
+    by_use = sorted(index, key=lambda key: index[key]["last_used"], reverse=True)
+    expired = {key for key in by_use if time.time() - index[key]["last_used"] > max_age * 86400}
+    expired.update(by_use[max(max_entries, 0):])
+
+    for key in expired:
+        shutil.rmtree(os.path.join(registry_dir(output), key), ignore_errors=True)
+        del index[key]
+        log.debug("Evicted training %s from the registry", key)
+
+    if expired:
+        cache_tools.save_manifest(index_path, index)
@@ -0,0 +1,230 @@
+""" Class-balanced subsampling of the simulated samples used in the
+training of the DNN. For each final state the same number of signal
+and background events is drawn from the skims with a weighted reservoir
+sampling (Efraimidis-Spirakis): each event gets the key ``E / w``, with
+``E`` drawn from an exponential distribution and ``w`` the weight of the
+event, and the events with the smallest keys are kept. The keys are
+computed inside the event loop by a counter-based generator keyed by the
+entry of the event, and each thread of the loop keeps only the events with
+the smallest keys in a bounded heap, so the memory doesn't grow with the
+size of the skims. The sample is reproducible given the seed in
+``TRAINING_SAMPLING`` of ``dnn_model_def.py`` even with the implicit multi-threading.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import ROOT
+
+from Analysis import dataset_io
+from Analysis.Definitions.dnn_model_def import TRAINING_SAMPLING
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES
+from Analysis.Histogramming import bootstrap
+
+# Key of the events from the counter-based generator of the bootstrap,
+# and heaps of the events with the smallest keys of each thread of the loop
+SAMPLING_CODE = """
+#ifndef TRAINING_SAMPLING_H
+#define TRAINING_SAMPLING_H
+#include <algorithm>
+#include <cmath>
+#include <cstddef>
+#include <cstdint>
+#include <limits>
+#include <queue>
+#include <tuple>
+#include <vector>
+#include "ROOT/RVec.hxx"
+inline double samplingKey(ULong64_t entry, double weight, std::uint64_t seed) {
+    if (!(weight > 0.)) return std::numeric_limits<double>::infinity();
+    const double u = ((bootstrapMix(seed ^ bootstrapMix(entry)) >> 11) + 0.5) / 9007199254740992.;
+    return -std::log(u) / weight;
+}
+struct SampledEvent {
+    double key;
+    unsigned int file;
+    ULong64_t entry;
+    std::vector<double> values;
+    bool operator<(const SampledEvent& other) const {
+        return std::tie(key, file, entry) < std::tie(other.key, other.file, other.entry);
+    }
+};
+class SamplingReservoir {
+public:
+    SamplingReservoir(unsigned int n_slots, std::size_t size) : fSize(size), fHeaps(n_slots) {}
+    bool Fill(unsigned int slot, unsigned int file, ULong64_t entry, double key,
+              const ROOT::RVec<double>& values) {
+        if (fSize == 0 || !std::isfinite(key)) return true;
+        auto& heap = fHeaps[slot];
+        const SampledEvent event{key, file, entry, {}};
+        if (heap.size() == fSize) {
+            if (!(event < heap.top())) return true;
+            heap.pop();
+        }
+        heap.push({key, file, entry, std::vector<double>(values.begin(), values.end())});
+        return true;
+    }
+    std::size_t Merge() {
+        for (auto& heap : fHeaps) {
+            for (; !heap.empty(); heap.pop()) fEvents.push_back(heap.top());
+        }
+        std::sort(fEvents.begin(), fEvents.end());
+        if (fEvents.size() > fSize) fEvents.resize(fSize);
+        return fEvents.size();
+    }
+    void Copy(double* values) const {
+        std::size_t i = 0;
+        for (const auto& event : fEvents) {
+            for (double value : event.values) values[i++] = value;
+        }
+    }
+private:
+    std::size_t fSize;
+    std::vector<std::priority_queue<SampledEvent>> fHeaps;
+    std::vector<SampledEvent> fEvents;
+};
+#endif
+"""
+
+# Types of the columns of the skims in NumPy
+NUMPY_TYPES = {
+    "float": np.float32, "Float_t": np.float32,
+    "double": np.float64, "Double_t": np.float64,
+    "int": np.int32, "Int_t": np.int32,
+    "unsigned int": np.uint32, "UInt_t": np.uint32,
+    "Long64_t": np.int64, "ULong64_t": np.uint64,
+    "bool": np.bool_, "Bool_t": np.bool_,
+}
+
+
+def declare_sampling():
+    """ Compile the reservoir of the sampling with the ROOT interpreter.
+    """
+
+    bootstrap.declare_bootstrap()
+    if not hasattr(ROOT, "SamplingReservoir"):
+        ROOT.gInterpreter.Declare(SAMPLING_CODE)
+
+def sampling_seed(state_idx, label_idx, file_idx):
+    """ Seed of the keys of the events of a skim, independent of those of the other skims.
+
+    :param state_idx: Index of the final state
+    :type state_idx: int
+    :param label_idx: Index of the class, signal or background
+    :type label_idx: int
+    :param file_idx: Index of the skim in the class
+    :type file_idx: int
+    :return: Seed of the generator
+    :rtype: int
+    """
+
+    sequence = np.random.SeedSequence(TRAINING_SAMPLING["seed"],
+                                      spawn_key=(state_idx, label_idx, file_idx))
+    return int(sequence.generate_state(1, np.uint64)[0])
+
+def reservoir_sample(file_names, columns, size, seeds):
+    """ Draw a weighted sample of events without replacement from the skims,
+    in a single event loop over each skim. The events with non positive weight
+    are never drawn.
+
+    :param file_names: Paths to the skims
+    :type file_names: list(str)
+    :param columns: Names of the columns to be read, including ``Weight``
+    :type columns: list(str)
+    :param size: Number of events to be drawn
+    :type size: int
+    :param seeds: Seed of the keys of the events of each skim
+    :type seeds: list(int)
+    :return: Columns of the drawn events, sorted by increasing key, so that
+        the first n events are a weighted sample of size n
+    :rtype: dict(str, numpy.ndarray)
+    """
+
+    declare_sampling()
+    n_slots = max(ROOT.ROOT.GetThreadPoolSize(), 1)
+    reservoir = ROOT.SamplingReservoir(n_slots, size)
+    address = ROOT.addressof(reservoir)
+
+    types = {}
+    values = ", ".join(f"(double){col}" for col in columns)
+    for file_idx, (file_name, seed) in enumerate(zip(file_names, seeds)):
+        rdf = dataset_io.open_dataset("Events", file_name)
+        types = types or {col: NUMPY_TYPES.get(str(rdf.GetColumnType(col)), np.float64)
+                          for col in columns}
+        rdf = rdf.Define("SamplingKey", f"samplingKey(rdfentry_, Weight, {seed}ULL)")\
+                 .Define("SamplingValues", f"ROOT::RVec<double>{{{values}}}")
+        rdf.Filter(f"((SamplingReservoir*){address})->Fill(rdfslot_, {file_idx}, rdfentry_, "
+                   "SamplingKey, SamplingValues)").Count().GetValue()
+
+    n_events = reservoir.Merge()
+    drawn = np.empty(n_events * len(columns))
+    if n_events:
+        reservoir.Copy(drawn)
+    drawn = drawn.reshape(n_events, len(columns))
+    return {col: np.ascontiguousarray(drawn[:, i].astype(types.get(col, np.float64)))
+            for i, col in enumerate(columns)}
+
+def sample_training_set(args, variables, directory, logger):
+    """ Write the class-balanced training sample: for each final state, the
+    same number of signal and background events, at most ``args.trainingSize``,
+    is drawn from the skims of the simulated samples.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param directory: Directory where the sampled datasets are written
+    :type directory: str
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Paths to the sampled signal and background datasets
+    :rtype: tuple(list(str), list(str))
+    """
+
+    columns = list(dict.fromkeys(list(variables) + KFOLD_VARIABLES + ["Weight"]))
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    simulated_samples = [name for name in SAMPLES if not name.startswith("Run")]
+    samples = {"signal": [], "bkg": []}
+    for state_idx, final_state in enumerate(SAMPLES["SMHiggsToZZTo4L"]):
+        # Check if the final state is one of those requested by the user
+        if final_state not in args.finalState and args.finalState != "all":
+            continue
+        drawn = {}
+        for label_idx, label in enumerate(samples):
+            file_names = []
+            for sample_name in simulated_samples:
+                # Check if the sample is one of those requested by the user
+                if sample_name not in args.sample and args.sample != "all":
+                    continue
+                if (sample_name == "SMHiggsToZZTo4L") != (label == "signal"):
+                    continue
+                file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+                if final_state in SAMPLES[sample_name] and os.path.exists(file_name):
+                    file_names.append(file_name)
+            if not file_names:
+                continue
+
+            # Each final state, class and skim has its own stream of random numbers
+            seeds = [sampling_seed(state_idx, label_idx, file_idx)
+                     for file_idx in range(len(file_names))]
+            drawn[label] = reservoir_sample(file_names, columns, args.trainingSize, seeds)
+
+        # Both classes get the size of the smallest one
+        size = min([len(arrays["Weight"]) for arrays in drawn.values()]
+                   if len(drawn) == len(samples) else [0])
+        if size == 0:
+            logger.warning("No balanced training sample can be drawn for the final state %s",
+                           final_state)
+            continue
+        for label, arrays in drawn.items():
+            logger.info("Drawn %s %s events of the final state %s", size, label, final_state)
+            sample_path = os.path.join(directory, f"{label}_{final_state}.root")
+            dataset_io.numpy_dataframe({col: values[:size] for col, values in arrays.items()})\
+                .Snapshot("Events", sample_path)
+            samples[label].append(sample_path)
+
+    return samples["signal"], samples["bkg"]
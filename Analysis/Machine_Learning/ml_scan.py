@@ -0,0 +1,289 @@
+""" Scan of the architecture, of the training parameters and of the
+set of variables of the DNN. The configurations are built from the
+grid ``SCAN_GRID`` in ``dnn_model_def.py`` and are trained concurrently
+on a pool of worker processes. The features of the simulated samples
+are read only once and shared by all the workers through a block of
+shared memory. For each configuration the ROC AUC, the maximum
+significance and the training time are saved in the leaderboard
+``ML_output/Scan/leaderboard.csv``, sorted by ROC AUC.
+
+To keep the configurations comparable and the scan fast, the DNN is
+trained directly with Keras on standardised variables, and the events of
+one of the folds defined in ``ml_kfold.py`` are used as test sample.
+"""
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join("..","..", ""))
+
+from Analysis import dataset_io, parallel_tools, set_up
+from Analysis.Definitions.dnn_model_def import DNN_MODEL, SCAN_GRID
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES, VARIABLES_ML_DICT
+from Analysis.Machine_Learning import ml_kfold, ml_training
+
+# Number of folds used to split the events: fold 0 is the test sample
+SCAN_FOLDS = 5
+
+# Features shared with the worker processes
+_SHARED = {}
+
+
+def scan_configurations(size, seed=0):
+    """ Configurations of the scan.
+
+    :param size: Number of configurations randomly sampled from the grid,
+        the whole grid if 0 or larger than the grid
+    :type size: int
+    :param seed: Seed of the random sampling
+    :type seed: int
+    :return: List of the configurations
+    :rtype: list(dict)
+    """
+
+    keys = sorted(SCAN_GRID)
+    configs = [dict(zip(keys, values))
+               for values in itertools.product(*(SCAN_GRID[key] for key in keys))]
+    if 0 < size < len(configs):
+        configs = random.Random(seed).sample(configs, size)
+    return configs
+
+def roc_auc(scores, labels):
+    """ Area under the ROC curve, computed from the ranks of the scores.
+
+    :param scores: Discriminant of the events
+    :type scores: numpy.ndarray
+    :param labels: 1 for the signal events and 0 for the background ones
+    :type labels: numpy.ndarray
+    :return: ROC AUC
+    :rtype: float
+    """
+
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(scores, kind="mergesort")] = np.arange(1, len(scores) + 1)
+    # Events with the same score get the average of their ranks
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    ranks = (np.bincount(inverse, weights=ranks) / counts)[inverse]
+
+    signal = labels == 1
+    n_sig, n_bkg = signal.sum(), (~signal).sum()
+    return float((ranks[signal].sum() - n_sig * (n_sig + 1) / 2) / (n_sig * n_bkg))
+
+def max_significance(scores, labels, n_sig=100000., n_bkg=100000.):
+    """ Maximum of the significance S/sqrt(S+B) as a function of the cut on
+    the discriminant, with the same normalisation of ``GetMaximumSignificance``
+    of TMVA used in the training.
+
+    :param scores: Discriminant of the events
+    :type scores: numpy.ndarray
+    :param labels: 1 for the signal events and 0 for the background ones
+    :type labels: numpy.ndarray
+    :param n_sig: Number of signal events before the cut
+    :type n_sig: float
+    :param n_bkg: Number of background events before the cut
+    :type n_bkg: float
+    :return: Cut and maximum significance
+    :rtype: tuple(float, float)
+    """
+
+    order = np.argsort(-scores, kind="mergesort")
+    signal = labels[order] == 1
+    sig = n_sig * np.cumsum(signal) / max(signal.sum(), 1)
+    bkg = n_bkg * np.cumsum(~signal) / max((~signal).sum(), 1)
+    significance = sig / np.sqrt(sig + bkg)
+    best = int(np.argmax(significance))
+    return float(scores[order][best]), float(significance[best])
+
+def load_features(signal_files, bkg_files, columns):
+    """ Read the features of the simulated samples in a single matrix,
+    with the label and the fold of each event as additional columns.
+
+    :param signal_files: Paths to the skims of the signal samples
+    :type signal_files: list(str)
+    :param bkg_files: Paths to the skims of the background samples
+    :type bkg_files: list(str)
+    :param columns: Names of the variables to be read
+    :type columns: list(str)
+    :return: Matrix of the features and names of its columns
+    :rtype: tuple(numpy.ndarray, list(str))
+    """
+
+    blocks = []
+    for label, file_names in [(1., signal_files), (0., bkg_files)]:
+        arrays = dataset_io.open_dataset("Events", file_names).AsNumpy(columns)
+        block = np.column_stack([arrays[col] for col in columns]
+                                + [np.full(len(arrays[columns[0]]), label),
+                                   ml_kfold.fold_index(arrays, SCAN_FOLDS)])
+        blocks.append(block.astype(np.float32))
+    return np.concatenate(blocks), list(columns) + ["label", "fold"]
+
+def init_worker(shm_name, shape, columns, threads):
+    """ Attach the worker process to the shared features.
+
+    :param shm_name: Name of the block of shared memory
+    :type shm_name: str
+    :param shape: Shape of the matrix of the features
+    :type shape: tuple(int, int)
+    :param columns: Names of the columns of the matrix
+    :type columns: list(str)
+    :param threads: Number of threads of the worker
+    :type threads: int
+    """
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    except RuntimeError:
+        pass
+
+    # The block must stay open as long as the worker uses the matrix
+    _SHARED["shm"] = shared_memory.SharedMemory(name=shm_name)
+    _SHARED["features"] = np.ndarray(shape, dtype=np.float32, buffer=_SHARED["shm"].buf)
+    _SHARED["columns"] = columns
+
+def train_configuration(config):
+    """ Train and test the DNN with one configuration of the scan.
+    The function is executed in a worker process.
+
+    :param config: Configuration of the scan
+    :type config: dict
+    :return: Configuration with ROC AUC, maximum significance, cut and training time
+    :rtype: dict
+    """
+
+    start_time = time.time()
+
+    features, columns = _SHARED["features"], _SHARED["columns"]
+    variables = VARIABLES_ML_DICT[config["variables"]]
+    inputs = features[:, [columns.index(var) for var in variables]]
+    labels = features[:, columns.index("label")]
+    test = features[:, columns.index("fold")] == 0
+
+    mean = inputs[~test].mean(axis=0)
+    std = inputs[~test].std(axis=0)
+    inputs = (inputs - mean) / np.where(std > 0, std, 1.)
+    # The first node of the output is the signal one, as in TMVA
+    targets = np.column_stack([labels, 1. - labels])
+
+    model_config = dict(DNN_MODEL, **{key: value for key, value in config.items()
+                                      if key in DNN_MODEL})
+    model = ml_training.build_model(len(variables), config=model_config)
+    model.fit(inputs[~test], targets[~test], epochs=model_config["epochs"],
+              batch_size=model_config["batch_size"], verbose=0)
+    training_time = time.time() - start_time
+
+    scores = model.predict(inputs[test], batch_size=4096, verbose=0)[:, 0]
+    cut, significance = max_significance(scores, labels[test])
+
+    return dict(config, roc_auc=roc_auc(scores, labels[test]), max_significance=significance,
+                cut=cut, training_time=training_time)
+
+def write_leaderboard(results, file_path):
+    """ Write the results of the scan sorted by ROC AUC.
+
+    :param results: Results of the configurations
+    :type results: list(dict)
+    :param file_path: Path to the leaderboard
+    :type file_path: str
+    """
+
+    fields = ["rank", "roc_auc", "max_significance", "cut", "training_time"] + sorted(SCAN_GRID)
+    with open(file_path, "w", encoding="utf8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        for rank, result in enumerate(sorted(results, key=lambda res: -res["roc_auc"]), 1):
+            writer.writerow(dict(result, rank=rank))
+
+def ml_scan(args, logger):
+    """ Main function of the scan of the configurations of the DNN.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    dir_name = os.path.join(args.output, "ML_output", "Scan")
+    os.makedirs(dir_name, exist_ok=True)
+
+    signal_files, bkg_files = ml_training.collect_files(args, logger)
+    if not signal_files or not bkg_files:
+        logger.error("The scan needs both signal and background samples")
+        return
+
+    configs = scan_configurations(args.scanSize)
+    columns = sorted({var for config in configs for var in VARIABLES_ML_DICT[config["variables"]]}
+                     | set(KFOLD_VARIABLES))
+    features, columns = load_features(signal_files, bkg_files, columns)
+    logger.info(">>> Read %s events in %s s", len(features), time.time() - start_time)
+
+    n_workers, threads = parallel_tools.worker_layout(len(configs), args.nWorkers)
+    logger.info(">>> Scanning %s configurations on %s workers with %s threads each",
+                len(configs), n_workers, threads)
+
+    # The only copy of the features is the one in shared memory
+    shape = features.shape
+    shm = shared_memory.SharedMemory(create=True, size=features.nbytes)
+    np.ndarray(shape, dtype=np.float32, buffer=shm.buf)[:] = features
+    del features
+    try:
+        results = []
+        with parallel_tools.pinned_threads(threads), \
+                multiprocessing.get_context("spawn").Pool(
+                    n_workers, initializer=init_worker,
+                    initargs=(shm.name, shape, columns, threads)) as pool:
+            for result in pool.imap_unordered(train_configuration, configs):
+                results.append(result)
+                logger.info("(%s / %s) %s", len(results), len(configs), result)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    leaderboard_path = os.path.join(dir_name, "leaderboard.csv")
+    write_leaderboard(results, leaderboard_path)
+    logger.info(">>> Leaderboard saved in %s", leaderboard_path)
+
+    logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of worker processes of the scan" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-f", "--finalState",   default="all", type=str,
+                            help="comma separated list of the final states to analyse: \
+                            FourMuons,FourElectrons,TwoMuonsTwoElectrons" )
+    parser.add_argument("-s", "--sample",    default="all", type=str,
+                        help="string with comma separated list of samples to analyse: \
+                        Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
+                        Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("--scanSize",   default=0, type=int,
+                        help="number of configurations randomly sampled from the grid \
+                            of the scan, the whole grid if 0")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+
+    ml_scan(args_main, logger_main)
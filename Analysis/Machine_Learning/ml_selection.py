@@ -1,6 +1,16 @@
 """ This step consists in the selection of the events for which
-the discriminant created by the DNN is above the threshold.
-The events that pass this cut are saved in a new TTree.
+the discriminant created by the DNN is above the thresholds.
+All the thresholds, i.e. the optimal one and the working points
+``DNN_WORKING_POINTS`` of ``selections_def.py``, are evaluated in a single
+pass over each skim, and the result is stored as the per-event bitmask
+``DNNSelectionMask`` in the friend TTree ``EventsSelection`` of the skim,
+instead of copying the selected events in a new dataset.
+The selections of ``SELECTIONS`` are then applied downstream as filters
+on the bitmask. The friend TTrees can't be attached to a RNTuple, so for
+the skims stored as RNTuple the bitmask is computed on the fly from the
+discriminant and the thresholds saved in ``ML_output/selection_thresholds.json``.
+With ``--inGraphDNN`` the discriminant is computed on the fly
+by the C++ code generated in ``ml_codegen.py``.
 """
 
 import argparse
@@ -11,14 +21,124 @@ import time
 import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
-from Analysis import set_up
+from Analysis import cache_tools, dataset_io, set_up
 from Analysis.Definitions.samples_def import SAMPLES
-from Analysis.Definitions.variables_def import VARIABLES_COMPLETE
+from Analysis.Definitions.selections_def import DNN_WORKING_POINTS, SELECTION_TREE
+from Analysis.Machine_Learning import ml_codegen
 
 
+def read_cut(output, log):
+    """ Read the optimal threshold on the discriminant.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :return: Optimal threshold, or 0.12 if it can't be found
+    :rtype: float
+    """
+
+    try:
+        with open(os.path.join(output, "ML_output", "optimal_cut.txt"),
+                                "r", encoding="utf8") as file:
+            cut = file.readlines()
+        if cut[0].find("nan") != -1 or float(cut[0]) > 1:
+            raise ValueError
+    except (FileNotFoundError, IndexError, ValueError):
+        log.warning("ATTENTION: Couldn't find a valid cut value. Set the cut value to the arbitrary value of 0.12 just for reference.")
+        return 0.12
+    log.info(f" Set cut to the optimal value {cut[0]}.")
+    return float(cut[0])
+
+def thresholds_path(output):
+    """ Path of the file with the thresholds stored in the bitmask.
+
+    :param output: Path to the output folder
+    :type output: str
+    :return: Path to the file
+    :rtype: str
+    """
+
+    return os.path.join(output, "ML_output", "selection_thresholds.json")
+
+def load_thresholds(output, log):
+    """ Thresholds used to write the bitmask, or the current
+    ones if the selection step hasn't been run yet.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param log: Configured logger for printing messages.
+    :type log: logging.RootLogger
+    :return: Threshold of each bit of the mask
+    :rtype: list(float)
+    """
+
+    thresholds = cache_tools.load_manifest(thresholds_path(output)).get("thresholds")
+    if thresholds is None:
+        thresholds = [read_cut(output, log)] + list(DNN_WORKING_POINTS)
+    return thresholds
+
+def mask_expression(thresholds, column="Discriminant"):
+    """ Expression of the bitmask of the thresholds passed by the discriminant.
+
+    :param thresholds: Threshold of each bit of the mask
+    :type thresholds: list(float)
+    :param column: Column of the discriminant
+    :type column: str
+    :return: Expression of the bitmask
+    :rtype: str
+    """
+
+    bits = [f"({column} > {threshold!r} ? {1 << bit}u : 0u)"
+            for bit, threshold in enumerate(thresholds)]
+    return "static_cast<unsigned int>(" + " | ".join(bits) + ")"
+
+def has_mask(file_name):
+    """ Check if the bitmask has been stored as a friend of the skim.
+
+    :param file_name: Path to the skim
+    :type file_name: str
+    :return: True if the skim is a TTree with the friend of the bitmask
+    :rtype: bool
+    """
+
+    return (dataset_io.dataset_format(file_name, "Events") == "ttree"
+            and dataset_io.dataset_exists(file_name, SELECTION_TREE))
+
+def open_selection(file_names, thresholds, dnn_expression=None):
+    """ Create a RDataFrame of the skims with the ``DNNSelectionMask`` column,
+    read from the friend TTree when available or else computed from the
+    discriminant. If neither of them is available the column is missing.
+
+    :param file_names: Path or list of paths to the skims
+    :type file_names: str or list(str)
+    :param thresholds: Threshold of each bit of the mask
+    :type thresholds: list(float)
+    :param dnn_expression: Expression returned by ``ml_codegen.declare_model``
+        to compute the discriminant on the fly, or None
+    :type dnn_expression: str
+    :return: RDataFrame of the skims
+    :rtype: ROOT.RDataFrame
+    """
+
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    if all(has_mask(file_name) for file_name in file_names):
+        rdf = dataset_io.open_with_friend("Events", SELECTION_TREE, file_names)
+    else:
+        rdf = dataset_io.open_dataset("Events", file_names)
+
+    if dnn_expression is not None:
+        rdf = ml_codegen.define_discriminant(rdf, dnn_expression)
+    column = ml_codegen.discriminant_column(dnn_expression)
+    if not rdf.HasColumn("DNNSelectionMask") and rdf.HasColumn(column):
+        rdf = rdf.Define("DNNSelectionMask", mask_expression(thresholds, column))
+    return rdf
+
 def ml_selection(args, logger):
     """Main function for the selection of the events for which
-    the discriminant created by the DNN is above the threshold.
+    the discriminant created by the DNN is above the thresholds.
 
     :param args: Global configuration of the analysis.
     :type args: argparse.Namespace
@@ -30,25 +150,23 @@ def ml_selection(args, logger):
 
     start_time_tot = time.time()
 
-    # Enable multi-threading
-    if args.parallel:
-        ROOT.ROOT.EnableImplicitMT()
-        thread_size = ROOT.ROOT.GetThreadPoolSize()
-        logger.info(">>> Thread pool size for parallel processing: %s", thread_size)
+    # The friend TTree must have the same order of the events of the skim,
+    # which isn't guaranteed by the implicit multi-threading
+    ROOT.ROOT.DisableImplicitMT()
 
-    try:
-        # Read the optimal threshold
-        with open(os.path.join(args.output, "ML_output", "optimal_cut.txt"),
-                                "r", encoding="utf8") as file:
-            cut = file.readlines()
-        if cut[0].find("nan") != -1 or float(cut[0]) > 1:
-            raise ValueError
-    except (FileNotFoundError, ValueError):
-        logger.warning("ATTENTION: Couldn't find a valid cut value. Set the cut value to the arbitrary value of 0.12 just for reference.")
-        final_cut = 0.12
-    else:
-        logger.info(f" Set cut to the optimal value {cut[0]}.")
-        final_cut = cut[0]
+    thresholds = [read_cut(args.output, logger)] + list(DNN_WORKING_POINTS)
+    cache_tools.save_manifest(thresholds_path(args.output), {"thresholds": thresholds})
+    logger.info("Thresholds of the bits of the selection mask: %s", thresholds)
+
+    # Compile the DNN to compute the discriminant inside the event loop
+    dnn_expression = None
+    if args.inGraphDNN:
+        try:
+            dnn_expression = ml_codegen.declare_model(args.output, logger)
+        except FileNotFoundError as not_found_err:
+            logger.exception("Unable to generate the DNN code %s", not_found_err, stack_info=True)
+            logger.exception("Exit the program")
+            return
 
     #Loop over the various samples and final states
     for sample_name, final_states in SAMPLES.items():
@@ -62,40 +180,47 @@ def ml_selection(args, logger):
             logger.info(">>> Process sample: %s and final state %s", sample_name, final_state)
             start_time = time.time()
 
-            file_name=os.path.join(args.output, "Skim_data",
-                                f"{sample_name}{final_state}Skim.root")
+            file_name=dataset_io.skim_path(args.output, sample_name, final_state)
 
             # Check if file exists or not
             try:
                 if not os.path.exists(file_name):
                     raise FileNotFoundError
-                rdf = ROOT.RDataFrame("Events", file_name)
+                rdf = dataset_io.open_dataset("Events", file_name)
             except FileNotFoundError as not_fund_err:
                 logger.debug("Sample %s final state %s: File %s can't be found %s",
                                     sample_name, final_state, file_name,
                                     not_fund_err,  stack_info=True)
                 continue
 
-            file = ROOT.TFile(file_name,"READ")
-            tree= file.Get("Events")
-            branch = tree.GetListOfBranches().FindObject("Discriminant")
-            if not branch:
-                return
+            if args.inGraphDNN:
+                rdf = ml_codegen.define_discriminant(rdf, dnn_expression)
+            elif not rdf.HasColumn("Discriminant"):
+                logger.warning("Sample %s final state %s hasn't been evaluated with the DNN",
+                               sample_name, final_state)
+                continue
 
-            rdf_final = rdf.Filter(f"Discriminant>{final_cut}",
-                                    "Select only events with discriminant above threshold")
+            if dataset_io.dataset_format(file_name, "Events") == "rntuple":
+                logger.debug("The selection mask of %s is computed from the discriminant",
+                             file_name)
+                continue
 
-            if args.logLevel <= 10:
-                rdf_final.Report().Print()
-            logger.debug("%s\n", rdf_final.GetColumnNames())
+            rdf_mask = rdf.Define("DNNSelectionMask", mask_expression(
+                thresholds, ml_codegen.discriminant_column(dnn_expression)))
+            # The counts are filled in the same event loop of the snapshot
+            counts = [rdf_mask.Filter(f"(DNNSelectionMask & {1 << bit}) != 0").Count()
+                      for bit in range(len(thresholds))]
 
-            # Create another TTree of the selected events inside the preexisting file
-            option = ROOT.RDF.RSnapshotOptions("UPDATE", ROOT.kZLIB, 1, 0, 99, False, True)
+            # Store the bitmask as a friend of the skim inside the preexisting file
             try:
-                rdf_final.Snapshot("EventsDNNSelection", file_name,
-                                    VARIABLES_COMPLETE.keys(), option)
+                dataset_io.write_dataset("ttree", rdf_mask, SELECTION_TREE,
+                                         file_name, ["DNNSelectionMask"], "UPDATE")
             except TypeError:
                 logger.debug("Sample %s final state %s is empty", sample_name, final_state)
+                continue
+
+            for threshold, count in zip(thresholds, counts):
+                logger.debug("Events with discriminant above %s: %s", threshold, count.GetValue())
 
             logger.info(">>> Execution time for %s %s: %s s \n", sample_name,
                         final_state, (time.time() - start_time))
@@ -123,6 +248,9 @@ if __name__ == "__main__":
                         help="string with comma separated list of samples to analyse: \
                         Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
                         Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("--inGraphDNN",   default=False,   action="store_const",
+                        const=True, help="computes the DNN discriminant inside the \
+                            event loop with generated C++ code instead of storing it")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
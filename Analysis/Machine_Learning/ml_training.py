@@ -5,83 +5,129 @@ keras API. To take a look at the output of the training run
 The training is done using as variables the masses of the Z bosons
 and the five decay angles described in `[Phys.Rev.D86:095031,2012]
 <https://journals.aps.org/prd/abstract/10.1103/PhysRevD.86.095031>`_.
+With ``--kFolds`` larger than one, a DNN is trained for each fold
+in parallel worker processes, as described in ``ml_kfold.py``.
+With ``--trainingSize`` the DNN is trained on a class-balanced
+subsample of the simulated events drawn by ``ml_sampling.py``.
 """
 
 import argparse
 import ctypes
+import logging
+import math
+import multiprocessing
 import os
 import shutil
 import sys
 import time
 
 import ROOT
+import tensorflow as tf
 from tensorflow.keras.layers import Dense
 from tensorflow.keras.models import Sequential
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import dataset_io, parallel_tools, set_up
+from Analysis.Definitions.dnn_model_def import DNN_MODEL, TMVA_OPTIONS, TRAINING_SAMPLING
 from Analysis.Definitions.samples_def import SAMPLES
-from Analysis.Definitions.variables_ml_def import VARIABLES_ML_DICT
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES, VARIABLES_ML_DICT
+from Analysis.Machine_Learning import ml_export, ml_kfold, ml_registry, ml_sampling
 
 
-def ml_training(args, logger):
-    """Main function for the training of the DNN. The DNN is
-    trained on the simulated Monte Carlo samples.
+# Number of trainings attempted when the cut of maximum significance isn't valid
+TRAINING_ATTEMPTS = 3
 
-    :param args: Global configuration of the analysis.
-    :type args: argparse.Namespace
-    :param logger: Configured logger for printing messages.
-    :type logger: logging.RootLogger
+
+def valid_cut(cut_sig):
+    """ Check if the cut of maximum significance found by TMVA is valid.
+
+    :param cut_sig: Cut on the discriminant
+    :type cut_sig: float
+    :return: True if the cut is valid
+    :rtype: bool
     """
 
-    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+    return isinstance(cut_sig, float) and not math.isnan(cut_sig) and cut_sig <= 1
 
-    start_time = time.time()
+def build_model(n_variables, model_path=None, config=None):
+    """ Define the DNN with the architecture in ``dnn_model_def.py``
+    and save it to file, where it is read by the PyKeras method.
 
-    # Create the directory to save the outputs of the ml algorithm if doesn't already exist
-    dir_name = os.path.join(args.output, "ML_output")
-    try:
-        os.makedirs(dir_name)
-        logger.debug("Directory %s/ Created", dir_name)
-    except FileExistsError:
-        logger.debug("The directory %s/ already exists", dir_name)
+    :param n_variables: Number of input variables
+    :type n_variables: int
+    :param model_path: Path where the model is saved, if any
+    :type model_path: str
+    :param config: Architecture of the DNN, ``DNN_MODEL`` by default
+    :type config: dict
+    :return: Compiled model
+    :rtype: tensorflow.keras.models.Sequential
+    """
 
-    signal_chain=ROOT.TChain("Events")
-    bkg_chain=ROOT.TChain("Events")
+    if config is None:
+        config = DNN_MODEL
 
-    simulated_samples = {k: v for k, v in SAMPLES.items() if not k.startswith("Run")}
+    model = Sequential()
+    for i, nodes in enumerate(config["hidden_layers"]):
+        if i == 0:
+            model.add(Dense(nodes, activation=config["activation"],
+                            input_dim=n_variables))
+        else:
+            model.add(Dense(nodes, activation=config["activation"]))
+    model.add(Dense(2, activation="softmax"))
 
-    for sample_name, final_states in simulated_samples.items():
-        # Check if the sample to plot is one of those requested by the user
-        if sample_name not in args.sample and args.sample != "all":
-            continue
-        for final_state in final_states:
-            # Check if the final state is one of those requested by the user
-            if final_state not in args.finalState and args.finalState != "all":
-                continue
-            logger.debug(">>> Process sample %s and final state %s", sample_name, final_state)
-            # Check if file exists or not
-            try:
-                file_name=os.path.join(args.output, "Skim_data",
-                                f"{sample_name}{final_state}Skim.root")
-                if not os.path.exists(file_name):
-                    raise FileNotFoundError
-            except FileNotFoundError as not_found_err:
-                logger.debug("Sample %s final state %s: File %s can't be found %s",
-                                sample_name, final_state, file_name,
-                                not_found_err, stack_info=True)
-                continue
+    # Set loss and optimizer
+    model.compile(loss=config["loss"],
+                optimizer=config["optimizer"], metrics=["accuracy", ], weighted_metrics=[])
 
-            logger.info(f"Added sample {sample_name} and final state {final_state}")
+    # Store model to file
+    if model_path is not None:
+        model.save(model_path)
+        model.summary()
+    return model
+
+def book_method(factory, dataloader, model_path):
+    """ Book the PyKeras method with the options in ``dnn_model_def.py``.
+
+    :param factory: TMVA factory
+    :type factory: ROOT.TMVA.Factory
+    :param dataloader: TMVA dataloader with the training and test samples
+    :type dataloader: ROOT.TMVA.DataLoader
+    :param model_path: Path to the Keras model
+    :type model_path: str
+    :return: Booked method
+    :rtype: ROOT.TMVA.MethodBase
+    """
 
-            if sample_name == "SMHiggsToZZTo4L":
-                signal_chain.Add(file_name)
-            else:
-                bkg_chain.Add(file_name)
+    return factory.BookMethod(dataloader, ROOT.TMVA.Types.kPyKeras, "PyKeras",
+                    f"{TMVA_OPTIONS['method']}:FilenameModel={model_path}"
+                    f":NumEpochs={DNN_MODEL['epochs']}:BatchSize={DNN_MODEL['batch_size']}")
+
+def train_single(dir_name, signal_files, bkg_files, variables, logger):
+    """ Train a single DNN with a random split of the events
+    in training and test samples.
+
+    :param dir_name: Path to the ``ML_output/`` directory
+    :type dir_name: str
+    :param signal_files: Paths to the skims of the signal samples
+    :type signal_files: list(str)
+    :param bkg_files: Paths to the skims of the background samples
+    :type bkg_files: list(str)
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Cut of maximum significance, or None if the training failed
+    :rtype: float
+    """
 
+    # TMVA can only read TTrees, so the skims stored as RNTuple are converted
+    tmp_dir = os.path.join(dir_name, "tmp_trees")
+    signal_chain = dataset_io.open_chain("Events", signal_files, tmp_dir)
+    bkg_chain = dataset_io.open_chain("Events", bkg_files, tmp_dir)
 
-    for _ in range(3):
+    # The cut found by TMVA is sometimes invalid, in which case the DNN is trained again
+    for attempt in range(TRAINING_ATTEMPTS):
         # Setup TMVA
         ROOT.TMVA.Tools.Instance()
         ROOT.TMVA.PyMethodBase.PyInitialize()
@@ -90,11 +136,7 @@ def ml_training(args, logger):
         output = ROOT.TFile.Open(os.path.join(dir_name, "DNN_Training.root"), "RECREATE")
 
         factory = ROOT.TMVA.Factory("TMVAClassification", output,
-                            "!V:!Silent:Color:DrawProgressBar:Transformations=D,G\
-                            :AnalysisType=Classification")
-
-        # Variables used in the ML algorithm
-        variables=VARIABLES_ML_DICT[args.MLVariables]
+                            TMVA_OPTIONS["factory"])
 
         # Directory where the weights are saved
         dataloader = ROOT.TMVA.DataLoader("dataset")
@@ -109,33 +151,17 @@ def ml_training(args, logger):
         except TypeError as type_err:
             logger.exception("Unable to train the DNN on the simulated samples %s",
                             type_err, stack_info=True)
-            logger.exception("Exit the program")
-            return
+            output.Close()
+            return None
 
-        dataloader.PrepareTrainingAndTestTree(ROOT.TCut(""),"SplitMode=Random:NormMode=NumEvents:!V")
+        dataloader.PrepareTrainingAndTestTree(ROOT.TCut(""), TMVA_OPTIONS["dataloader"])
 
         # Generate model
-
-        # Define model
-        model = Sequential()
-        model.add(Dense(12, activation="relu", input_dim=len(variables)))
-        model.add(Dense(12, activation="relu"))
-        model.add(Dense(12, activation="relu"))
-        model.add(Dense(2, activation="softmax"))
-
-
-        # Set loss and optimizer
-        model.compile(loss="categorical_crossentropy",
-                    optimizer="adam", metrics=["accuracy", ], weighted_metrics=[])
-
-        # Store model to file
         model_path = os.path.join(dir_name,"DNNmodel.h5")
-        model.save(model_path)
-        model.summary()
+        build_model(len(variables), model_path)
 
         # Book methods
-        method = factory.BookMethod(dataloader, ROOT.TMVA.Types.kPyKeras, "PyKeras",
-                        f"H:!V:VarTransform=D,G:FilenameModel={model_path}:NumEpochs=20:BatchSize=128")
+        method = book_method(factory, dataloader, model_path)
 
         # Run training, test and evaluation
         factory.TrainAllMethods()
@@ -147,27 +173,20 @@ def ml_training(args, logger):
         c_roc.Draw()
         c_roc.Print(os.path.join(dir_name, "ml_roc.pdf"))
 
-        # Save the optimal cut
+        # Find the optimal cut
         significance = ctypes.c_double(0.)
         cut_sig = method.GetMaximumSignificance(100000, 100000, significance)
         logger.info(f"Maximum significance cut at {cut_sig}")
 
-        try:
-            if not isinstance(cut_sig, float) or cut_sig > 1:
-                raise ValueError
-        except ValueError:
-            logger.warning("ATTENTION: Maximum significance cut not valid. Performing the training again.")
-        else:
-            break
+        output.Close()
 
-    cut_path = os.path.join(dir_name, "optimal_cut.txt")
-    if os.path.exists(cut_path):
-        os.remove(cut_path)
-    with open(cut_path, "w", encoding="utf8") as file:
-        file.write(str(cut_sig))
-    logger.debug("Created file optimal_cut.txt")
+        if valid_cut(cut_sig):
+            break
+        logger.warning("ATTENTION: Maximum significance cut not valid at attempt %s of %s.",
+                       attempt + 1, TRAINING_ATTEMPTS)
 
-    output.Close()
+    # Remove the temporary TTrees converted from RNTuple
+    shutil.rmtree(tmp_dir, ignore_errors=True)
 
     # Move the dataset directory to the output folder
     dataset_dir= os.path.join(dir_name, "dataset")
@@ -178,6 +197,289 @@ def ml_training(args, logger):
         shutil.rmtree(dataset_dir)
         shutil.move("dataset", dir_name)
 
+    # Export the DNN for the NumPy runtime used in the evaluation
+    try:
+        ml_export.export_model(dir_name, variables, logger)
+    except (OSError, KeyError, RuntimeError) as export_err:
+        logger.warning("Unable to export the DNN for the NumPy runtime %s", export_err)
+
+    return cut_sig
+
+def train_fold(task):
+    """ Train the DNN of one fold. The function is executed in a worker
+    process, inside the directory of the fold, so that the TMVA outputs
+    of the various folds don't overwrite each other.
+
+    :param task: Fold index, directory, paths to the training and test trees,
+        variables, number of threads and logging level
+    :type task: dict
+    :return: Fold index, cut of maximum significance, ROC integral and training time
+    :rtype: dict
+    """
+
+    start_time = time.time()
+
+    logging.basicConfig( format="\n%(asctime)s - %(filename)s - %(message)s")
+    logger = logging.getLogger()
+    logger.setLevel(task["log_level"])
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(task["threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(task["threads"])
+    except RuntimeError:
+        logger.debug("The threads of TensorFlow are already initialized")
+
+    os.chdir(task["fold_dir"])
+
+    # Setup TMVA
+    ROOT.TMVA.Tools.Instance()
+    ROOT.TMVA.PyMethodBase.PyInitialize()
+
+    for attempt in range(TRAINING_ATTEMPTS):
+        output = ROOT.TFile.Open("DNN_Training.root", "RECREATE")
+        factory = ROOT.TMVA.Factory("TMVAClassification", output,
+                            TMVA_OPTIONS["factory"])
+
+        dataloader = ROOT.TMVA.DataLoader("dataset")
+        for variable in task["variables"]:
+            dataloader.AddVariable(variable)
+
+        # The test sample is the fold itself, the training sample all the other folds
+        tree_files = []
+        for name, tree_type in [("signal_train", ROOT.TMVA.Types.kTraining),
+                                ("signal_test", ROOT.TMVA.Types.kTesting),
+                                ("bkg_train", ROOT.TMVA.Types.kTraining),
+                                ("bkg_test", ROOT.TMVA.Types.kTesting)]:
+            tree_files.append(ROOT.TFile.Open(task["trees"][name], "READ"))
+            if name.startswith("signal"):
+                dataloader.AddSignalTree(tree_files[-1].Get("Events"), 1.0, tree_type)
+            else:
+                dataloader.AddBackgroundTree(tree_files[-1].Get("Events"), 1.0, tree_type)
+
+        dataloader.PrepareTrainingAndTestTree(ROOT.TCut(""), TMVA_OPTIONS["dataloader"])
+
+        model_path = os.path.join(task["fold_dir"], "DNNmodel.h5")
+        build_model(len(task["variables"]), model_path)
+        method = book_method(factory, dataloader, model_path)
+
+        factory.TrainAllMethods()
+        factory.TestAllMethods()
+        factory.EvaluateAllMethods()
+
+        roc_auc = factory.GetROCIntegral(dataloader, "PyKeras")
+        c_roc=factory.GetROCCurve(dataloader)
+        c_roc.Draw()
+        c_roc.Print("ml_roc.pdf")
+
+        significance = ctypes.c_double(0.)
+        cut_sig = method.GetMaximumSignificance(100000, 100000, significance)
+
+        output.Close()
+        for tree_file in tree_files:
+            tree_file.Close()
+
+        if valid_cut(cut_sig):
+            break
+        logger.warning("ATTENTION: Maximum significance cut of fold %s not valid at "
+                       "attempt %s of %s.", task["fold"], attempt + 1, TRAINING_ATTEMPTS)
+
+    return {
+        "fold": task["fold"],
+        "cut": cut_sig if valid_cut(cut_sig) else None,
+        "significance": significance.value,
+        "roc_auc": roc_auc,
+        "time": time.time() - start_time,
+    }
+
+def train_folds(args, signal_files, bkg_files, variables, logger):
+    """ Train a DNN for each fold in parallel worker processes.
+    The number of threads of each worker is limited, so that
+    the workers together don't use more than the available cores.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param signal_files: Paths to the skims of the signal samples
+    :type signal_files: list(str)
+    :param bkg_files: Paths to the skims of the background samples
+    :type bkg_files: list(str)
+    :param variables: Names of the variables used in the ML algorithm
+    :type variables: list(str)
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Average of the cuts of maximum significance of the folds,
+        nan if one of them isn't valid or can't be exported
+    :rtype: float
+    """
+
+    directory = ml_kfold.folds_dir(args.output)
+    ml_kfold.clear_folds(args.output)
+    trees = ml_kfold.split_folds(signal_files, bkg_files, variables, args.kFolds, directory)
+
+    n_workers, threads = parallel_tools.worker_layout(args.kFolds, args.nWorkers)
+    logger.info(">>> Training %s folds on %s workers with %s threads each",
+                args.kFolds, n_workers, threads)
+
+    tasks = [{
+        "fold": fold,
+        "fold_dir": os.path.abspath(os.path.join(directory, f"fold{fold}")),
+        "trees": {name: os.path.abspath(path) for name, path in trees[fold].items()},
+        "variables": list(variables),
+        "threads": threads,
+        "log_level": logger.level,
+    } for fold in range(args.kFolds)]
+
+    with parallel_tools.pinned_threads(threads), \
+            multiprocessing.get_context("spawn").Pool(n_workers) as pool:
+        results = pool.map(train_fold, tasks)
+
+    exported = True
+    for task, result in zip(tasks, results):
+        logger.info("Fold %s: ROC integral %s, maximum significance cut at %s, "
+                    "training time %s s", result["fold"], result["roc_auc"],
+                    result["cut"], result["time"])
+        for tree_path in task["trees"].values():
+            os.remove(tree_path)
+        try:
+            ml_export.export_model(task["fold_dir"], variables, logger)
+        except (OSError, KeyError, RuntimeError) as export_err:
+            logger.error("Unable to export the DNN of fold %s for the NumPy runtime %s",
+                         result["fold"], export_err)
+            exported = False
+
+    # The folds are evaluated only with the NumPy runtime, so a fold
+    # that can't be exported invalidates the whole training
+    if not exported:
+        ml_kfold.clear_folds(args.output)
+        return float("nan")
+
+    ml_kfold.save_folds(args.output, {
+        "k_folds": args.kFolds,
+        "fold_variables": KFOLD_VARIABLES,
+        "variables": list(variables),
+        "folds": results,
+    })
+
+    # A fold without a valid cut invalidates the whole training
+    cuts = [result["cut"] for result in results]
+    return sum(cuts) / len(cuts) if None not in cuts else float("nan")
+
+def collect_files(args, logger):
+    """ Collect the skims of the simulated samples used in the training.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Paths to the skims of the signal and of the background samples
+    :rtype: tuple(list(str), list(str))
+    """
+
+    signal_files = []
+    bkg_files = []
+
+    simulated_samples = {k: v for k, v in SAMPLES.items() if not k.startswith("Run")}
+
+    for sample_name, final_states in simulated_samples.items():
+        # Check if the sample to plot is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
+                continue
+            logger.debug(">>> Process sample %s and final state %s", sample_name, final_state)
+            # Check if file exists or not
+            try:
+                file_name=dataset_io.skim_path(args.output, sample_name, final_state)
+                if not os.path.exists(file_name):
+                    raise FileNotFoundError
+            except FileNotFoundError as not_found_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_found_err, stack_info=True)
+                continue
+
+            logger.info(f"Added sample {sample_name} and final state {final_state}")
+
+            if sample_name == "SMHiggsToZZTo4L":
+                signal_files.append(file_name)
+            else:
+                bkg_files.append(file_name)
+
+    return signal_files, bkg_files
+
+def ml_training(args, logger):
+    """Main function for the training of the DNN. The DNN is
+    trained on the simulated Monte Carlo samples.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    # Create the directory to save the outputs of the ml algorithm if doesn't already exist
+    dir_name = os.path.join(args.output, "ML_output")
+    try:
+        os.makedirs(dir_name)
+        logger.debug("Directory %s/ Created", dir_name)
+    except FileExistsError:
+        logger.debug("The directory %s/ already exists", dir_name)
+
+    signal_files, bkg_files = collect_files(args, logger)
+
+    # Variables used in the ML algorithm
+    variables=VARIABLES_ML_DICT[args.MLVariables]
+
+    # Reuse the outputs of a previous training with the same configuration
+    sampling = dict(TRAINING_SAMPLING, size=args.trainingSize) if args.trainingSize > 0 else None
+    fingerprint = ml_registry.training_fingerprint(signal_files, bkg_files, variables,
+                                                   args.kFolds, sampling)
+    if not args.force and ml_registry.restore(args.output, fingerprint, logger):
+        ml_registry.evict(args.output, args.registrySize, args.registryAge, logger)
+        logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+        return
+
+    # Draw the class-balanced training sample from the skims
+    sample_dir = os.path.join(dir_name, "tmp_sample")
+    if sampling is not None:
+        signal_files, bkg_files = ml_sampling.sample_training_set(args, variables,
+                                                                  sample_dir, logger)
+        if not signal_files or not bkg_files:
+            logger.error("The training sample needs both signal and background events")
+            return
+
+    if args.kFolds > 1:
+        cut_sig = train_folds(args, signal_files, bkg_files, variables, logger)
+    else:
+        # Remove the outputs of a previous k-fold training
+        ml_kfold.clear_folds(args.output)
+        cut_sig = train_single(dir_name, signal_files, bkg_files, variables, logger)
+        if cut_sig is None:
+            logger.exception("Exit the program")
+            return
+
+    shutil.rmtree(sample_dir, ignore_errors=True)
+
+    if not valid_cut(cut_sig):
+        logger.error("ATTENTION: Maximum significance cut not valid after %s attempts, "
+                     "the trained DNN isn't saved", TRAINING_ATTEMPTS)
+        return
+
+    cut_path = os.path.join(dir_name, "optimal_cut.txt")
+    if os.path.exists(cut_path):
+        os.remove(cut_path)
+    with open(cut_path, "w", encoding="utf8") as file:
+        file.write(str(cut_sig))
+    logger.debug("Created file optimal_cut.txt")
+
+    # Save the outputs in the registry and remove the old entries
+    ml_registry.store(args.output, fingerprint, logger)
+    ml_registry.evict(args.output, args.registrySize, args.registryAge, logger)
 
     logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
 
@@ -201,6 +503,19 @@ if __name__ == "__main__":
                         help="string with comma separated list of samples to analyse: \
                         Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
                         Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of workers for the k-fold training" )
+    parser.add_argument("-K", "--kFolds",   default=1, type=int,
+                        help="number of folds of the k-fold training")
+    parser.add_argument("--trainingSize",   default=0, type=int,
+                        help="number of signal and of background events of each final state \
+                            drawn for the training, all the events if 0")
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="disables the reuse of cached results")
+    parser.add_argument("--registrySize",   default=5, type=int,
+                        help="maximum number of trained models kept in the registry")
+    parser.add_argument("--registryAge",   default=30., type=float,
+                        help="maximum age in days of the trained models kept in the registry")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
@@ -0,0 +1,222 @@
+""" In-memory index of the histograms of the histogramming step.
+``Histograms.root`` is read once and the content of the histograms named
+``{sample}_{final_state}_{variable}_{selection}`` is stored in arrays indexed
+by (variable and selection, sample, final state, bin), together with the
+edges of the bins of each variable. The sums over the samples and the final
+states, the normalized and the stacked distributions are then computed
+from the arrays. The index can be exported in ``Histograms/Index/`` as
+NumPy files, which are memory-mapped when read, so that the processes
+rendering the plots share the same pages instead of reading the ROOT file.
+"""
+
+import os
+
+import numpy as np
+import ROOT
+
+from Analysis import cache_tools
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.selections_def import SELECTIONS
+from Analysis.Histogramming import histogram_cube
+from Analysis.Histogramming.histogramming_functions import histogram_to_numpy
+
+FINAL_STATES = ["FourMuons", "FourElectrons", "TwoMuonsTwoElectrons"]
+
+
+def parse_name(name):
+    """ Split the name of a histogram in its sample, final state, variable and selection.
+
+    :param name: Name of the histogram
+    :type name: str
+    :return: Sample, final state, variable and selection, or None
+        if the name doesn't follow the convention of the histogramming step
+    :rtype: tuple(str)
+    """
+
+    for sample in sorted(SAMPLES, key=len, reverse=True):
+        if not name.startswith(f"{sample}_"):
+            continue
+        rest = name[len(sample) + 1:]
+        for final_state in FINAL_STATES:
+            if not rest.startswith(f"{final_state}_"):
+                continue
+            rest = rest[len(final_state) + 1:]
+            for selection in SELECTIONS:
+                if rest.endswith(f"_{selection}"):
+                    return sample, final_state, rest[:-len(selection) - 1], selection
+    return None
+
+def _lookup(index):
+    """ Add to the index the positions of its keys, samples and final states.
+    """
+
+    index["key_pos"] = {tuple(key): pos for pos, key in enumerate(index["keys"])}
+    index["sample_pos"] = {sample: pos for pos, sample in enumerate(index["samples"])}
+    index["state_pos"] = {state: pos for pos, state in enumerate(index["final_states"])}
+    return index
+
+def read_root(file_path):
+    """ Build the index of the 1D histograms of a ROOT file, reading it once.
+
+    :param file_path: Path to the file
+    :type file_path: str
+    :raises FileNotFoundError: Raised when the file can't be opened
+    :return: Index of the histograms
+    :rtype: dict
+    """
+
+    infile = ROOT.TFile.Open(file_path, "READ")
+    if not infile or infile.IsZombie():
+        raise FileNotFoundError(f"Failed to open {file_path}")
+
+    contents = {}
+    edges = {}
+    for key in infile.GetListOfKeys():
+        parsed = parse_name(key.GetName())
+        if parsed is None or not key.GetClassName().startswith("TH1"):
+            continue
+        sample, final_state, variable, selection = parsed
+        histo = key.ReadObj()
+        axis = histo.GetXaxis()
+        edges[variable] = np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+        contents[(variable, selection, sample, final_state)] = (
+            histogram_to_numpy(histo),
+            np.array([histo.GetBinError(i)**2 for i in range(histo.GetNcells())]))
+    infile.Close()
+
+    keys = sorted({(variable, selection) for variable, selection, _, _ in contents})
+    samples = [sample for sample in SAMPLES
+               if any(key[2] == sample for key in contents)]
+    n_cells = max((len(edge) + 1 for edge in edges.values()), default=0)
+    shape = (len(keys), len(samples), len(FINAL_STATES), n_cells)
+    index = _lookup({"keys": [list(key) for key in keys], "samples": samples,
+                     "final_states": list(FINAL_STATES), "edges": edges,
+                     "sumw": np.zeros(shape), "sumw2": np.zeros(shape),
+                     "filled": np.zeros(shape[:3], dtype=bool)})
+    for (variable, selection, sample, final_state), (sumw, sumw2) in contents.items():
+        pos = (index["key_pos"][(variable, selection)], index["sample_pos"][sample],
+               index["state_pos"][final_state])
+        index["sumw"][pos][:len(sumw)] = sumw
+        index["sumw2"][pos][:len(sumw2)] = sumw2
+        index["filled"][pos] = True
+    return index
+
+def save_index(index, dir_name):
+    """ Export the index as NumPy files.
+
+    :param index: Index of the histograms
+    :type index: dict
+    :param dir_name: Directory of the export
+    :type dir_name: str
+    """
+
+    os.makedirs(dir_name, exist_ok=True)
+    for name in ["sumw", "sumw2", "filled"]:
+        np.save(os.path.join(dir_name, f"{name}.npy"), index[name])
+    cache_tools.save_manifest(os.path.join(dir_name, "index.json"), {
+        "keys": index["keys"], "samples": index["samples"],
+        "final_states": index["final_states"],
+        "edges": {variable: list(edge) for variable, edge in index["edges"].items()}})
+
+def load_index(dir_name):
+    """ Read the index exported by ``save_index``, memory-mapping the arrays.
+
+    :param dir_name: Directory of the export
+    :type dir_name: str
+    :raises FileNotFoundError: Raised when the export can't be found
+    :return: Index of the histograms
+    :rtype: dict
+    """
+
+    meta_path = os.path.join(dir_name, "index.json")
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"Failed to open {meta_path}")
+    index = cache_tools.load_manifest(meta_path)
+    index["edges"] = {variable: np.array(edge) for variable, edge in index["edges"].items()}
+    for name in ["sumw", "sumw2", "filled"]:
+        index[name] = np.load(os.path.join(dir_name, f"{name}.npy"), mmap_mode="r")
+    return _lookup(index)
+
+def view(index, samples, final_state, variable, selection):
+    """ Sum of the histograms of some samples in a final state.
+
+    :param index: Index of the histograms
+    :type index: dict
+    :param samples: Names of the samples
+    :type samples: list(str)
+    :param final_state: Final state
+    :type final_state: str
+    :param variable: Name of the variable
+    :type variable: str
+    :param selection: Name of the selection
+    :type selection: str
+    :raises KeyError: Raised when none of the histograms is in the index
+    :return: Sum of the weights and of the squared weights in each bin,
+        including underflow and overflow
+    :rtype: tuple(numpy.ndarray)
+    """
+
+    key = index["key_pos"].get((variable, selection))
+    state = index["state_pos"][final_state]
+    rows = [] if key is None else [index["sample_pos"][sample] for sample in samples
+                                   if sample in index["sample_pos"] and
+                                   index["filled"][key, index["sample_pos"][sample], state]]
+    if not rows:
+        raise KeyError(f"Failed to load histogram {variable} {selection} "
+                       f"of {', '.join(samples)} in {final_state}")
+    n_cells = len(index["edges"][variable]) + 1
+    return (np.asarray(index["sumw"][key, rows, state, :n_cells]).sum(axis=0),
+            np.asarray(index["sumw2"][key, rows, state, :n_cells]).sum(axis=0))
+
+def combine(views):
+    """ Sum of the views of all the final states.
+
+    :param views: Views of each final state
+    :type views: dict(str, tuple(numpy.ndarray))
+    :raises KeyError: Raised when one of the final states is missing
+    :return: Sum of the weights and of the squared weights in each bin
+    :rtype: tuple(numpy.ndarray)
+    """
+
+    return add(*[views[final_state] for final_state in FINAL_STATES])
+
+def add(*views):
+    """ Sum of some views, e.g. signal and background stacked.
+
+    :param views: Sum of the weights and of the squared weights in each bin
+    :type views: tuple(numpy.ndarray)
+    :return: Sum of the weights and of the squared weights in each bin
+    :rtype: tuple(numpy.ndarray)
+    """
+
+    return sum(view_[0] for view_ in views), sum(view_[1] for view_ in views)
+
+def normalize(view_):
+    """ View scaled to an integral of 100 over the bins, without underflow and overflow.
+
+    :param view_: Sum of the weights and of the squared weights in each bin
+    :type view_: tuple(numpy.ndarray)
+    :return: Normalized sum of the weights and of the squared weights in each bin
+    :rtype: tuple(numpy.ndarray)
+    """
+
+    integral = view_[0][1:-1].sum()
+    if integral == 0:
+        return view_
+    scale = 100. / integral
+    return view_[0] * scale, view_[1] * scale**2
+
+def to_histogram(name, view_, edges):
+    """ Convert a view to a ROOT histogram to be drawn.
+
+    :param name: Name of the histogram
+    :type name: str
+    :param view_: Sum of the weights and of the squared weights in each bin
+    :type view_: tuple(numpy.ndarray)
+    :param edges: Edges of the bins
+    :type edges: numpy.ndarray
+    :return: Histogram
+    :rtype: ROOT.TH1D
+    """
+
+    return histogram_cube.to_histogram(name, view_[0], np.sqrt(view_[1]), [edges])
@@ -1,7 +1,18 @@
 """ The plotting combines the histograms to plots which allow to study the
 inital dataset based on observables motivated through physics.
+The histograms are read once in the index of ``histogram_index.py``, which
+is exported as memory-mapped NumPy arrays, and the sums over the samples
+and final states are computed from it.
+The plots of each selection and variable are an independent job: the jobs
+are rendered in batch mode by a pool of worker processes, which share
+the memory-mapped index.
+The manifest ``Plots/plot_manifest.json`` records a fingerprint of the
+content of the histograms, of the style and of the labels of each plot,
+and the plots whose fingerprint didn't change aren't rendered again.
 """
 import argparse
+import logging
+import multiprocessing
 import os
 import sys
 import time
@@ -10,13 +21,246 @@ import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import cache_tools, parallel_tools, set_up
 from Analysis.Definitions.selections_def import SELECTIONS
 from Analysis.Definitions.variables_def import VARIABLES_DICT
-from Analysis.Plotting import plotting_functions
+from Analysis.Plotting import histogram_index, plotting_functions
 
 ROOT.gROOT.SetBatch(True)
 
+# Index of the histograms and configuration of the process rendering the plots
+_WORKER = {}
+
+# Samples summed in each type of distribution and final state
+PLOT_SAMPLES = {
+    "data": {
+        "FourMuons": ["Run2012B_DoubleMuParked", "Run2012C_DoubleMuParked"],
+        "FourElectrons": ["Run2012B_DoubleElectron", "Run2012C_DoubleElectron"],
+        "TwoMuonsTwoElectrons": ["Run2012B_DoubleMuParked", "Run2012C_DoubleMuParked",
+                                 "Run2012B_DoubleElectron", "Run2012C_DoubleElectron"],
+    },
+    "background": {
+        "FourMuons": ["ZZTo4mu"],
+        "FourElectrons": ["ZZTo4e"],
+        "TwoMuonsTwoElectrons": ["ZZTo2e2mu"],
+    },
+    "signal": {
+        "FourMuons": ["SMHiggsToZZTo4L"],
+        "FourElectrons": ["SMHiggsToZZTo4L"],
+        "TwoMuonsTwoElectrons": ["SMHiggsToZZTo4L"],
+    },
+}
+
+
+def init_worker(config):
+    """ Load the index of the histograms in the process rendering the plots.
+
+    :param config: Output folder, samples, final states, types of distributions,
+        use of the DNN and logging level
+    :type config: dict
+    """
+
+    logging.basicConfig( format="\n%(asctime)s - %(filename)s - %(message)s")
+    log = logging.getLogger()
+    log.setLevel(config["log_level"])
+
+    ROOT.gROOT.SetBatch(True)
+    if config["log_level"] >= 20:
+        ROOT.gErrorIgnoreLevel = ROOT.kWarning
+    plotting_functions.set_style()
+
+    index = histogram_index.load_index(os.path.join(config["output"], "Histograms", "Index"))
+    _WORKER.update(log=log, index=index, config=config)
+
+def plot_histograms(inputs_dict, input_type, final_state):
+    """ Histograms drawn in a plot.
+
+    :param inputs_dict: Histograms of each type of distribution and final state
+    :type inputs_dict: dict
+    :param input_type: Type of distribution of the plot
+    :type input_type: str
+    :param final_state: Final state of the plot
+    :type final_state: str
+    :raises KeyError: Raised when one of the histograms is missing
+    :return: Histograms of the plot
+    :rtype: list(ROOT.TH1D)
+    """
+
+    if input_type == "sig_bkg_normalized":
+        return [inputs_dict[input_type][0][final_state], inputs_dict[input_type][1][final_state]]
+    if input_type == "total":
+        return [inputs_dict[input_key][final_state] for input_key in inputs_dict[input_type]]
+    return [inputs_dict[input_type][final_state]]
+
+def plot_variable(job):
+    """ Render all the plots of a variable with a given selection,
+    for each type of distribution and final state.
+
+    :param job: Selection and name of the variable
+    :type job: tuple(str, str)
+    :return: Job, number of plots saved and reused, fingerprints of the plots,
+        execution time and process that rendered them
+    :rtype: dict
+    """
+
+    start_time = time.time()
+    selection, variable = job
+    log, config = _WORKER["log"], _WORKER["config"]
+    var_dict = VARIABLES_DICT["tot"] if config["ml"] else VARIABLES_DICT["part"]
+    n_plots = 0
+    n_reused = 0
+    fingerprints = {}
+
+    # Sum the histograms of the samples of each type of distribution
+    index = _WORKER["index"]
+    views = {}
+    for input_type, samples_by_state in PLOT_SAMPLES.items():
+        views[input_type] = {}
+        for final_state, samples in samples_by_state.items():
+            # Check if the samples to plot are among those requested by the user
+            samples = [sample for sample in samples
+                       if sample in config["sample"] or config["sample"] == "all"]
+            try:
+                views[input_type][final_state] = histogram_index.view(
+                    index, samples, final_state, variable, selection)
+            except KeyError as key_err:
+                log.debug("ERROR:  %s ", key_err,  stack_info=True)
+        try:
+            views[input_type]["Combined"] = histogram_index.combine(views[input_type])
+        except KeyError:
+            log.debug("ERROR: Failed to create the %s histogram of the combined final states",
+                      input_type, stack_info=True)
+
+    edges = index["edges"].get(variable)
+    def histograms(input_type, transform=lambda view_: view_):
+        return {final_state: histogram_index.to_histogram(
+                    f"{input_type}_{final_state}_{variable}", transform(view_), edges)
+                for final_state, view_ in views[input_type].items()}
+
+    data = histograms("data")
+    backgrounds = histograms("background")
+    signals = histograms("signal")
+    backgrounds_norm = histograms("background", histogram_index.normalize)
+    signals_norm = histograms("signal", histogram_index.normalize)
+
+    # Signal stacked on top of the background
+    stacked = {final_state: histogram_index.to_histogram(
+                   f"stacked_{final_state}_{variable}",
+                   histogram_index.add(views["signal"][final_state],
+                                       views["background"][final_state]), edges)
+               for final_state in views["signal"] if final_state in views["background"]}
+
+    # Dictionary for the different types of datasets
+    inputs_dict = {
+        "data" : data,
+        "background" : backgrounds,
+        "signal" : signals,
+        "sig_bkg_normalized" : [backgrounds_norm, signals_norm],
+        "total" : ["data", "background", "signal"]
+    }
+
+    # Loop over the types of datasets and the final states
+    for input_type, inputs in inputs_dict.items():
+
+        # Check if the input_type to plot is one of those requested by the user
+        if input_type not in config["typeDistribution"] and config["typeDistribution"] != "all":
+            continue
+
+        # Create the directory to save the plots if doesn't already exist
+        dir_name = os.path.join(config["output"], "Plots", selection, input_type)
+        try:
+            os.makedirs(dir_name)
+            log.debug("Directory %s/ Created", dir_name)
+        except FileExistsError:
+            log.debug("The directory %s/ already exists", dir_name)
+
+        for final_state in ["FourMuons", "FourElectrons",
+                            "TwoMuonsTwoElectrons", "Combined"]:
+
+            if final_state not in config["finalState"] and config["finalState"] != "all":
+                continue
+
+            file_name = f"{input_type}_{final_state}_{variable}_{selection}.pdf"
+            complete_name = os.path.join(dir_name, file_name)
+            plot_key = os.path.join(selection, input_type, file_name)
+
+            # Skip the plots whose histograms, style, drawing code and labels didn't change
+            try:
+                fingerprints[plot_key] = plotting_functions.plot_fingerprint(
+                    plot_histograms(inputs_dict, input_type, final_state),
+                    [plot_histograms, plot_variable], var_dict[variable])
+            except KeyError:
+                log.debug("ERROR: Failed to create the plot for %s_%s_%s_%s",
+                        input_type, final_state, variable, selection, stack_info=True)
+                continue
+            if config["manifest"].get(plot_key) == fingerprints[plot_key] and \
+                    os.path.exists(complete_name):
+                n_reused += 1
+                continue
+
+            canvas = ROOT.TCanvas("", "", 600, 600)
+            legend = ROOT.TLegend(0.5, 0.7, 0.8, 0.9)
+            legend.SetBorderSize(0)
+
+            try:
+                if input_type in ["data", "background", "signal"]:
+                    input_histo = inputs[final_state]
+                    plotting_functions.input_style(input_type, input_histo)
+                    plotting_functions.add_title(input_histo, var_dict[variable])
+                    input_histo.SetMaximum(input_histo.GetMaximum() * 1.4)
+                    if input_type == "data":
+                        input_histo.Draw("E1P")
+                    elif input_type in ("background", "signal"):
+                        input_histo.Draw("HIST")
+                    legend=plotting_functions.add_legend(legend, input_type, input_histo)
+                    legend.Draw()
+
+                elif input_type == "sig_bkg_normalized":
+                    bkg_norm = inputs[0][final_state]
+                    sig_norm = inputs[1][final_state]
+                    plotting_functions.input_style("background", bkg_norm)
+                    plotting_functions.input_style("signal", sig_norm)
+                    plotting_functions.add_title(bkg_norm, var_dict[variable])
+                    bkg_norm.SetMaximum(max(bkg_norm.GetMaximum(),
+                                            sig_norm.GetMaximum()) * 1.5)
+                    bkg_norm.Draw("HIST")
+                    sig_norm.Draw("HIST SAME")
+                    legend=plotting_functions.add_legend(legend, "background", bkg_norm)
+                    legend=plotting_functions.add_legend(legend, "signal", sig_norm)
+                    legend.Draw()
+
+                elif input_type == "total":
+
+                    # The signal is stacked on top of the background
+                    # in order to compare it with the data.
+                    for input_key in inputs:
+                        input_histo=inputs_dict[input_key][final_state]
+                        plotting_functions.input_style(input_key, input_histo)
+                        legend=plotting_functions.add_legend(legend, input_key, input_histo)
+
+                    plotting_functions.input_style("signal", stacked[final_state])
+                    plotting_functions.add_title(stacked[final_state], var_dict[variable])
+                    stacked[final_state].SetMaximum(
+                                        max(backgrounds[final_state].GetMaximum(),
+                                        data[final_state].GetMaximum()) * 1.4)
+                    stacked[final_state].Draw("HIST")
+                    backgrounds[final_state].Draw("HIST SAME")
+                    data[final_state].Draw("E1P SAME")
+                    legend.Draw()
+
+                plotting_functions.add_latex()
+
+                # Save the plots
+                canvas.SaveAs(complete_name)
+                n_plots += 1
+
+            except KeyError:
+                fingerprints.pop(plot_key)
+                log.debug("ERROR: Failed to create the plot for %s_%s_%s_%s",
+                        input_type, final_state, variable, selection, stack_info=True)
+
+    return {"job": job, "plots": n_plots, "reused": n_reused, "fingerprints": fingerprints,
+            "time": time.time() - start_time, "worker": os.getpid()}
 
 def make_plot (args, logger):
     """ Main function of the plotting step. The plotting takes for
@@ -30,225 +274,90 @@ def make_plot (args, logger):
     :type args: argparse.Namespace
     :param logger: Configured logger for printing messages.
     :type logger: logging.RootLogger
-    :param path: Optional base path where the directories
-        ``Histograms/`` and ``Plots/`` can be found.
-    :type path: str
     """
 
     logger.info(">>> Executing %s \n", os.path.basename(__file__))
 
     start_time = time.time()
 
-    if args.logLevel >= 20:
-        ROOT.gErrorIgnoreLevel = ROOT.kWarning
-
+    # Read the histograms once and export their index for the workers,
+    # or use an existing export if the ROOT file isn't available
     infile_path = os.path.join(args.output, "Histograms", "Histograms.root")
-    # Check if file exists or not
+    index_dir = os.path.join(args.output, "Histograms", "Index")
     try:
-        if not os.path.exists(infile_path):
+        if os.path.exists(infile_path):
+            histogram_index.save_index(histogram_index.read_root(infile_path), index_dir)
+        elif not os.path.exists(os.path.join(index_dir, "index.json")):
             raise FileNotFoundError
-        infile = ROOT.TFile(infile_path, "READ")
     except FileNotFoundError as not_fund_err:
         logger.exception("File %s can't be found %s",
                         infile_path, not_fund_err,  stack_info=True)
         return
 
-    plotting_functions.set_style()
-
     if args.ml :
         var_dict = VARIABLES_DICT["tot"]
     else :
         var_dict = VARIABLES_DICT["part"]
 
-    variables = var_dict.keys()
-
+    # Each selection and variable to plot is an independent job
+    jobs = []
     for selection in SELECTIONS.keys():
-        logger.info(">>> Processing %s\n", selection)
-
-        for variable in variables:
+        for variable in var_dict.keys():
             # Check if the variable to plot is one of those requested by the user
             if (variable not in args.variableDistribution
                 and args.variableDistribution != "all") or variable == "Weight":
                 continue
-
-            # Get histograms for the signal
-            signals = {}
-
-            # Check if the sample to plot is one of those requested by the user
-            if "SMHiggsToZZTo4L" in args.sample or args.sample == "all":
-                for final_state in ["FourMuons", "FourElectrons", "TwoMuonsTwoElectrons"]:
-                    histo_name = f"SMHiggsToZZTo4L_{final_state}_{variable}_{selection}"
-                    try:
-                        signals[final_state] = plotting_functions.get_histogram(infile, histo_name)
-                    except RuntimeError as run_time_err:
-                        logger.debug("ERROR:  %s ", run_time_err,  stack_info=True)
-
-                try:
-                    plotting_functions.combine_final_states(signals)
-                except KeyError:
-                    logger.debug(
-                       "ERROR: Failed to create the signal histogram of the combined final states",
-                        stack_info=True)
-
-            # Get the normalized histograms for the signal
-            signals_norm = {}
-            for final_state, signal_histo in signals.items():
-                histo = signal_histo.Clone()
-                histo.Scale(1/histo.Integral()*100)
-                signals_norm[final_state] = histo
-
-            # Get histograms for the background
-            backgrounds = {}
-            for sample, final_state in {"ZZTo4mu":"FourMuons",
-                                        "ZZTo4e":"FourElectrons",
-                                        "ZZTo2e2mu":"TwoMuonsTwoElectrons"
-                    }.items():
-                # Check if the sample to plot is one of those requested by the user
-                if sample not in args.sample and args.sample != "all":
-                    continue
-                try:
-                    backgrounds[final_state] = plotting_functions.get_histogram(infile,
-                                f"{sample}_{final_state}_{variable}_{selection}")
-                except RuntimeError as run_time_err:
-                    logger.debug("ERROR:  %s ", run_time_err,  stack_info=True)
-
-            try:
-                plotting_functions.combine_final_states(backgrounds)
-            except KeyError:
-                logger.debug(
-                   "ERROR: Failed to create the background histogram of the combined final states",
-                    stack_info=True)
-
-            # Get the normalized histograms for the background
-            backgrounds_norm = {}
-            for final_state, background_histo in backgrounds.items():
-                histo = background_histo.Clone()
-                histo.Scale(1/histo.Integral()*100)
-                backgrounds_norm[final_state] = histo
-
-            # Get histograms for the data
-            data = {}
-            for final_state, samples in [
-                        ["FourMuons", ["Run2012B_DoubleMuParked",
-                                        "Run2012C_DoubleMuParked"]],
-                        ["FourElectrons", ["Run2012B_DoubleElectron",
-                                            "Run2012C_DoubleElectron"]],
-                        ["TwoMuonsTwoElectrons", ["Run2012B_DoubleMuParked",
-                                                    "Run2012C_DoubleMuParked",
-                                                    "Run2012B_DoubleElectron",
-                                                    "Run2012C_DoubleElectron"]]
-                    ]:
-                for sample in samples:
-                    # Check if the sample to plot is one of those requested by the user
-                    if sample not in args.sample and args.sample != "all":
-                        continue
-                    try:
-                        histo = plotting_functions.get_histogram(infile,
-                                    f"{sample}_{final_state}_{variable}_{selection}")
-                        if not final_state in data:
-                            data[final_state] = histo
-                        else:
-                            data[final_state].Add(histo)
-                    except RuntimeError as run_time_err:
-                        logger.debug("ERROR:  %s ", run_time_err,  stack_info=True)
-
-            try:
-                plotting_functions.combine_final_states(data)
-            except KeyError:
-                logger.debug(
-                   "ERROR: Failed to create the data histogram of the combined final states",
-                    stack_info=True)
-
-            # Dictionary for the different types of datasets
-            inputs_dict = {
-                "data" : data,
-                "background" : backgrounds,
-                "signal" : signals,
-                "sig_bkg_normalized" : [backgrounds_norm, signals_norm],
-                "total" : ["data", "background", "signal"]
-            }
-
-            # Loop over the types of datasets and the final states
-            for input_type, inputs in inputs_dict.items():
-
-                # Check if the input_type to plot is one of those requested by the user
-                if input_type not in args.typeDistribution and args.typeDistribution != "all":
-                    continue
-
-                # Create the directory to save the plots if doesn't already exist
-                dir_name = os.path.join(args.output, "Plots", selection, input_type)
-                try:
-                    os.makedirs(dir_name)
-                    logger.debug("Directory %s/ Created", dir_name)
-                except FileExistsError:
-                    logger.debug("The directory %s/ already exists", dir_name)
-
-                for final_state in ["FourMuons", "FourElectrons",
-                                    "TwoMuonsTwoElectrons", "Combined"]:
-
-                    if final_state not in args.finalState and args.finalState != "all":
-                        continue
-
-                    canvas = ROOT.TCanvas("", "", 600, 600)
-                    legend = ROOT.TLegend(0.5, 0.7, 0.8, 0.9)
-                    legend.SetBorderSize(0)
-
-                    try:
-                        if input_type in ["data", "background", "signal"]:
-                            input_histo = inputs[final_state]
-                            plotting_functions.input_style(input_type, input_histo)
-                            plotting_functions.add_title(input_histo, var_dict[variable])
-                            input_histo.SetMaximum(input_histo.GetMaximum() * 1.4)
-                            if input_type == "data":
-                                input_histo.Draw("E1P")
-                            elif input_type in ("background", "signal"):
-                                input_histo.Draw("HIST")
-                            legend=plotting_functions.add_legend(legend, input_type, input_histo)
-                            legend.Draw()
-
-                        elif input_type == "sig_bkg_normalized":
-                            bkg_norm = inputs[0][final_state]
-                            sig_norm = inputs[1][final_state]
-                            plotting_functions.input_style("background", bkg_norm)
-                            plotting_functions.input_style("signal", sig_norm)
-                            plotting_functions.add_title(bkg_norm, var_dict[variable])
-                            bkg_norm.SetMaximum(max(bkg_norm.GetMaximum(),
-                                                    sig_norm.GetMaximum()) * 1.5)
-                            bkg_norm.Draw("HIST")
-                            sig_norm.Draw("HIST SAME")
-                            legend=plotting_functions.add_legend(legend, "background", bkg_norm)
-                            legend=plotting_functions.add_legend(legend, "signal", sig_norm)
-                            legend.Draw()
-
-                        elif input_type == "total":
-
-                            # Add the background to the signal
-                            # in order to compare it with the data.
-                            signals[final_state].Add(backgrounds[final_state])
-                            for input_key in inputs:
-                                input_histo=inputs_dict[input_key][final_state]
-                                plotting_functions.input_style(input_key, input_histo)
-                                legend=plotting_functions.add_legend(legend, input_key, input_histo)
-
-                            plotting_functions.add_title(signals[final_state], var_dict[variable])
-                            signals[final_state].SetMaximum(
-                                                max(backgrounds[final_state].GetMaximum(),
-                                                data[final_state].GetMaximum()) * 1.4)
-                            signals[final_state].Draw("HIST")
-                            backgrounds[final_state].Draw("HIST SAME")
-                            data[final_state].Draw("E1P SAME")
-                            legend.Draw()
-
-                        plotting_functions.add_latex()
-
-                        # Save the plots
-                        file_name = f"{input_type}_{final_state}_{variable}_{selection}.pdf"
-                        complete_name = os.path.join(dir_name, file_name)
-                        canvas.SaveAs(complete_name)
-
-                    except KeyError:
-                        logger.debug("ERROR: Failed to create the plot for %s_%s_%s_%s",
-                                input_type, final_state, variable, selection, stack_info=True)
+            jobs.append((selection, variable))
+
+    # The plots of the previous runs are kept unless all must be rendered again
+    manifest_path = os.path.join(args.output, "Plots", "plot_manifest.json")
+    manifest = {} if args.force else cache_tools.load_manifest(manifest_path)
+
+    n_workers, _ = parallel_tools.worker_layout(len(jobs), args.nWorkers if args.parallel else 1)
+    config = {
+        "output": args.output,
+        "sample": args.sample,
+        "finalState": args.finalState,
+        "typeDistribution": args.typeDistribution,
+        "ml": args.ml,
+        "manifest": manifest,
+        "log_level": logger.level,
+    }
+    logger.info(">>> Rendering %s jobs on %s workers", len(jobs), n_workers)
+
+    workers = {}
+    n_reused = 0
+    def collect(result):
+        nonlocal n_reused
+        n_reused += result["reused"]
+        manifest.update(result["fingerprints"])
+        worker = workers.setdefault(result["worker"], {"jobs": 0, "plots": 0, "time": 0.})
+        worker["jobs"] += 1
+        worker["plots"] += result["plots"]
+        worker["time"] += result["time"]
+        logger.debug("Plotted %s with selection %s in %s s", result["job"][1],
+                     result["job"][0], result["time"])
+
+    if jobs and n_workers == 1:
+        init_worker(config)
+        for job in jobs:
+            collect(plot_variable(job))
+    elif jobs:
+        with parallel_tools.pinned_threads(1), \
+                multiprocessing.get_context("spawn").Pool(
+                    n_workers, initializer=init_worker, initargs=(config,)) as pool:
+            for result in pool.imap_unordered(plot_variable, jobs):
+                collect(result)
+
+    for pid, worker in sorted(workers.items()):
+        logger.info(">>> Worker %s: %s plots of %s jobs in %s s", pid, worker["plots"],
+                    worker["jobs"], worker["time"])
+    logger.info(">>> Plots rendered: %s, reused from the previous runs: %s",
+                sum(worker["plots"] for worker in workers.values()), n_reused)
+
+    if jobs:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        cache_tools.save_manifest(manifest_path, manifest)
 
     logger.info(">>> Execution time: %s s \n",(time.time() - start_time))
 
@@ -256,6 +365,12 @@ if __name__ == "__main__":
 
     # General configuration
     parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-p", "--parallel",   default=True,   action="store_const",
+                        const=False, help="disables running in parallel")
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of worker processes rendering the plots" )
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="renders again all the plots")
     parser.add_argument("-o", "--output",     default=os.path.join("..", "..", "Output"), type=str,
                         help="path to the output folder w.r.t. the current directory")
     parser.add_argument("-m", "--ml", default=True,   action="store_const", const=False,
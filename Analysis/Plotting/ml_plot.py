@@ -3,6 +3,8 @@ are created, one for the simulated background and one for the
 simulated signal. Each plot contains both the combination
 of all background/signal datasets and the real data
 separated in the three possible final states.
+As in ``make_plot.py``, the plots whose histograms and style didn't change
+aren't rendered again.
 """
 
 import argparse
@@ -14,7 +16,7 @@ import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import cache_tools, set_up
 from Analysis.Plotting import plotting_functions
 
 
@@ -67,8 +69,25 @@ def ml_plot (args, logger):
     except FileExistsError:
         logger.debug("The directory %s/ already exists", dir_name)
 
+    # The plots of the previous runs are kept unless all must be rendered again
+    manifest_path = os.path.join(dir_name, "plot_manifest.json")
+    manifest = {} if args.force else cache_tools.load_manifest(manifest_path)
+    n_plots = 0
+    n_reused = 0
+
     for type_dataset in ["signal", "background"]:
 
+        # Skip the plots whose histograms, style and drawing code didn't change
+        file_name = f"discriminant_{type_dataset}.pdf"
+        complete_name = os.path.join(dir_name, file_name)
+        if type_dataset in histos:
+            fingerprint = plotting_functions.plot_fingerprint(
+                [histos[name] for name in [type_dataset, "data_el", "data_mu", "data_elmu"]
+                 if name in histos], [ml_plot], type_dataset)
+            if manifest.get(file_name) == fingerprint and os.path.exists(complete_name):
+                n_reused += 1
+                continue
+
         canvas = ROOT.TCanvas("", "", 600, 600)
         legend = ROOT.TLegend(0.75, 0.8, 0.85, 0.9)
         try:
@@ -107,9 +126,12 @@ def ml_plot (args, logger):
         plotting_functions.add_latex()
 
         # Save the plots
-        file_name = f"discriminant_{type_dataset}.pdf"
-        complete_name = os.path.join(dir_name, file_name)
         canvas.SaveAs(complete_name)
+        manifest[file_name] = fingerprint
+        n_plots += 1
+
+    cache_tools.save_manifest(manifest_path, manifest)
+    logger.info(">>> Plots rendered: %s, reused from the previous runs: %s", n_plots, n_reused)
 
     logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
 
@@ -122,6 +144,8 @@ if __name__ == "__main__":
     parser.add_argument("-l", "--logLevel",   default=20, type=int,
                             help="integer representing the level of the logger:\
                              DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="renders again all the plots")
     args_main = parser.parse_args()
 
     logger_main=set_up.set_up(args_main)
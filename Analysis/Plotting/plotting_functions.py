@@ -1,8 +1,12 @@
 """ Definitions of the functions used in the plotting step of the analysis.
 """
 
+import inspect
+
 import ROOT
 
+from Analysis import cache_tools
+
 def get_histogram(tfile, dataset):
     """Retrieve a histogram from the file given the sample,
     the final state and the variable name.
@@ -132,6 +136,10 @@ def add_title(histo, variable_specs=None):
         histo.GetXaxis().SetTitle("m_{4l} [GeV]")
     else:
         histo.GetXaxis().SetTitle(f"{variable_specs[3]}{variable_specs[4]}")
+        # The bins proposed by ``binning.py`` can have different widths
+        if histo.GetXaxis().IsVariableBinSize():
+            histo.GetYaxis().SetTitle("N_{Events} / bin")
+            return
         bin_width=(variable_specs[2]-variable_specs[1])/variable_specs[0]
         histo.GetYaxis().SetTitle(
             f"N_{{Events}} / {float(f'{bin_width:.1g}'):g}{variable_specs[4]}")
@@ -190,3 +198,41 @@ def add_latex():
     latex.SetTextFont(42)
     latex.DrawLatex(0.6, 0.935, "11.6 fb^{-1} (2012, 8 TeV)")
     latex.DrawLatex(0.16, 0.935, "#bf{CMS Open Data}")
+
+def style_fingerprint():
+    """ Fingerprint of the style of the plots, given by the code of the
+    functions that set it.
+
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    return cache_tools.make_fingerprint(*[inspect.getsource(func) for func in
+                                          (set_style, input_style, add_title,
+                                           add_legend, add_latex)])
+
+def plot_fingerprint(histos, drawing, *specs):
+    """ Fingerprint of a plot, given by the content and the binning of
+    its histograms, the style of the plots, the code of the functions
+    drawing it and some further specifics (e.g. the labels of the variable).
+
+    :param histos: Histograms drawn in the plot
+    :type histos: list(ROOT.TH1)
+    :param drawing: Functions drawing the plot
+    :type drawing: list(function)
+    :param specs: Further specifics of the plot
+    :type specs: object
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    contents = []
+    for histo in histos:
+        axes = [histo.GetXaxis(), histo.GetYaxis()][:histo.GetDimension()]
+        contents.append([
+            [histo.GetBinContent(i) for i in range(histo.GetNcells())],
+            [histo.GetBinError(i) for i in range(histo.GetNcells())],
+            [[axis.GetBinLowEdge(j) for j in range(1, axis.GetNbins() + 2)] for axis in axes],
+        ])
+    return cache_tools.make_fingerprint(contents, style_fingerprint(),
+                                        [inspect.getsource(func) for func in drawing], *specs)
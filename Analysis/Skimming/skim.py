@@ -17,7 +17,7 @@ import ROOT
 
 sys.path.append(os.path.join("..","..", ""))
 
-from Analysis import set_up
+from Analysis import dataset_io, set_up
 from Analysis.Definitions.eos_link_def import EOS_LINK
 from Analysis.Definitions.samples_size_def import SAMPLE_SIZE
 from Analysis.Definitions.samples_def import SAMPLES
@@ -115,9 +115,10 @@ def skim(args, logger, path_sf="Analysis/Skimming"):
                 rdf_final.Report().Print()
             logger.debug("%s\n", rdf_final.GetColumnNames())
 
-            # Save the skimmed samples
-            complete_name = os.path.join(dir_name, f"{sample_name}{final_state}Skim.root")
-            rdf_final.Snapshot("Events", complete_name, VARIABLES.keys())
+            # Save the skimmed samples in the requested format
+            complete_name = dataset_io.skim_path(args.output, sample_name, final_state)
+            dataset_io.write_dataset(args.storage, rdf_final, "Events",
+                                     complete_name, VARIABLES.keys())
 
             logger.info(">>> Execution time for %s %s: %s s \n",
                         sample_name, final_state, (time.time() - start_time))
@@ -151,6 +152,8 @@ if __name__ == "__main__":
                             const=EOS_LINK, type=str,
                             help="base path where to find the input data. \
                             If enabled it automatically gets the input data from EOS")
+    parser.add_argument("-k", "--storage",    default="ttree", type=str,
+                            help="format of the skimmed datasets: ttree, rntuple")
     args_main = parser.parse_args()
 
 
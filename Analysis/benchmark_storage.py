@@ -0,0 +1,183 @@
+""" Benchmark of the read throughput of the skimmed datasets stored as
+TTree and as RNTuple. The skims are converted to both formats and
+read back with the same workloads of the histogramming step (one
+weighted histogram for each variable) and of the mass fit (the Higgs mass
+and the weight in the fit window), in order to choose the default
+format for larger productions.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import ROOT
+
+sys.path.append(os.path.join("..", ""))
+
+from Analysis import dataset_io, set_up
+from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.variables_def import VARIABLES
+from Analysis.Histogramming import histogramming_functions
+
+
+def histogramming_workload(rdf):
+    """ Fill one weighted histogram for each variable, as in ``make_histo``.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :return: Number of processed events
+    :rtype: int
+    """
+
+    histos = [histogramming_functions.book_histogram_1d(rdf, variable, range_)
+              for variable, range_ in VARIABLES.items() if variable != "Weight"]
+    count = rdf.Count()
+    ROOT.RDF.RunGraphs(histos + [count])
+    return count.GetValue()
+
+def fitting_workload(rdf):
+    """ Read the Higgs mass and the weight in the fit window, as in ``fit_mass``.
+
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :return: Number of processed events
+    :rtype: int
+    """
+
+    # The count is booked first so that it runs in the same event loop of AsNumpy
+    count = rdf.Count()
+    rdf.Filter("Higgs_mass > 110 && Higgs_mass < 140").AsNumpy(["Higgs_mass", "Weight"])
+    return count.GetValue()
+
+def convert_skims(args, logger, bench_dir):
+    """ Copy the available skims in all the storage formats.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :param bench_dir: Directory where the converted skims are saved
+    :type bench_dir: str
+    :return: Paths of the converted files for each storage format
+    :rtype: dict(str, list(str))
+    """
+
+    # The RNTuple is benchmarked only if the installed ROOT supports it
+    formats = dataset_io.storage_formats()
+    if "rntuple" not in formats:
+        logger.warning("ATTENTION: ROOT %s doesn't support the RNTuple, only the TTree "
+                       "is benchmarked", ROOT.gROOT.GetVersion())
+    files = {storage: [] for storage in formats}
+
+    for sample_name, final_states in SAMPLES.items():
+        # Check if the sample is one of those requested by the user
+        if sample_name not in args.sample and args.sample != "all":
+            continue
+        for final_state in final_states:
+            # Check if the final state is one of those requested by the user
+            if final_state not in args.finalState and args.finalState != "all":
+                continue
+
+            file_name = dataset_io.skim_path(args.output, sample_name, final_state)
+            try:
+                rdf = dataset_io.open_dataset("Events", file_name)
+            except FileNotFoundError as not_found_err:
+                logger.debug("Sample %s final state %s: File %s can't be found %s",
+                                sample_name, final_state, file_name,
+                                not_found_err, stack_info=True)
+                continue
+
+            for storage in formats:
+                out_dir = os.path.join(bench_dir, storage)
+                os.makedirs(out_dir, exist_ok=True)
+                out_name = os.path.join(out_dir, os.path.basename(file_name))
+                dataset_io.write_dataset(storage, rdf, "Events", out_name, VARIABLES.keys())
+                files[storage].append(out_name)
+
+    return files
+
+def benchmark_storage(args, logger):
+    """ Main function of the benchmark. Each workload is run ``args.repetitions``
+    times on each storage format and the best and median times,
+    the event rate and the read throughput are reported.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    logger.info(">>> Executing %s \n", os.path.basename(__file__))
+
+    start_time = time.time()
+
+    #Enable multi-threading
+    if args.parallel:
+        ROOT.ROOT.EnableImplicitMT(args.nWorkers)
+        thread_size = ROOT.ROOT.GetThreadPoolSize()
+        logger.info(">>> Thread pool size for parallel processing: %s", thread_size)
+
+    bench_dir = os.path.join(args.output, "Benchmark")
+    files = convert_skims(args, logger, bench_dir)
+
+    workloads = {
+        "histogramming" : histogramming_workload,
+        "fitting" : fitting_workload
+    }
+
+    lines = [f"{'workload':<15}{'storage':<10}{'size [MB]':>12}{'best [s]':>12}"
+             f"{'median [s]':>12}{'events/s':>14}{'MB/s':>10}"]
+    for workload, function in workloads.items():
+        for storage, file_names in files.items():
+            if not file_names:
+                continue
+            size = sum(os.path.getsize(file_name) for file_name in file_names) / 1e6
+            times = []
+            for _ in range(args.repetitions):
+                rdf = dataset_io.open_dataset("Events", file_names)
+                start = time.perf_counter()
+                n_events = function(rdf)
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            lines.append(f"{workload:<15}{storage:<10}{size:>12.2f}{best:>12.3f}"
+                         f"{statistics.median(times):>12.3f}{n_events / best:>14.0f}"
+                         f"{size / best:>10.1f}")
+            logger.info(">>> %s %s: best time %.3f s over %d repetitions",
+                        workload, storage, best, args.repetitions)
+
+    report = "\n".join(lines)
+    logger.info(">>> Read throughput of the storage formats:\n%s\n", report)
+    with open(os.path.join(bench_dir, "storage_benchmark.txt"), "w", encoding="utf8") as file:
+        file.write(report + "\n")
+
+    logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
+
+if __name__ == "__main__":
+
+    # General configuration
+    parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-p", "--parallel",   default=True,   action="store_const",
+                        const=False, help="disables running in parallel")
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of workers for multi-threading" )
+    parser.add_argument("-o", "--output",     default=os.path.join("..", "Output"), type=str,
+                        help="path to the output folder w.r.t. the current directory")
+    parser.add_argument("-l", "--logLevel",   default=20, type=int,
+                            help="integer representing the level of the logger:\
+                             DEBUG=10, INFO = 20, WARNING = 30, ERROR = 40" )
+    parser.add_argument("-f", "--finalState",   default="all", type=str,
+                            help="comma separated list of the final states to analyse: \
+                            FourMuons,FourElectrons,TwoMuonsTwoElectrons" )
+    parser.add_argument("-s", "--sample",    default="all", type=str,
+                        help="string with comma separated list of samples to analyse: \
+                        Run2012B_DoubleElectron, Run2012B_DoubleMuParked, Run2012C_DoubleElectron, \
+                        Run2012C_DoubleMuParked, SMHiggsToZZTo4L, ZZTo2e2mu, ZZTo4e, ZZTo4mu")
+    parser.add_argument("-x", "--repetitions",   default=5, type=int,
+                        help="number of times each workload is repeated")
+    args_main = parser.parse_args()
+
+    logger_main=set_up.set_up(args_main)
+
+    benchmark_storage(args_main, logger_main)
@@ -0,0 +1,129 @@
+""" Helpers to fingerprint the inputs of the various steps of the analysis
+and to keep track of them in JSON manifests, so that the outputs
+produced from unchanged inputs can be reused instead of being recomputed.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import ROOT
+
+from Analysis import dataset_io
+
+
+def make_fingerprint(*items):
+    """ Compute a fingerprint of a set of JSON serializable objects.
+
+    :param items: Objects defining the configuration to be fingerprinted
+    :type items: object
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    payload = json.dumps(items, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf8")).hexdigest()
+
+def file_checksum(file_path, chunk_size=1 << 20):
+    """ Compute the checksum of the content of a file.
+
+    :param file_path: Path to the file
+    :type file_path: str
+    :param chunk_size: Number of bytes read at a time
+    :type chunk_size: int
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def dataset_fingerprint(file_name, tree_name, columns):
+    """ Compute a fingerprint of the content of some columns of a dataset.
+    Unlike the checksum of the whole file, it doesn't change when other
+    columns or datasets are added to the file, e.g. by the evaluation of the DNN.
+    The columns are read once and their bytes are hashed in a canonical
+    order of the events, which doesn't depend on the implicit multi-threading.
+
+    :param file_name: Path to the file
+    :type file_name: str
+    :param tree_name: Name of the dataset inside the file
+    :type tree_name: str
+    :param columns: Names of the columns to be fingerprinted
+    :type columns: list(str)
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    columns = list(columns)
+    arrays = dataset_io.open_dataset(tree_name, file_name).AsNumpy(columns)
+    arrays = [np.ascontiguousarray(arrays[column]) for column in columns]
+    order = np.lexsort(arrays) if arrays else []
+
+    sha = hashlib.sha256()
+    sha.update(make_fingerprint(os.path.basename(file_name), tree_name, columns).encode("utf8"))
+    for values in arrays:
+        sha.update(str(values.dtype).encode("utf8"))
+        sha.update(np.ascontiguousarray(values[order]).tobytes())
+    return sha.hexdigest()
+
+def key_fingerprint(file_name, names):
+    """ Compute a fingerprint of the records of some datasets in a file, i.e.
+    of the date, size and position of their keys. It changes whenever one of
+    the datasets is written again, but not when other datasets are added to
+    the file, and it doesn't need to read the datasets.
+
+    :param file_name: Path to the file
+    :type file_name: str
+    :param names: Names of the datasets inside the file
+    :type names: list(str)
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    records = []
+    tfile = ROOT.TFile.Open(file_name, "READ")
+    for name in names:
+        key = tfile.GetKey(name) if tfile and not tfile.IsZombie() else None
+        if key:
+            records.append([name, key.GetClassName(), key.GetCycle(), key.GetDatime().Get(),
+                            key.GetNbytes(), key.GetSeekKey()])
+        else:
+            records.append([name, None])
+    if tfile:
+        tfile.Close()
+    return make_fingerprint(os.path.basename(file_name), records)
+
+def load_manifest(file_path):
+    """ Read a JSON manifest.
+
+    :param file_path: Path to the manifest
+    :type file_path: str
+    :return: Content of the manifest, empty if it doesn't exist or can't be read
+    :rtype: dict
+    """
+
+    try:
+        with open(file_path, "r", encoding="utf8") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(file_path, manifest):
+    """ Write a JSON manifest. The file is replaced atomically so that
+    an interrupted run never leaves a corrupted manifest behind.
+
+    :param file_path: Path to the manifest
+    :type file_path: str
+    :param manifest: Content of the manifest
+    :type manifest: dict
+    """
+
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, file_path)
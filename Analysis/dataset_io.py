@@ -0,0 +1,250 @@
+""" Helpers to read and write the intermediate datasets of the analysis
+(the skims in ``Skim_data/`` and the trees produced by the selection step).
+The datasets can be stored either as TTree or as RNTuple: the format
+used for writing is chosen with the ``--storage`` option, while the
+format of the existing files is detected automatically when reading,
+so that every downstream stage works with both of them.
+"""
+
+import os
+
+import numpy as np
+import ROOT
+
+from Analysis.Definitions.storage_def import RNTUPLE_ROOT_VERSION, STORAGE_FORMATS
+
+# Chains of the datasets with friends, which must live as long as their RDataFrame
+_FRIEND_CHAINS = []
+
+
+def skim_path(output, sample_name, final_state):
+    """ Path of the skimmed file of a given sample and final state.
+
+    :param output: Path to the output folder
+    :type output: str
+    :param sample_name: Name of the sample
+    :type sample_name: str
+    :param final_state: Final state of the sample
+    :type final_state: str
+    :return: Path to the skimmed file
+    :rtype: str
+    """
+
+    return os.path.join(output, "Skim_data", f"{sample_name}{final_state}Skim.root")
+
+def rntuple_supported():
+    """ Check if the installed ROOT can read and write the RNTuple with RDataFrame.
+
+    :return: True if the RNTuple is supported
+    :rtype: bool
+    """
+
+    return hasattr(ROOT.RDF.Experimental, "FromRNTuple") and \
+        hasattr(ROOT.RDF, "ESnapshotOutputFormat")
+
+def storage_formats():
+    """ Storage formats supported by the installed ROOT.
+
+    :return: Names of the formats, the default one first
+    :rtype: list(str)
+    """
+
+    return [storage for storage in STORAGE_FORMATS
+            if storage != "rntuple" or rntuple_supported()]
+
+def check_rntuple():
+    """ Check that the installed ROOT supports the RNTuple.
+
+    :raises RuntimeError: Raised when the RNTuple isn't supported
+    """
+
+    if not rntuple_supported():
+        raise RuntimeError(f"The RNTuple needs ROOT {RNTUPLE_ROOT_VERSION} or later, "
+                           f"while ROOT {ROOT.gROOT.GetVersion()} is installed")
+
+def dataset_format(file_name, tree_name):
+    """ Detect the format of a dataset stored in a file.
+
+    :param file_name: Path to the file
+    :type file_name: str
+    :param tree_name: Name of the dataset inside the file
+    :type tree_name: str
+    :return: ``ttree`` or ``rntuple``, or ``None`` if the dataset can't be found
+    :rtype: str
+    """
+
+    if not os.path.exists(file_name):
+        return None
+
+    tfile = ROOT.TFile.Open(file_name, "READ")
+    if not tfile or tfile.IsZombie():
+        return None
+    key = tfile.GetKey(tree_name)
+    class_name = key.GetClassName() if key else ""
+    tfile.Close()
+
+    if class_name.endswith("RNTuple"):
+        return "rntuple"
+    if class_name:
+        return "ttree"
+    return None
+
+def dataset_exists(file_name, tree_name):
+    """ Check if a dataset with the given name exists in the file.
+
+    :param file_name: Path to the file
+    :type file_name: str
+    :param tree_name: Name of the dataset inside the file
+    :type tree_name: str
+    :return: True if the dataset exists
+    :rtype: bool
+    """
+
+    return dataset_format(file_name, tree_name) is not None
+
+def open_dataset(tree_name, file_names):
+    """ Create a RDataFrame reading a dataset from one or more files,
+    independently of the format in which it is stored.
+
+    :param tree_name: Name of the dataset inside the files
+    :type tree_name: str
+    :param file_names: Path or list of paths to the files
+    :type file_names: str or list(str)
+    :raises FileNotFoundError: Raised when none of the files contains the dataset
+    :raises RuntimeError: Raised when the files store the dataset in different formats,
+        or as RNTuple with a ROOT that doesn't support it
+    :return: RDataFrame of the dataset
+    :rtype: ROOT.RDataFrame
+    """
+
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    formats = {dataset_format(file_name, tree_name) for file_name in file_names}
+    formats.discard(None)
+    if not formats:
+        raise FileNotFoundError(f"Dataset {tree_name} can't be found in {file_names}")
+    if len(formats) > 1:
+        raise RuntimeError(f"Dataset {tree_name} is stored in mixed formats {formats}")
+
+    files = ROOT.std.vector["std::string"]()
+    for file_name in file_names:
+        if dataset_exists(file_name, tree_name):
+            files.push_back(file_name)
+
+    if formats.pop() == "rntuple":
+        check_rntuple()
+        return ROOT.RDF.Experimental.FromRNTuple(tree_name, files)
+    return ROOT.RDataFrame(tree_name, files)
+
+def numpy_dataframe(arrays):
+    """ Create a RDataFrame from NumPy arrays held in memory.
+
+    :param arrays: Columns of the dataset
+    :type arrays: dict(str, numpy.ndarray)
+    :return: RDataFrame of the arrays
+    :rtype: ROOT.RDataFrame
+    """
+
+    arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+    # RDF.FromNumpy replaces RDF.MakeNumpyDataFrame from ROOT 6.28
+    if hasattr(ROOT.RDF, "FromNumpy"):
+        return ROOT.RDF.FromNumpy(arrays)
+    return ROOT.RDF.MakeNumpyDataFrame(arrays)
+
+def snapshot_options(storage, mode="RECREATE"):
+    """ Options used to write a dataset with ``Snapshot``.
+
+    :param storage: Format of the output dataset: ``ttree`` or ``rntuple``
+    :type storage: str
+    :param mode: Opening mode of the output file: ``RECREATE`` or ``UPDATE``
+    :type mode: str
+    :raises RuntimeError: Raised when the RNTuple is requested with a ROOT that doesn't support it
+    :return: Snapshot options
+    :rtype: ROOT.RDF.RSnapshotOptions
+    """
+
+    option = ROOT.RDF.RSnapshotOptions(mode, ROOT.kZLIB, 1, 0, 99, False, True)
+    if storage == "rntuple":
+        check_rntuple()
+        option.fOutputFormat = ROOT.RDF.ESnapshotOutputFormat.kRNTuple
+    return option
+
+def write_dataset(storage, rdf, tree_name, file_name, columns, mode="RECREATE"):
+    """ Write the selected columns of a RDataFrame in the requested format.
+
+    :param storage: Format of the output dataset: ``ttree`` or ``rntuple``
+    :type storage: str
+    :param rdf: Input RDataFrame
+    :type rdf: ROOT.RDataFrame
+    :param tree_name: Name of the output dataset
+    :type tree_name: str
+    :param file_name: Path to the output file
+    :type file_name: str
+    :param columns: Names of the columns to be saved
+    :type columns: list(str)
+    :param mode: Opening mode of the output file: ``RECREATE`` or ``UPDATE``
+    :type mode: str
+    :return: RDataFrame of the written dataset
+    :rtype: ROOT.RDataFrame
+    """
+
+    return rdf.Snapshot(tree_name, file_name, list(columns), snapshot_options(storage, mode))
+
+def open_chain(tree_name, file_names, tmp_dir):
+    """ Create a TChain of the dataset for the tools that can only read
+    TTrees (e.g. TMVA and RooFit). The datasets stored as RNTuple
+    are first converted to a temporary TTree in ``tmp_dir``.
+
+    :param tree_name: Name of the dataset inside the files
+    :type tree_name: str
+    :param file_names: List of paths to the files
+    :type file_names: list(str)
+    :param tmp_dir: Directory where the converted TTrees are saved
+    :type tmp_dir: str
+    :raises RuntimeError: Raised when a dataset is stored as RNTuple
+        with a ROOT that doesn't support it
+    :return: Chain of the dataset
+    :rtype: ROOT.TChain
+    """
+
+    chain = ROOT.TChain(tree_name)
+    for file_name in file_names:
+        if dataset_format(file_name, tree_name) == "rntuple":
+            check_rntuple()
+            os.makedirs(tmp_dir, exist_ok=True)
+            tmp_name = os.path.join(tmp_dir,
+                            f"{tree_name}_{os.path.basename(file_name)}")
+            rdf = ROOT.RDF.Experimental.FromRNTuple(tree_name, file_name)
+            rdf.Snapshot(tree_name, tmp_name)
+            chain.Add(tmp_name)
+        else:
+            chain.Add(file_name)
+    return chain
+
+def open_with_friend(tree_name, friend_name, file_names):
+    """ Create a RDataFrame reading a TTree dataset together with a
+    friend TTree with the same number of entries stored in the same files.
+
+    :param tree_name: Name of the dataset inside the files
+    :type tree_name: str
+    :param friend_name: Name of the friend TTree inside the files
+    :type friend_name: str
+    :param file_names: Path or list of paths to the files
+    :type file_names: str or list(str)
+    :return: RDataFrame of the dataset with the columns of the friend
+    :rtype: ROOT.RDataFrame
+    """
+
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    chain = ROOT.TChain(tree_name)
+    friend = ROOT.TChain(friend_name)
+    for file_name in file_names:
+        chain.Add(file_name)
+        friend.Add(file_name)
+    chain.AddFriend(friend)
+    _FRIEND_CHAINS.append((chain, friend))
+
+    return ROOT.RDataFrame(chain)
@@ -8,16 +8,116 @@ import os
 import sys
 import time
 
+import numpy as np
 import ROOT
 
 sys.path.append(os.path.join("..", ""))
 
-from Analysis import set_up
+from Analysis import dataset_io, fit_tools, mass_scan, set_up, toy_study
+from Analysis.Definitions.fit_def import FIT_TOLERANCE
 from Analysis.Definitions.samples_def import SAMPLES
 from Analysis.Definitions.selections_def import SELECTIONS
+from Analysis.Machine_Learning import ml_selection
 from Analysis.Plotting import plotting_functions
 
 
+def load_fit_data(file_groups, expression, thresholds, m4l, weight):
+    """ Build the datasets of the fit from the skims. ``Higgs_mass`` and ``Weight``
+    of the events passing the selection and inside the ranges of the variables
+    of the fit are read with a RDataFrame for each group of skims, and all the
+    event loops are run together. The datasets are then filled from the
+    arrays, without writing intermediate TTrees.
+
+    :param file_groups: Paths to the skims of each dataset (e.g. signal, background, data)
+    :type file_groups: dict(str, list(str))
+    :param expression: Filter of the selection, empty for no selection
+    :type expression: str
+    :param thresholds: Threshold of each bit of the selection mask
+    :type thresholds: list(float)
+    :param m4l: Mass of the Higgs candidate in the fit
+    :type m4l: ROOT.RooRealVar
+    :param weight: Weight of the events, stored as a variable of the datasets
+    :type weight: ROOT.RooRealVar
+    :raises RuntimeError: Raised when the selection mask isn't available
+    :return: Dataset of each group
+    :rtype: dict(str, ROOT.RooDataSet)
+    """
+
+    # Events outside of the ranges of the variables wouldn't be imported in the datasets
+    window = f"Higgs_mass >= {m4l.getMin()} && Higgs_mass <= {m4l.getMax()} && " \
+             f"Weight >= {weight.getMin()} && Weight <= {weight.getMax()}"
+
+    results = {}
+    for name, file_names in file_groups.items():
+        if not file_names:
+            continue
+        if expression:
+            rdf = ml_selection.open_selection(file_names, thresholds)
+            if not rdf.HasColumn("DNNSelectionMask"):
+                raise RuntimeError
+            rdf = rdf.Filter(expression)
+        else:
+            rdf = dataset_io.open_dataset("Events", file_names)
+        rdf = rdf.Filter(window).Define("fit_mass", "static_cast<double>(Higgs_mass)")\
+                 .Define("fit_weight", "static_cast<double>(Weight)")
+        results[name] = [rdf.Take["double"]("fit_mass"), rdf.Take["double"]("fit_weight")]
+
+    # Run the event loops over all the groups at once
+    if results:
+        ROOT.RDF.RunGraphs([result for pair in results.values() for result in pair])
+
+    datasets = {}
+    for name in file_groups:
+        columns = [np.empty(0), np.empty(0)]
+        if name in results:
+            columns = [np.asarray(result.GetValue()) for result in results[name]]
+        datasets[name] = fit_tools.make_dataset(name, [m4l, weight], columns)
+    return datasets
+
+def fit_model(pdf, data, name, args, logger):
+    """ Fit a model with the backend of ``--fitBackend``, logging the wall time
+    and the number of evaluations of the likelihood. With ``--validateFit``
+    the fit is repeated from the same initial values with the scalar
+    evaluation on a single CPU and the parameters are compared.
+
+    :param pdf: Model to be fitted
+    :type pdf: ROOT.RooAbsPdf
+    :param data: Dataset to be fitted
+    :type data: ROOT.RooDataSet
+    :param name: Name of the fit in the messages
+    :type name: str
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Result of the fit and its wall time, number of evaluations
+        of the likelihood and backend
+    :rtype: tuple(ROOT.RooFitResult, dict)
+    """
+
+    result, stats = fit_tools.run_fit(pdf, data, args.fitBackend, fit_tools.fit_cpus(args))
+    logger.info(">>> Fit of %s with backend %s on %s CPUs: %s s, %s likelihood calls",
+                name, stats["backend"], stats["cpus"], stats["time"], stats["calls"])
+
+    if args.validateFit and (args.fitBackend != "legacy" or stats["cpus"] > 1):
+        params = pdf.getParameters(data)
+        fitted = params.snapshot()
+        params.assignValueOnly(result.floatParsInit())
+        reference, ref_stats = fit_tools.run_fit(pdf, data, "legacy", 1)
+        worst, diff = fit_tools.compare_fits(fit_tools.parameter_values(result),
+                                             fit_tools.parameter_values(reference))
+        logger.info("Scalar fit of %s: %s s, %s likelihood calls",
+                    name, ref_stats["time"], ref_stats["calls"])
+        if diff > FIT_TOLERANCE:
+            logger.warning("The fit of %s differs from the scalar one: %s differs by %.3g "
+                           "standard deviations", name, worst, diff)
+        else:
+            logger.info("The fit of %s agrees with the scalar one, largest difference "
+                        "%.3g standard deviations", name, diff)
+        params.assignValueOnly(fitted)
+
+    return result, stats
+
 def fit_mass (args, logger):
     """ Main function for the mass fit of the Higgs candidate
     using a Crystal Ball.
@@ -41,14 +141,16 @@ def fit_mass (args, logger):
     except FileExistsError:
         logger.debug("The directory %s/ already exists", dir_name)
 
+    thresholds = ml_selection.load_thresholds(args.output, logger)
+
     # Loop over the possible selections
-    for selection, tree_name in SELECTIONS.items():
+    for selection, expression in SELECTIONS.items():
         try:
             logger.info(">>> Process %s\n", selection)
 
-            sig_chain= ROOT.TChain(tree_name)
-            bkg_chain= ROOT.TChain(tree_name)
-            data_chain= ROOT.TChain(tree_name)
+            sig_files = []
+            bkg_files = []
+            data_files = []
 
             for sample_name, final_states in SAMPLES.items():
                 # Check if the sample to plot is one of those requested by the user
@@ -63,8 +165,7 @@ def fit_mass (args, logger):
 
                     # Check if input file exists or not
                     try:
-                        infile_path = os.path.join(args.output, "Skim_data",
-                                            f"{sample_name}{final_state}Skim.root")
+                        infile_path = dataset_io.skim_path(args.output, sample_name, final_state)
                         if not os.path.exists(infile_path):
                             raise FileNotFoundError
                     except FileNotFoundError as not_found_err:
@@ -73,27 +174,36 @@ def fit_mass (args, logger):
                                         stack_info=True)
                         continue
 
-                    file = ROOT.TFile(infile_path,"READ")
-                    tree= file.Get(tree_name)
-                    if not tree:
-                        raise RuntimeError
-
                     if sample_name.startswith("SM"):
-                        sig_chain.Add(infile_path)
+                        sig_files.append(infile_path)
 
                     elif sample_name.startswith("ZZ"):
-                        bkg_chain.Add(infile_path)
+                        bkg_files.append(infile_path)
 
                     elif sample_name.startswith("Run"):
-                        data_chain.Add(infile_path)
+                        data_files.append(infile_path)
 
             m4l = ROOT.RooRealVar("Higgs_mass",f"4 leptons invariant mass with {selection}",
                                     110, 140,"GeV")
             weight = ROOT.RooRealVar("Weight","Weight", 0, 1,"GeV")
 
-            sig = ROOT.RooDataSet("signal", "", sig_chain, ROOT.RooArgSet(m4l, weight) )
-            bkg = ROOT.RooDataSet("background", "", bkg_chain, ROOT.RooArgSet(m4l, weight) )
-            data = ROOT.RooDataSet("data", "", data_chain, ROOT.RooArgSet(m4l, weight) )
+            # The multi-threading is enabled only to read the skims, since the
+            # processes of the likelihood must not be forked from running threads
+            load_start = time.time()
+            if args.parallel:
+                ROOT.ROOT.EnableImplicitMT(args.nWorkers)
+                logger.debug("Thread pool size for reading the skims: %s",
+                             ROOT.ROOT.GetThreadPoolSize())
+            try:
+                datasets = load_fit_data({"signal": sig_files, "background": bkg_files,
+                                          "data": data_files}, expression, thresholds,
+                                         m4l, weight)
+            finally:
+                ROOT.ROOT.DisableImplicitMT()
+            sig, bkg, data = datasets["signal"], datasets["background"], datasets["data"]
+            logger.info(">>> Datasets of %s loaded in %s s: %s signal, %s background "
+                        "and %s data events", selection, time.time() - load_start,
+                        sig.numEntries(), bkg.numEntries(), data.numEntries())
 
             # Calculate signal fraction
             sig_frac_count = sig.sumEntries()/(sig.sumEntries()+bkg.sumEntries())
@@ -102,7 +212,19 @@ def fit_mass (args, logger):
             # KDE for background. In this configuration the input data
             # is mirrored over the right boundary to minimize edge effects in distribution
             # that do not fall to zero towards the right edge
-            bkg_kde = ROOT.RooKeysPdf("bkg_kde", "bkg_kde", m4l, bkg, ROOT.RooKeysPdf.MirrorRight)
+            if args.kdeCache:
+                kde_start = time.time()
+                # The histogram of the cached KDE stays bound until the end of
+                # the iteration, since the PDF using it is still alive
+                bkg_kde, bkg_grid, reused = fit_tools.cached_kde(
+                    "bkg_kde", m4l, bkg,
+                    fit_tools.kde_fingerprint(bkg_files, expression, thresholds, m4l),
+                    os.path.join(dir_name, "KDE_cache"), args.force)
+                logger.info(">>> KDE of the background %s in %s s", "read from the cache"
+                            if reused else "tabulated", time.time() - kde_start)
+            else:
+                bkg_kde = ROOT.RooKeysPdf("bkg_kde", "bkg_kde", m4l, bkg,
+                                          ROOT.RooKeysPdf.MirrorRight)
 
             # Parameters and model for the fit of the simulated signal samples
             mean_higgs_sig = ROOT.RooRealVar("meanHiggs_sig",
@@ -115,9 +237,12 @@ def fit_mass (args, logger):
                                             m4l, mean_higgs_sig, sigma_higgs, alpha_higgs, n_higgs)
 
             # Unbinned ML fit to signal
-            fit_higgs = cb_higgs_sig.fitTo(sig, ROOT.RooFit.Save(True),
-                                           ROOT.RooFit.AsymptoticError(True))
+            fit_higgs, sig_stats = fit_model(cb_higgs_sig, sig, f"signal {selection}",
+                                             args, logger)
             fit_higgs.Print("v")
+            # The shape of the signal is also fitted on the data below
+            signal_shape = {param.GetName(): param.getVal()
+                            for param in [sigma_higgs, alpha_higgs, n_higgs]}
 
             # Parameters and model for data fit
             mean_higgs_data = ROOT.RooRealVar("m_{H}", "The mean of the Higgs CB for the data",
@@ -134,7 +259,7 @@ def fit_mass (args, logger):
                     ROOT.RooArgList(cb_higgs_data, bkg_kde), ROOT.RooArgList(sig_frac,bkg_frac))
 
             # Unbinned ML fit to data
-            fit_data = tot_pdf.fitTo(data, ROOT.RooFit.Save(True))
+            fit_data, data_stats = fit_model(tot_pdf, data, f"data {selection}", args, logger)
             fit_data.Print("v")
             logger.info("Fraction sig/bkg is: %s\n",sig_frac_count)
             logger.info("Fraction bkg/sig is: %s\n",bkg_frac_count)
@@ -189,6 +314,10 @@ def fit_mass (args, logger):
                            .format(alpha_higgs.getValV(), alpha_higgs.getError()))
                 file.write("Normalization of Higgs CB from data = {:.3f} +/- {:.3f} \n"
                            .format(n_higgs.getValV(), n_higgs.getError()))
+                for fit_name, stats in [("MC", sig_stats), ("data", data_stats)]:
+                    file.write(f"Fit of {fit_name}: backend {stats['backend']} on "
+                               f"{stats['cpus']} CPUs, {stats['time']:.3f} s, "
+                               f"{stats['calls']} likelihood calls \n")
 
             # Now save the data and the PDF into a Workspace
             out_file_name= os.path.join(dir_name, f"Workspace_mass_fit_{selection}.root")
@@ -201,8 +330,17 @@ def fit_mass (args, logger):
             f_output.Write()
             f_output.Close()
 
+            # Pseudo-experiments of the fit of the data
+            if args.toys > 0:
+                toy_study.toy_study(out_file_name, selection, args, logger)
+
+            # Scan of the mass hypothesis with the shape of the signal of the MC
+            if args.massScan and data.numEntries() > 0:
+                masses = fit_tools.dataset_values(data, m4l.GetName())
+                mass_scan.mass_scan(out_file_name, masses, signal_shape, selection, args, logger)
+
         except RuntimeError:
-            logger.debug("Can't find the TTree %s", tree_name, stack_info=True)
+            logger.debug("The selection %s isn't available", selection, stack_info=True)
 
     logger.info(">>> Execution time: %s s \n", (time.time() - start_time))
 
@@ -210,6 +348,27 @@ if __name__ == "__main__":
 
     # General configuration
     parser = argparse.ArgumentParser( description = "Analysis Tool" )
+    parser.add_argument("-p", "--parallel",   default=True,   action="store_const",
+                        const=False, help="disables running in parallel")
+    parser.add_argument("-n", "--nWorkers",   default=0,
+                        type=int,   help="number of workers for multi-threading" )
+    parser.add_argument("--fitBackend",   default="cpu", type=str,
+                        help="backend evaluating the likelihood of the fits: cpu, legacy")
+    parser.add_argument("--validateFit",   default=False,   action="store_const",
+                        const=True, help="compares the fitted parameters with the scalar \
+                        evaluation of the likelihood")
+    parser.add_argument("--kdeCache",   default=False,   action="store_const",
+                        const=True, help="replaces the KDE of the background with its \
+                        interpolation on a fine grid, cached on disk")
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                        const=True, help="disables the reuse of cached results \
+                        and recomputes every output")
+    parser.add_argument("--toys",   default=0, type=int,
+                        help="number of pseudo-experiments generated and fitted to study \
+                        the fit of the data, none if 0")
+    parser.add_argument("--massScan",   default=False,   action="store_const",
+                        const=True, help="scans the mass hypothesis of the Higgs boson \
+                        computing the local significance and the profile likelihood")
     parser.add_argument("-o", "--output",     default="../Output", type=str,
                         help="path to the output folder w.r.t. the current directory")
     parser.add_argument("-l", "--logLevel",   default=20, type=int,
@@ -0,0 +1,278 @@
+""" Engine of the unbinned likelihood fits of ``fit_mass.py``.
+The negative log-likelihood is evaluated either with the vectorized batch
+evaluation of RooFit, which computes the PDFs over all the events of the
+dataset at once, or with the scalar evaluation, event by event. With more
+than one worker requested the likelihood is split among parallel processes. The wall
+time and the number of evaluations of the likelihood of each fit are
+returned together with its result.
+The KDE of the background can be tabulated on a fine grid and replaced by
+an interpolated histogram PDF, cached on disk and keyed by the fingerprint
+of the skims and of the selection it is built from.
+"""
+
+import os
+import time
+
+import numpy as np
+import ROOT
+
+from Analysis import cache_tools
+from Analysis.Definitions.fit_def import KDE_GRID
+from Analysis.Definitions.selections_def import SELECTION_TREE
+
+# Copy of NumPy arrays in and out of the datasets, since RooDataSet.from_numpy
+# and RooDataSet.to_numpy are only available from ROOT 6.28
+DATASET_CODE = """
+#ifndef FIT_DATASET_H
+#define FIT_DATASET_H
+#include <cstddef>
+#include <vector>
+#include "RooArgSet.h"
+#include "RooDataSet.h"
+#include "RooRealVar.h"
+inline void fillDataSet(RooDataSet& data, const std::vector<RooRealVar*>& vars,
+                        const double* values, std::size_t n) {
+    RooArgSet row;
+    for (auto* var : vars) row.add(*var);
+    const std::size_t n_vars = vars.size();
+    for (std::size_t i = 0; i < n; ++i) {
+        for (std::size_t j = 0; j < n_vars; ++j) vars[j]->setVal(values[i * n_vars + j]);
+        data.add(row);
+    }
+}
+inline void readDataSet(const RooDataSet& data, const char* name, double* values) {
+    for (int i = 0; i < data.numEntries(); ++i) values[i] = data.get(i)->getRealValue(name);
+}
+#endif
+"""
+
+
+def declare_dataset_tools():
+    """ Compile the functions copying the arrays of the datasets with the ROOT interpreter.
+    """
+
+    if not hasattr(ROOT, "fillDataSet"):
+        ROOT.gInterpreter.Declare(DATASET_CODE)
+
+def make_dataset(name, variables, columns):
+    """ Fill an unweighted dataset with the values of some arrays.
+
+    :param name: Name of the dataset
+    :type name: str
+    :param variables: Variables of the dataset
+    :type variables: list(ROOT.RooRealVar)
+    :param columns: Values of each variable, with the same length
+    :type columns: list(numpy.ndarray)
+    :return: Dataset
+    :rtype: ROOT.RooDataSet
+    """
+
+    declare_dataset_tools()
+    values = np.empty((len(columns[0]), len(variables)))
+    for i, column in enumerate(columns):
+        values[:, i] = column
+    values = np.ascontiguousarray(values).ravel()
+    dataset = ROOT.RooDataSet(name, name, ROOT.RooArgSet(*variables))
+    ROOT.fillDataSet(dataset, ROOT.std.vector["RooRealVar*"](variables), values,
+                     len(columns[0]))
+    return dataset
+
+def dataset_values(data, name):
+    """ Values of a variable of a dataset.
+
+    :param data: Dataset
+    :type data: ROOT.RooDataSet
+    :param name: Name of the variable
+    :type name: str
+    :return: Values of the variable
+    :rtype: numpy.ndarray
+    """
+
+    declare_dataset_tools()
+    values = np.empty(data.numEntries())
+    ROOT.readDataSet(data, name, values)
+    return values
+
+def fit_cpus(args):
+    """ Number of CPUs over which the likelihood is split.
+
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :return: Number of CPUs, 1 unless more than one worker is requested
+        explicitly with ``--nWorkers``, since the processes aren't worth
+        their overhead on the small datasets of the fit
+    :rtype: int
+    """
+
+    if not args.parallel or args.nWorkers <= 1:
+        return 1
+    return args.nWorkers
+
+def fit_options(backend, n_cpu):
+    """ Options of the likelihood for a backend.
+
+    :param backend: Either ``cpu``, for the vectorized batch evaluation,
+        or ``legacy``, for the scalar evaluation
+    :type backend: str
+    :param n_cpu: Number of CPUs over which the likelihood is split
+    :type n_cpu: int
+    :return: Options to be passed to ``createNLL``
+    :rtype: list(ROOT.RooCmdArg)
+    """
+
+    # Older versions of RooFit only provide the switch of the batch mode
+    if hasattr(ROOT.RooFit, "EvalBackend"):
+        options = [ROOT.RooFit.EvalBackend(backend)]
+    else:
+        options = [ROOT.RooFit.BatchMode(backend == "cpu")]
+    if n_cpu > 1:
+        options.append(ROOT.RooFit.NumCPU(n_cpu))
+    return options
+
+def run_fit(pdf, data, backend, n_cpu):
+    """ Unbinned maximum likelihood fit, minimized with MIGRAD and with
+    the uncertainties of HESSE, as in ``RooAbsPdf.fitTo``.
+
+    :param pdf: Model to be fitted
+    :type pdf: ROOT.RooAbsPdf
+    :param data: Dataset to be fitted
+    :type data: ROOT.RooDataSet
+    :param backend: Backend of the evaluation of the likelihood
+    :type backend: str
+    :param n_cpu: Number of CPUs over which the likelihood is split
+    :type n_cpu: int
+    :return: Result of the fit, and its wall time, number of evaluations
+        of the likelihood and backend
+    :rtype: tuple(ROOT.RooFitResult, dict)
+    """
+
+    start_time = time.time()
+    nll = pdf.createNLL(data, *fit_options(backend, n_cpu))
+    minimizer = ROOT.RooMinimizer(nll)
+    minimizer.setPrintLevel(-1)
+    minimizer.migrad()
+    minimizer.hesse()
+    result = minimizer.save()
+    stats = {"backend": backend, "cpus": n_cpu, "time": time.time() - start_time,
+             "calls": minimizer.evalCounter()}
+    return result, stats
+
+def kde_fingerprint(file_names, expression, thresholds, m4l):
+    """ Fingerprint of the inputs of the KDE of the background: the records of
+    the skims and of their selection masks, the selection and the grid.
+
+    :param file_names: Paths to the skims of the background
+    :type file_names: list(str)
+    :param expression: Filter of the selection, empty for no selection
+    :type expression: str
+    :param thresholds: Threshold of each bit of the selection mask
+    :type thresholds: list(float)
+    :param m4l: Mass of the Higgs candidate in the fit
+    :type m4l: ROOT.RooRealVar
+    :return: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+
+    events = [cache_tools.key_fingerprint(file_name, ["Events"]) for file_name in file_names]
+    masks = [cache_tools.key_fingerprint(file_name, [SELECTION_TREE])
+             for file_name in file_names] if expression else []
+    return cache_tools.make_fingerprint(events, masks, expression, thresholds if expression else [],
+                                        [m4l.getMin(), m4l.getMax()], KDE_GRID, "MirrorRight")
+
+def tabulate_kde(m4l, data, n_bins):
+    """ Build the KDE of a dataset, mirrored over the right boundary,
+    and evaluate it at the centres of the bins of a grid.
+
+    :param m4l: Variable of the KDE
+    :type m4l: ROOT.RooRealVar
+    :param data: Dataset of the KDE
+    :type data: ROOT.RooDataSet
+    :param n_bins: Number of bins of the grid
+    :type n_bins: int
+    :return: Normalized density at the centres of the bins
+    :rtype: numpy.ndarray
+    """
+
+    kde = ROOT.RooKeysPdf("bkg_kde_exact", "bkg_kde_exact", m4l, data,
+                          ROOT.RooKeysPdf.MirrorRight)
+    edges = np.linspace(m4l.getMin(), m4l.getMax(), n_bins + 1)
+    norm_set = ROOT.RooArgSet(m4l)
+    value = m4l.getVal()
+    density = np.empty(n_bins)
+    for i, centre in enumerate(0.5 * (edges[1:] + edges[:-1])):
+        m4l.setVal(centre)
+        density[i] = kde.getVal(norm_set)
+    m4l.setVal(value)
+    return density
+
+def cached_kde(name, m4l, data, fingerprint, cache_dir, force=False):
+    """ Histogram PDF interpolating the KDE of a dataset tabulated on the grid of
+    ``KDE_GRID``. The tabulated KDE is read from ``cache_dir`` when one with the
+    same fingerprint is available, otherwise it is computed and saved there.
+
+    :param name: Name of the PDF
+    :type name: str
+    :param m4l: Variable of the KDE
+    :type m4l: ROOT.RooRealVar
+    :param data: Dataset of the KDE
+    :type data: ROOT.RooDataSet
+    :param fingerprint: Fingerprint of the inputs of the KDE
+    :type fingerprint: str
+    :param cache_dir: Directory of the cached KDEs
+    :type cache_dir: str
+    :param force: Whether to recompute the KDE even if cached
+    :type force: bool
+    :return: PDF, its histogram, which must be kept alive as long as the PDF,
+        and whether it was read from the cache
+    :rtype: tuple(ROOT.RooHistPdf, ROOT.RooDataHist, bool)
+    """
+
+    cache_path = os.path.join(cache_dir, f"{fingerprint}.npy")
+    reused = not force and os.path.exists(cache_path)
+    if reused:
+        density = np.load(cache_path)
+    else:
+        density = tabulate_kde(m4l, data, KDE_GRID["bins"])
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_path, density)
+
+    histo = ROOT.TH1D(f"{name}_grid", f"{name}_grid", len(density),
+                      m4l.getMin(), m4l.getMax())
+    histo.SetDirectory(ROOT.nullptr)
+    for i, value in enumerate(density):
+        histo.SetBinContent(i + 1, value)
+    data_hist = ROOT.RooDataHist(f"{name}_hist", f"{name}_hist", ROOT.RooArgList(m4l), histo)
+    pdf = ROOT.RooHistPdf(name, name, ROOT.RooArgSet(m4l), data_hist, KDE_GRID["interpolation"])
+    return pdf, data_hist, reused
+
+def parameter_values(result):
+    """ Fitted values and uncertainties of the floating parameters.
+
+    :param result: Result of the fit
+    :type result: ROOT.RooFitResult
+    :return: Value and uncertainty of each parameter
+    :rtype: dict(str, tuple(float))
+    """
+
+    return {param.GetName(): (param.getVal(), param.getError())
+            for param in result.floatParsFinal()}
+
+def compare_fits(values, reference):
+    """ Largest difference between the parameters of two fits of the same
+    model, in units of the uncertainty of the reference.
+
+    :param values: Value and uncertainty of each parameter of the fit to be checked
+    :type values: dict(str, tuple(float))
+    :param reference: Value and uncertainty of each parameter of the reference fit
+    :type reference: dict(str, tuple(float))
+    :return: Name of the parameter with the largest difference and the difference
+    :rtype: tuple(str, float)
+    """
+
+    worst = (None, 0.)
+    for name, (value, _) in values.items():
+        ref_value, ref_error = reference[name]
+        diff = abs(value - ref_value) / ref_error if ref_error > 0 else abs(value - ref_value)
+        if diff >= worst[1]:
+            worst = (name, diff)
+    return worst
@@ -0,0 +1,277 @@
+""" Scan of the mass hypothesis of the Higgs boson in the data of ``fit_mass.py``.
+At each mass of the grid of ``MASS_SCAN`` the data are fitted with an extended
+model of the yields of the signal, a Crystal Ball centred at the mass with the
+shape fitted on the simulated signal, and of the background, the KDE of the
+fit. The fit is repeated without signal, so that the likelihood ratio gives
+the local p-value and significance of the signal at each mass, while the
+likelihood of the fits with signal, profiled over the yields, gives the
+profile-likelihood curve of the mass. The points of the grid are independent
+and are fitted on a pool of worker processes, which read the masses of the
+data from a block of shared memory filled once by the main process.
+The curves are saved in ``Fit_results/mass_scan_{selection}.npz`` and plotted
+in ``Fit_results/mass_scan_{selection}.pdf``, together with a summary in
+``Fit_results/mass_scan_{selection}.json``.
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import ROOT
+
+from Analysis import cache_tools, fit_tools, parallel_tools
+from Analysis.Definitions.fit_def import MASS_SCAN
+
+# Model of the scan and configuration of the process fitting the points
+_WORKER = {}
+
+
+def scan_points(low, high, step):
+    """ Masses of the grid of the scan, including the extremes.
+
+    :param low: Lowest mass
+    :type low: float
+    :param high: Highest mass
+    :type high: float
+    :param step: Distance between two points
+    :type step: float
+    :return: Masses of the grid
+    :rtype: numpy.ndarray
+    """
+
+    return np.linspace(low, high, int(round((high - low) / step)) + 1)
+
+def local_significance(nll_null, nll_best):
+    """ Local p-value and significance of the signal from the minima of the
+    negative log-likelihood without and with signal, using the asymptotic
+    distribution of the one-sided test statistic q0 = 2 (NLL_0 - NLL).
+
+    :param nll_null: Minimum of the negative log-likelihood without signal
+    :type nll_null: numpy.ndarray
+    :param nll_best: Minimum of the negative log-likelihood with signal
+    :type nll_best: numpy.ndarray
+    :return: Test statistic, local p-value and local significance
+    :rtype: tuple(numpy.ndarray)
+    """
+
+    q_0 = np.maximum(2. * (np.asarray(nll_null) - np.asarray(nll_best)), 0.)
+    significance = np.sqrt(q_0)
+    p_value = np.array([0.5 * math.erfc(z / math.sqrt(2.)) for z in np.atleast_1d(significance)])
+    return q_0, p_value.reshape(np.shape(q_0)), significance
+
+def profile_curve(masses, nll_best):
+    """ Profile-likelihood curve of the mass, its minimum and the interval
+    of the grid where the curve is below 1.
+
+    :param masses: Masses of the grid
+    :type masses: numpy.ndarray
+    :param nll_best: Minimum of the negative log-likelihood with signal at each mass
+    :type nll_best: numpy.ndarray
+    :return: -2 Delta ln L at each mass, mass of the minimum and
+        lower and upper edge of the interval
+    :rtype: tuple(numpy.ndarray, float, float, float)
+    """
+
+    curve = 2. * (np.asarray(nll_best) - np.min(nll_best))
+    best = int(np.argmin(curve))
+    inside = np.flatnonzero(curve <= 1.)
+    return curve, float(masses[best]), float(masses[inside[0]]), float(masses[inside[-1]])
+
+def init_worker(config):
+    """ Build the model of the scan and the dataset read from the
+    shared memory in the process fitting the points.
+
+    :param config: Path to the workspace, name of the observable, name and size of
+        the shared memory, shape of the signal, backend of the fits and logging level
+    :type config: dict
+    """
+
+    logging.basicConfig( format="\n%(asctime)s - %(filename)s - %(message)s")
+    log = logging.getLogger()
+    log.setLevel(config["log_level"])
+
+    ROOT.gROOT.SetBatch(True)
+    if config["log_level"] >= 20:
+        ROOT.gErrorIgnoreLevel = ROOT.kWarning
+        ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+
+    infile = ROOT.TFile.Open(config["workspace"], "READ")
+    w_s = infile.Get("ws")
+    m4l = w_s.var(config["observable"])
+
+    shm = shared_memory.SharedMemory(name=config["shm_name"])
+    masses = np.ndarray((config["n_events"],), dtype=np.float64, buffer=shm.buf)
+    data = fit_tools.make_dataset("scan_data", [m4l], [masses])
+    shm.close()
+
+    n_data = config["n_events"]
+    model = {
+        "mass": ROOT.RooRealVar("scan_mass", "Mass hypothesis", 125., m4l.getMin(), m4l.getMax()),
+        "n_sig": ROOT.RooRealVar("n_sig", "Signal yield", 0., 0., n_data),
+        "n_bkg": ROOT.RooRealVar("n_bkg", "Background yield", n_data, 0., 2. * n_data),
+    }
+    for name, value in config["shape"].items():
+        model[name] = ROOT.RooRealVar(f"scan_{name}", name, value)
+    model["signal"] = ROOT.RooCBShape("scan_CB", "Signal at the mass hypothesis", m4l,
+                                      model["mass"], model["sigmaHiggs"],
+                                      model["alphaHiggs"], model["nHiggs"])
+    model["pdf"] = ROOT.RooAddPdf("scan_pdf", "Signal and background yields",
+                                  ROOT.RooArgList(model["signal"], w_s.pdf("bkg_kde")),
+                                  ROOT.RooArgList(model["n_sig"], model["n_bkg"]))
+    model["mass"].setConstant(True)
+    _WORKER.update(log=log, config=config, file=infile, ws=w_s, data=data, model=model)
+
+def fit_point(job):
+    """ Fit the data at a mass hypothesis with and without signal.
+
+    :param job: Index and mass of the point
+    :type job: tuple(int, float)
+    :return: Index and mass of the point, minima of the negative log-likelihood
+        with and without signal, fitted signal yield and its uncertainty,
+        status of the fits, worker and wall time
+    :rtype: dict
+    """
+
+    start_time = time.time()
+    index, mass = job
+    model, data = _WORKER["model"], _WORKER["data"]
+    backend = _WORKER["config"]["backend"]
+    n_data = data.numEntries()
+
+    model["mass"].setVal(mass)
+    model["n_sig"].setConstant(False)
+    model["n_sig"].setVal(0.05 * n_data)
+    model["n_bkg"].setVal(0.95 * n_data)
+    best, _ = fit_tools.run_fit(model["pdf"], data, backend, 1)
+    n_sig, n_sig_error = model["n_sig"].getVal(), model["n_sig"].getError()
+
+    model["n_sig"].setVal(0.)
+    model["n_sig"].setConstant(True)
+    model["n_bkg"].setVal(n_data)
+    null, _ = fit_tools.run_fit(model["pdf"], data, backend, 1)
+
+    return {"index": index, "mass": mass, "nll_best": best.minNll(), "nll_null": null.minNll(),
+            "n_sig": n_sig, "n_sig_error": n_sig_error,
+            "status": max(best.status(), null.status()),
+            "worker": os.getpid(), "time": time.time() - start_time}
+
+def plot_scan(masses, p_value, curve, file_name):
+    """ Plot the local p-value and the profile-likelihood curve of the mass.
+
+    :param masses: Masses of the grid
+    :type masses: numpy.ndarray
+    :param p_value: Local p-value at each mass
+    :type p_value: numpy.ndarray
+    :param curve: -2 Delta ln L at each mass
+    :type curve: numpy.ndarray
+    :param file_name: Path to the plot
+    :type file_name: str
+    """
+
+    canvas = ROOT.TCanvas("mass_scan", "mass_scan", 1200, 500)
+    canvas.Divide(2, 1)
+    graphs = [ROOT.TGraph(len(masses), np.asarray(masses, dtype=np.float64),
+                          np.maximum(np.asarray(values, dtype=np.float64), 1e-300))
+              for values in [p_value, curve]]
+    titles = [";m_{H} [GeV];Local p-value", ";m_{H} [GeV];-2 #Delta ln L"]
+    for pad, (graph, title) in enumerate(zip(graphs, titles), start=1):
+        canvas.cd(pad)
+        graph.SetTitle(title)
+        graph.SetLineWidth(2)
+        graph.Draw("AL")
+    canvas.cd(1).SetLogy()
+    canvas.SaveAs(file_name)
+
+def mass_scan(workspace_path, masses, shape, selection, args, logger):
+    """ Scan the mass hypothesis over the grid of ``MASS_SCAN`` and save
+    the local significance and the profile-likelihood curve.
+
+    :param workspace_path: Path to the workspace with the model fitted on the data
+    :type workspace_path: str
+    :param masses: Masses of the Higgs candidates of the data
+    :type masses: numpy.ndarray
+    :param shape: Width, tail and normalization of the Crystal Ball fitted on the signal
+    :type shape: dict(str, float)
+    :param selection: Name of the selection
+    :type selection: str
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Summary of the scan
+    :rtype: dict
+    """
+
+    start_time = time.time()
+
+    points = scan_points(*MASS_SCAN["range"], MASS_SCAN["step"])
+    jobs = list(enumerate(float(mass) for mass in points))
+    n_workers, _ = parallel_tools.worker_layout(len(jobs), args.nWorkers if args.parallel else 1)
+
+    # The masses of the data are shared by all the workers
+    masses = np.ascontiguousarray(masses, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(masses.nbytes, 1))
+    np.ndarray(masses.shape, dtype=np.float64, buffer=shm.buf)[:] = masses
+    config = {
+        "workspace": workspace_path,
+        "observable": "Higgs_mass",
+        "shm_name": shm.name,
+        "n_events": len(masses),
+        "shape": shape,
+        "backend": args.fitBackend,
+        "log_level": logger.level,
+    }
+    logger.info(">>> Scanning %s masses of %s on %s workers", len(jobs), selection, n_workers)
+
+    results = []
+    try:
+        if n_workers == 1:
+            init_worker(config)
+            results = [fit_point(job) for job in jobs]
+        else:
+            with parallel_tools.pinned_threads(1), \
+                    multiprocessing.get_context("spawn").Pool(
+                        n_workers, initializer=init_worker, initargs=(config,)) as pool:
+                for result in pool.imap_unordered(fit_point, jobs):
+                    logger.debug("Mass %s fitted by worker %s in %s s",
+                                 result["mass"], result["worker"], result["time"])
+                    results.append(result)
+    finally:
+        shm.close()
+        shm.unlink()
+    results.sort(key=lambda result: result["index"])
+
+    nll_best = np.array([result["nll_best"] for result in results])
+    nll_null = np.array([result["nll_null"] for result in results])
+    q_0, p_value, significance = local_significance(nll_null, nll_best)
+    curve, best_mass, low, high = profile_curve(points, nll_best)
+
+    dir_name = os.path.dirname(workspace_path)
+    np.savez_compressed(os.path.join(dir_name, f"mass_scan_{selection}.npz"), mass=points,
+                        nll_best=nll_best, nll_null=nll_null, q0=q_0, p_value=p_value,
+                        significance=significance, profile=curve,
+                        n_sig=np.array([result["n_sig"] for result in results]),
+                        n_sig_error=np.array([result["n_sig_error"] for result in results]),
+                        status=np.array([result["status"] for result in results], dtype=np.int32))
+    plot_scan(points, p_value, curve, os.path.join(dir_name, f"mass_scan_{selection}.pdf"))
+
+    peak = int(np.argmax(significance))
+    summary = {"best_mass": best_mass, "interval": [low, high],
+               "max_significance": float(significance[peak]),
+               "max_significance_mass": float(points[peak]),
+               "min_p_value": float(p_value[peak]),
+               "failed_fits": int(sum(result["status"] != 0 for result in results)),
+               "workers": n_workers, "time": time.time() - start_time}
+    cache_tools.save_manifest(os.path.join(dir_name, f"mass_scan_{selection}.json"), summary)
+
+    logger.info("Profile likelihood of %s: m_H = %.2f GeV, -2 Delta ln L < 1 in [%.2f, %.2f]",
+                selection, best_mass, low, high)
+    logger.info("Largest local significance of %s: %.2f sigma (p-value %.3g) at %.2f GeV",
+                selection, summary["max_significance"], summary["min_p_value"],
+                summary["max_significance_mass"])
+    logger.info(">>> Mass scan of %s in %s s", selection, summary["time"])
+    return summary
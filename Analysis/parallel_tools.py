@@ -0,0 +1,48 @@
+""" Helpers to run the steps of the analysis on a pool of worker processes.
+Each worker is given a limited number of threads, so that the workers
+together don't use more than the available cores.
+"""
+
+import contextlib
+import os
+
+# Environment variables limiting the threads of the numerical libraries
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]
+
+
+def worker_layout(n_tasks, n_workers):
+    """ Number of worker processes and of threads for each of them.
+
+    :param n_tasks: Number of tasks to be executed
+    :type n_tasks: int
+    :param n_workers: Number of workers requested, all the cores if 0
+    :type n_workers: int
+    :return: Number of workers and number of threads of each worker
+    :rtype: tuple(int, int)
+    """
+
+    n_cores = os.cpu_count() or 1
+    workers = max(1, min(n_tasks, n_workers if n_workers > 0 else n_cores))
+    return workers, max(1, n_cores // workers)
+
+@contextlib.contextmanager
+def pinned_threads(threads):
+    """ Context in which the processes started inherit the limit on the
+    number of threads. The thread pools are created when the workers
+    start, so the limit must be set in the environment they inherit.
+
+    :param threads: Number of threads of each worker
+    :type threads: int
+    """
+
+    old_env = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: str(threads) for name in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
@@ -10,7 +10,12 @@ import sys
 
 sys.path.append(os.path.join("..", ""))
 
+from Analysis import dataset_io
+from Analysis.Definitions.dnn_model_def import INFERENCE_ENGINES
+from Analysis.Definitions.fit_def import FIT_BACKENDS
 from Analysis.Definitions.samples_def import SAMPLES
+from Analysis.Definitions.selections_def import SIGNIFICANCE_METRICS
+from Analysis.Definitions.storage_def import STORAGE_FORMATS
 from Analysis.Definitions.variables_def import VARIABLES_COMPLETE
 from Analysis.Definitions.variables_ml_def import VARIABLES_ML_DICT
 
@@ -141,6 +146,90 @@ def set_up (args):
     except AttributeError:
         pass
 
+    # Check if kFolds is valid
+    try:
+        if args.kFolds < 1:
+            raise argparse.ArgumentTypeError(
+                f"the value for kFolds {args.kFolds} is invalid: it must be at least 1")
+    except argparse.ArgumentTypeError as arg_err:
+        logger.exception("%s \n kFolds is set to 1 \n", arg_err, stack_info=True)
+        args.kFolds = 1
+    except AttributeError:
+        pass
+
+    # Check if trainingSize is valid
+    try:
+        if args.trainingSize < 0:
+            raise argparse.ArgumentTypeError(
+                f"the value for trainingSize {args.trainingSize} is invalid: it must be at least 0")
+    except argparse.ArgumentTypeError as arg_err:
+        logger.exception("%s \n trainingSize is set to 0 \n", arg_err, stack_info=True)
+        args.trainingSize = 0
+    except AttributeError:
+        pass
+
+    # Check if bootstrap is valid
+    try:
+        if args.bootstrap < 0:
+            raise argparse.ArgumentTypeError(
+                f"the value for bootstrap {args.bootstrap} is invalid: it must be at least 0")
+    except argparse.ArgumentTypeError as arg_err:
+        logger.exception("%s \n bootstrap is set to 0 \n", arg_err, stack_info=True)
+        args.bootstrap = 0
+    except AttributeError:
+        pass
+
+    # Check if toys is valid
+    try:
+        if args.toys < 0:
+            raise argparse.ArgumentTypeError(
+                f"the value for toys {args.toys} is invalid: it must be at least 0")
+    except argparse.ArgumentTypeError as arg_err:
+        logger.exception("%s \n toys is set to 0 \n", arg_err, stack_info=True)
+        args.toys = 0
+    except AttributeError:
+        pass
+
+    # Check if storage is valid and supported by the installed ROOT
+    try:
+        args.storage = check_val(logger, args.storage, STORAGE_FORMATS, "storage")
+        if args.storage == "rntuple":
+            dataset_io.check_rntuple()
+    except RuntimeError as root_err:
+        logger.exception("%s \n storage is set to %s \n", root_err, STORAGE_FORMATS[0],
+                         stack_info=True)
+        args.storage = STORAGE_FORMATS[0]
+    except AttributeError:
+        pass
+
+    # Check if inferenceEngine is valid
+    try:
+        args.inferenceEngine = check_val(logger, args.inferenceEngine,
+            INFERENCE_ENGINES, "inferenceEngine")
+    except AttributeError:
+        pass
+
+    # Check if fitBackend is valid
+    try:
+        args.fitBackend = check_val(logger, args.fitBackend, FIT_BACKENDS, "fitBackend")
+    except AttributeError:
+        pass
+
+    # Check if significance is valid
+    try:
+        args.significance = check_val(logger, args.significance,
+            SIGNIFICANCE_METRICS, "significance")
+    except AttributeError:
+        pass
+
+    # The fused ML step computes the discriminant inside the event loop
+    try:
+        if args.fusedML and not args.inGraphDNN:
+            logger.info("The option fusedML enables inGraphDNN")
+            args.inGraphDNN = True
+    except AttributeError:
+        pass
+
     # Create the directory to save the downloaded files
     # if doesn't already exist and create .gitignore
     try:
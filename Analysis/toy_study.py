@@ -0,0 +1,211 @@
+""" Pseudo-experiments of the fit of the data of ``fit_mass.py``.
+Pseudo-datasets are generated from the total PDF (Crystal Ball of the
+signal and KDE of the background) with the parameters fitted on the data,
+with a Poisson number of events of mean the number of events of the data,
+and they are fitted again with the same model. The toys are split in chunks
+fitted on a pool of worker processes, each of which reads the model from the
+workspace written by the fit. Every toy has its own seed, derived from
+``TOYS["seed"]`` and from its index, so the results don't depend on the
+number of workers. The fitted values, uncertainties and pulls of the floating
+parameters are saved in ``Fit_results/toys_{selection}.npz``, and their bias,
+pull distribution and coverage in ``Fit_results/toys_{selection}.json``.
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import ROOT
+
+from Analysis import cache_tools, fit_tools, parallel_tools
+from Analysis.Definitions.fit_def import TOYS
+
+# Model of the fit and configuration of the process fitting the toys
+_WORKER = {}
+
+
+def toy_seed(index):
+    """ Seed of a toy, independent of those of the other toys.
+
+    :param index: Index of the toy
+    :type index: int
+    :return: Seed of the generators, never 0 since ROOT would draw a random one
+    :rtype: int
+    """
+
+    state = np.random.SeedSequence(TOYS["seed"], spawn_key=(index,)).generate_state(1)
+    return int(state[0]) % (2**32 - 1) + 1
+
+def init_worker(config):
+    """ Read the model fitted on the data in the process fitting the toys.
+
+    :param config: Path to the workspace, name of the observable,
+        backend of the fits and logging level
+    :type config: dict
+    """
+
+    logging.basicConfig( format="\n%(asctime)s - %(filename)s - %(message)s")
+    log = logging.getLogger()
+    log.setLevel(config["log_level"])
+
+    ROOT.gROOT.SetBatch(True)
+    if config["log_level"] >= 20:
+        ROOT.gErrorIgnoreLevel = ROOT.kWarning
+        ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+
+    infile = ROOT.TFile.Open(config["workspace"], "READ")
+    w_s = infile.Get("ws")
+    pdf = w_s.pdf("totPDF")
+    observable = w_s.var(config["observable"])
+    params = pdf.getParameters(ROOT.RooArgSet(observable))
+    _WORKER.update(log=log, config=config, file=infile, ws=w_s, pdf=pdf,
+                   observable=observable, params=params, truth=params.snapshot(),
+                   n_expected=w_s.data("data").numEntries())
+
+def fit_toys(job):
+    """ Generate and fit a chunk of toys.
+
+    :param job: Index of the first toy and number of toys
+    :type job: tuple(int, int)
+    :return: Indices of the toys, fitted values and uncertainties of the floating
+        parameters, status of the fits, worker and wall time
+    :rtype: dict
+    """
+
+    start_time = time.time()
+    first, n_toys = job
+    pdf, observable = _WORKER["pdf"], _WORKER["observable"]
+    params, truth = _WORKER["params"], _WORKER["truth"]
+
+    values, errors, status = [], [], []
+    for index in range(first, first + n_toys):
+        seed = toy_seed(index)
+        ROOT.RooRandom.randomGenerator().SetSeed(seed)
+        n_events = np.random.default_rng(seed).poisson(_WORKER["n_expected"])
+        params.assignValueOnly(truth)
+        toy = pdf.generate(ROOT.RooArgSet(observable), int(n_events))
+        result, _ = fit_tools.run_fit(pdf, toy, _WORKER["config"]["backend"], 1)
+        fitted = fit_tools.parameter_values(result)
+        values.append([fitted[name][0] for name in _WORKER["config"]["parameters"]])
+        errors.append([fitted[name][1] for name in _WORKER["config"]["parameters"]])
+        status.append(result.status())
+        del toy
+
+    return {"indices": np.arange(first, first + n_toys), "values": np.array(values),
+            "errors": np.array(errors), "status": np.array(status, dtype=np.int32),
+            "worker": os.getpid(), "time": time.time() - start_time}
+
+def summarize_toys(values, errors, truth, status):
+    """ Bias, distribution of the pulls and coverage of a parameter over the
+    toys whose fit converged. The coverage is the fraction of toys in which
+    the true value is within one uncertainty from the fitted one.
+
+    :param values: Fitted values of the toys
+    :type values: numpy.ndarray
+    :param errors: Fitted uncertainties of the toys
+    :type errors: numpy.ndarray
+    :param truth: True value of the parameter
+    :type truth: float
+    :param status: Status of the fits, 0 if converged
+    :type status: numpy.ndarray
+    :return: Number of converged toys, mean and error of the bias, mean and
+        standard deviation of the pulls and coverage
+    :rtype: dict(str, float)
+    """
+
+    good = (status == 0) & (errors > 0)
+    n_good = int(good.sum())
+    if n_good < 2:
+        return {"converged": n_good}
+    bias = values[good] - truth
+    pulls = bias / errors[good]
+    return {"converged": n_good,
+            "bias": float(bias.mean()),
+            "bias_error": float(bias.std(ddof=1) / np.sqrt(n_good)),
+            "pull_mean": float(pulls.mean()),
+            "pull_width": float(pulls.std(ddof=1)),
+            "coverage": float(np.mean(np.abs(pulls) <= 1.))}
+
+def toy_study(workspace_path, selection, args, logger):
+    """ Generate and fit ``--toys`` pseudo-experiments of the fit of the data
+    of a selection, and save their results and summary.
+
+    :param workspace_path: Path to the workspace with the model fitted on the data
+    :type workspace_path: str
+    :param selection: Name of the selection
+    :type selection: str
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :return: Summary of each floating parameter
+    :rtype: dict(str, dict)
+    """
+
+    start_time = time.time()
+
+    infile = ROOT.TFile.Open(workspace_path, "READ")
+    w_s = infile.Get("ws")
+    observable = w_s.pdf("totPDF").getObservables(w_s.data("data")).first().GetName()
+    fitted = w_s.pdf("totPDF").getParameters(w_s.data("data"))
+    parameters = [param.GetName() for param in fitted if not param.isConstant()]
+    truth = np.array([fitted.find(name).getVal() for name in parameters])
+    infile.Close()
+
+    jobs = [(first, min(TOYS["chunk_size"], args.toys - first))
+            for first in range(0, args.toys, TOYS["chunk_size"])]
+    n_workers, _ = parallel_tools.worker_layout(len(jobs), args.nWorkers if args.parallel else 1)
+    config = {
+        "workspace": workspace_path,
+        "observable": observable,
+        "parameters": parameters,
+        "backend": args.fitBackend,
+        "log_level": logger.level,
+    }
+    logger.info(">>> Fitting %s toys of %s in %s chunks on %s workers",
+                args.toys, selection, len(jobs), n_workers)
+
+    results = []
+    if n_workers == 1:
+        init_worker(config)
+        results = [fit_toys(job) for job in jobs]
+    else:
+        with parallel_tools.pinned_threads(1), \
+                multiprocessing.get_context("spawn").Pool(
+                    n_workers, initializer=init_worker, initargs=(config,)) as pool:
+            for result in pool.imap_unordered(fit_toys, jobs):
+                logger.debug("Toys from %s fitted by worker %s in %s s",
+                             result["indices"][0], result["worker"], result["time"])
+                results.append(result)
+    results.sort(key=lambda result: result["indices"][0])
+
+    values = np.concatenate([result["values"] for result in results])
+    errors = np.concatenate([result["errors"] for result in results])
+    status = np.concatenate([result["status"] for result in results])
+    pulls = np.divide(values - truth, errors, out=np.zeros_like(values), where=errors > 0)
+
+    dir_name = os.path.dirname(workspace_path)
+    np.savez_compressed(os.path.join(dir_name, f"toys_{selection}.npz"),
+                        parameters=np.array(parameters), truth=truth,
+                        seeds=np.array([toy_seed(i) for i in range(args.toys)], dtype=np.uint32),
+                        values=values.astype(np.float32), errors=errors.astype(np.float32),
+                        pulls=pulls.astype(np.float32), status=status)
+
+    wall_time = time.time() - start_time
+    summary = {name: summarize_toys(values[:, i], errors[:, i], truth[i], status)
+               for i, name in enumerate(parameters)}
+    throughput = args.toys / wall_time / n_workers
+    cache_tools.save_manifest(os.path.join(dir_name, f"toys_{selection}.json"), {
+        "toys": args.toys, "seed": TOYS["seed"], "workers": n_workers,
+        "time": wall_time, "toys_per_second_per_core": throughput, "parameters": summary})
+
+    for name, stats in summary.items():
+        if "pull_mean" in stats:
+            logger.info("%s: bias %.4g +/- %.4g, pull %.3f +/- %.3f, coverage %.3f", name,
+                        stats["bias"], stats["bias_error"], stats["pull_mean"],
+                        stats["pull_width"], stats["coverage"])
+    logger.info(">>> %s toys of %s fitted in %s s: %.3g toys/s/core, %s converged",
+                args.toys, selection, wall_time, throughput, int((status == 0).sum()))
+    return summary
@@ -0,0 +1,63 @@
+""" Tests for the bootstrap replicas defined in ``bootstrap.py``.
+"""
+
+import unittest
+
+import numpy as np
+import ROOT
+
+from Analysis.Histogramming import bootstrap
+
+
+class TestBootstrap(unittest.TestCase):
+    """ Test class for the functions defined in ``bootstrap.py``.
+    """
+
+    def setUp(self):
+        """ Toy dataset of weighted events spread uniformly over 10 bins.
+        """
+        ROOT.TH1.AddDirectory(False)
+        self.n_replicas = 200
+        self.range_ = (10, 0., 1.)
+        self.rdf = ROOT.RDataFrame(20000) \
+            .Define("x", "(rdfentry_ % 1000) / 1000.") \
+            .Define("Weight", "0.5 + (rdfentry_ % 3) * 0.25")
+
+    def replicas(self, seed):
+        """ Content of the histogram of the replicas of ``x`` for a given seed.
+        """
+        rdf = bootstrap.define_replicas(self.rdf, ["x"], self.n_replicas, seed)
+        return bootstrap.book_bootstrap(rdf, "x", self.range_, self.n_replicas).GetValue()
+
+    def test_reproducible(self):
+        """ Test that the same seed gives the same replicas and a different one doesn't.
+        """
+        first = bootstrap.histogram_to_numpy(self.replicas(1234))
+        second = bootstrap.histogram_to_numpy(self.replicas(1234))
+        other = bootstrap.histogram_to_numpy(self.replicas(4321))
+        np.testing.assert_array_equal(first, second)
+        self.assertFalse(np.array_equal(first, other))
+
+    def test_errors(self):
+        """ Test that the spread of the replicas matches the square root of
+            the sum of the squared weights within the statistical precision
+            of 200 replicas.
+        """
+        errors = bootstrap.bootstrap_errors(self.replicas(1234))
+        histo = self.rdf.Histo1D(ROOT.RDF.TH1DModel("x", "x", *self.range_),
+                                 "x", "Weight").GetValue()
+        sumw2 = np.array([histo.GetBinError(i) for i in range(1, self.range_[0] + 1)])
+        np.testing.assert_allclose(errors[1:-1], sumw2, rtol=0.2)
+        np.testing.assert_array_equal(errors[[0, -1]], 0.)
+
+    def test_seed(self):
+        """ Test that the datasets get different seeds.
+        """
+        self.assertEqual(bootstrap.bootstrap_seed("SMHiggsToZZTo4L", "FourMuons"),
+                         bootstrap.bootstrap_seed("SMHiggsToZZTo4L", "FourMuons"))
+        self.assertNotEqual(bootstrap.bootstrap_seed("SMHiggsToZZTo4L", "FourMuons"),
+                            bootstrap.bootstrap_seed("SMHiggsToZZTo4L", "FourElectrons"))
+
+
+if __name__ == "__main__":
+    unittest.main()
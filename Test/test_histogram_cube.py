@@ -0,0 +1,63 @@
+""" Tests for the sparse N-dimensional histograms defined in ``histogram_cube.py``.
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+from Analysis.Histogramming import histogram_cube
+
+
+class TestHistogramCube(unittest.TestCase):
+    """ Test class for the functions defined in ``histogram_cube.py``.
+    """
+
+    def setUp(self):
+        """ Fill a cube of ``Higgs_mass`` and ``Discriminant`` with a few events,
+            one of which is in the overflow of the mass.
+        """
+        arrays = {"Higgs_mass": np.array([100.1, 100.1, 125., 200.]),
+                  "Discriminant": np.array([0.1, 0.9, 0.95, 0.5])}
+        self.cube = histogram_cube.fill_cube(arrays, ["Higgs_mass", "Discriminant"],
+                                             np.array([1., 2., 3., 4.]))
+
+    def test_sparse(self):
+        """ Test that only the filled bins are stored.
+        """
+        self.assertEqual(len(self.cube["sumw"]), 4)
+        self.assertAlmostEqual(self.cube["sumw"].sum(), 10.)
+
+    def test_projection(self):
+        """ Test the projection on one variable, including the overflow.
+        """
+        values, errors, edges = histogram_cube.project(self.cube, ["Higgs_mass"])
+        self.assertEqual(values.shape, (len(edges[0]) + 1,))
+        self.assertAlmostEqual(values.sum(), 10.)
+        self.assertAlmostEqual(values[-1], 4.)
+        self.assertAlmostEqual(errors.max(), 4.)
+
+    def test_cut(self):
+        """ Test that a threshold on the discriminant drops the events below it.
+        """
+        values, _, _ = histogram_cube.project(self.cube, ["Higgs_mass"],
+                                              cuts={"Discriminant": (0.3, None)})
+        self.assertAlmostEqual(values.sum(), 9.)
+
+    def test_rebin(self):
+        """ Test that merging the bins preserves the content and sums the variances.
+        """
+        values, errors, edges = histogram_cube.project(self.cube, ["Higgs_mass"],
+                                                       rebin={"Higgs_mass": 4})
+        self.assertEqual(len(edges[0]), 111)
+        self.assertAlmostEqual(values.sum(), 10.)
+        self.assertAlmostEqual(errors.max(), 4.)
+        mass_bin = np.searchsorted(edges[0], 100.1, side="right")
+        self.assertAlmostEqual(values[mass_bin], 3.)
+        self.assertAlmostEqual(errors[mass_bin], math.sqrt(5.))
+        with self.assertRaises(ValueError):
+            histogram_cube.project(self.cube, ["Higgs_mass"], rebin={"Higgs_mass": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+""" Tests for the index of the histograms defined in ``histogram_index.py``.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from Analysis.Plotting import histogram_index
+
+
+class TestHistogramIndex(unittest.TestCase):
+    """ Test class for the functions defined in ``histogram_index.py``.
+    """
+
+    def setUp(self):
+        """ Build by hand the index of the histograms of Higgs_mass without
+        selection for two data samples and one simulated sample.
+        """
+
+        samples = ["Run2012B_DoubleMuParked", "Run2012C_DoubleMuParked", "ZZTo4mu"]
+        shape = (1, len(samples), 3, 5)
+        sumw = np.zeros(shape)
+        sumw[0, 0, 0] = [0., 1., 2., 3., 0.]
+        sumw[0, 1, 0] = [0., 1., 1., 1., 1.]
+        sumw[0, 2, :] = [0., 2., 2., 0., 0.]
+        filled = np.zeros(shape[:3], dtype=bool)
+        filled[0, :2, 0] = True
+        filled[0, 2, :] = True
+        self.index = histogram_index._lookup({
+            "keys": [["Higgs_mass", "NoSelection"]], "samples": samples,
+            "final_states": list(histogram_index.FINAL_STATES),
+            "edges": {"Higgs_mass": np.array([70., 100., 130., 180.])},
+            "sumw": sumw, "sumw2": sumw, "filled": filled})
+
+    def test_parse_name(self):
+        """ Test the split of the names of the histograms.
+        """
+
+        self.assertEqual(histogram_index.parse_name(
+                            "Run2012B_DoubleMuParked_FourMuons_cos_theta_star_DNNSelection"),
+                         ("Run2012B_DoubleMuParked", "FourMuons", "cos_theta_star",
+                          "DNNSelection"))
+        self.assertIsNone(histogram_index.parse_name(
+                            "ZZTo4mu_FourMuons_Higgs_mass_NoSelection_bootstrap"))
+
+    def test_view(self):
+        """ Test the sum of the samples and the missing histograms.
+        """
+
+        sumw, _ = histogram_index.view(self.index, ["Run2012B_DoubleMuParked",
+                                                    "Run2012C_DoubleMuParked"],
+                                       "FourMuons", "Higgs_mass", "NoSelection")
+        np.testing.assert_allclose(sumw, [0., 2., 3., 4., 1.])
+        with self.assertRaises(KeyError):
+            histogram_index.view(self.index, ["Run2012B_DoubleMuParked"], "FourElectrons",
+                                 "Higgs_mass", "NoSelection")
+
+    def test_combine_normalize(self):
+        """ Test the sum of the final states and the normalization.
+        """
+
+        views = {final_state: histogram_index.view(self.index, ["ZZTo4mu"], final_state,
+                                                   "Higgs_mass", "NoSelection")
+                 for final_state in histogram_index.FINAL_STATES}
+        sumw, sumw2 = histogram_index.normalize(histogram_index.combine(views))
+        np.testing.assert_allclose(sumw, [0., 50., 50., 0., 0.])
+        np.testing.assert_allclose(sumw2, [0., 6. * (100. / 12.)**2, 6. * (100. / 12.)**2,
+                                            0., 0.])
+
+    def test_export(self):
+        """ Test that the memory-mapped export gives the same views.
+        """
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            histogram_index.save_index(self.index, os.path.join(tmp_dir, "Index"))
+            loaded = histogram_index.load_index(os.path.join(tmp_dir, "Index"))
+            for index in [self.index, loaded]:
+                sumw, _ = histogram_index.view(index, ["ZZTo4mu"], "TwoMuonsTwoElectrons",
+                                               "Higgs_mass", "NoSelection")
+                np.testing.assert_allclose(sumw, [0., 2., 2., 0., 0.])
+
+
+if __name__ == "__main__":
+    unittest.main()
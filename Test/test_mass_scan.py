@@ -0,0 +1,42 @@
+""" Tests for the curves of the scan of the mass defined in ``mass_scan.py``.
+"""
+
+import unittest
+
+import numpy as np
+
+from Analysis import mass_scan
+
+
+class TestMassScan(unittest.TestCase):
+    """ Test class for the functions defined in ``mass_scan.py``.
+    """
+
+    def test_scan_points(self):
+        """ Test that the grid includes both extremes.
+        """
+        points = mass_scan.scan_points(110., 140., 0.5)
+        self.assertEqual(len(points), 61)
+        self.assertAlmostEqual(points[0], 110.)
+        self.assertAlmostEqual(points[-1], 140.)
+
+    def test_local_significance(self):
+        """ Test the significance of a signal and of a negative fluctuation.
+        """
+        q_0, p_value, significance = mass_scan.local_significance(np.array([5., 3.]),
+                                                                  np.array([3., 3.5]))
+        np.testing.assert_allclose(q_0, [4., 0.])
+        np.testing.assert_allclose(significance, [2., 0.])
+        np.testing.assert_allclose(p_value, [0.0227501, 0.5], rtol=1e-5)
+
+    def test_profile_curve(self):
+        """ Test the minimum of the profile likelihood and its interval.
+        """
+        curve, best, low, high = mass_scan.profile_curve(np.array([120., 125., 130.]),
+                                                         np.array([2., 1., 1.4]))
+        np.testing.assert_allclose(curve, [2., 0., 0.8])
+        self.assertEqual((best, low, high), (125., 125., 130.))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+""" Tests for the merging of the partial results defined in ``merge_histo.py``.
+"""
+
+import unittest
+
+import numpy as np
+import ROOT
+
+from Analysis.Histogramming import merge_histo
+from Analysis.Histogramming.histogramming_functions import histogram_to_numpy
+
+
+class TestMergeHisto(unittest.TestCase):
+    """ Test class for the functions defined in ``merge_histo.py``.
+    """
+
+    def setUp(self):
+        """ Keep the histograms out of the current directory, so that
+            the partial results can reuse the same names.
+        """
+        ROOT.TH1.AddDirectory(False)
+        self.rng = np.random.default_rng(42)
+
+    def partials(self, n_partials):
+        """ Partial results with weighted histograms of ``Higgs_mass`` in all of them
+            and of ``Discriminant`` only in the even ones.
+        """
+        partials = []
+        for i in range(n_partials):
+            partial = {}
+            for name in ["Higgs_mass", "Discriminant"] if i % 2 == 0 else ["Higgs_mass"]:
+                histo = ROOT.TH1D(f"{name}_{i}", name, 10, 0., 1.)
+                histo.Sumw2()
+                for value, weight in zip(self.rng.uniform(-0.1, 1.1, 50),
+                                         self.rng.uniform(0.5, 2., 50)):
+                    histo.Fill(value, weight)
+                partial[name] = histo
+            partials.append(partial)
+        return partials
+
+    def check_sums(self, n_partials):
+        """ Test that the tree reduction gives the direct sum of the contents
+            and of the squared weights of every histogram.
+        """
+        partials = self.partials(n_partials)
+        expected = {}
+        for partial in partials:
+            for name, histo in partial.items():
+                sums = np.array([histogram_to_numpy(histo),
+                                 [histo.GetSumw2()[i] for i in range(histo.GetNcells())]])
+                expected[name] = expected.get(name, 0.) + sums
+
+        merged = merge_histo.tree_reduce(partials)
+        self.assertEqual(set(merged), set(expected))
+        for name, histo in merged.items():
+            np.testing.assert_allclose(histogram_to_numpy(histo), expected[name][0])
+            np.testing.assert_allclose([histo.GetSumw2()[i] for i in range(histo.GetNcells())],
+                                       expected[name][1])
+
+    def test_single(self):
+        """ Test that a single partial result is returned as it is.
+        """
+        self.check_sums(1)
+
+    def test_even(self):
+        """ Test the sum of an even number of partial results.
+        """
+        self.check_sums(2)
+        self.check_sums(4)
+
+    def test_odd(self):
+        """ Test the sum of an odd number of partial results, where one
+            is carried over to the next level without a pair.
+        """
+        self.check_sums(3)
+        self.check_sums(5)
+
+    def test_empty(self):
+        """ Test that no partial results give no histograms.
+        """
+        self.assertEqual(merge_histo.tree_reduce([]), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+""" Tests for the NumPy runtime of the DNN defined in ``ml_inference.py``
+and for the assignment of the events to the folds in ``ml_kfold.py``.
+"""
+
+import math
+import unittest
+
+import numpy as np
+import ROOT
+
+from Analysis.Definitions.variables_ml_def import KFOLD_VARIABLES
+from Analysis.Machine_Learning import ml_inference, ml_kfold
+
+
+class TestMLInference(unittest.TestCase):
+    """ Test class for the functions defined in ``ml_inference.py``
+        and ``ml_kfold.py``.
+    """
+
+    def test_erfinv(self):
+        """ Test that the inverse error function inverts ``math.erf``
+            also close to the limits of its domain.
+        """
+        values = np.array([-ml_inference.MAX_ERFINV_ARG, -0.9, -0.3, 0., 1e-5, 0.5, 0.999])
+        for value, result in zip(values, ml_inference.erfinv(values)):
+            self.assertAlmostEqual(math.erf(result), value, 12)
+
+    def test_transform(self):
+        """ Test the decorrelation and the gaussianisation of the inputs:
+            a uniform cumulative distribution of a variable uniform in [0, 1]
+            maps the median to 0 and the first quartile to the Gaussian one.
+        """
+        centers = np.linspace(0.05, 0.95, 10)
+        model = {"decorr": np.array([[2., 0.], [0., 1.]]),
+                 "cdf": [(2 * centers, centers), (centers, centers)]}
+        result = ml_inference.transform(model, np.array([[0.5, 0.25]]))
+        self.assertAlmostEqual(result[0, 0], 0., 7)
+        self.assertAlmostEqual(result[0, 1], -0.6744897501960817, 7)
+
+    def test_score(self):
+        """ Test that the discriminant is the softmax output of the signal node.
+        """
+        centers = np.linspace(0.05, 0.95, 10)
+        model = {"variables": ["x"], "decorr": np.eye(1), "cdf": [(centers, centers)],
+                 "layers": [(np.array([[1., -1.]]), np.zeros(2), "relu"),
+                            (np.eye(2), np.zeros(2), "softmax")]}
+        result = ml_inference.score(model, {"x": np.array([0.5, 0.9])})
+        self.assertAlmostEqual(float(result[0]), 0.5, 6)
+        gauss = math.sqrt(2.) * float(ml_inference.erfinv(np.array([0.8]))[0])
+        self.assertAlmostEqual(float(result[1]), 1. / (1. + math.exp(-gauss)), 6)
+
+    def test_fold_index(self):
+        """ Test that the folds computed in NumPy are the same
+            as the ones computed by ``kfoldIndex`` in the event loop.
+        """
+        rng = np.random.default_rng(1)
+        arrays = {var: rng.normal(100., 30., 50).astype(np.float32) for var in KFOLD_VARIABLES}
+        folds = ml_kfold.fold_index(arrays, 5)
+        ml_kfold.declare_fold_index()
+        for i, fold in enumerate(folds):
+            self.assertEqual(ROOT.kfoldIndex(*[float(arrays[var][i])
+                                               for var in KFOLD_VARIABLES], 5), fold)
+        self.assertEqual(set(folds), set(range(5)))
+
+
+if __name__ == "__main__":
+    unittest.main()
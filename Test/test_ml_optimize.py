@@ -0,0 +1,103 @@
+""" Tests for the scan of the threshold on the discriminant defined in ``ml_optimize.py``.
+"""
+
+import unittest
+
+import numpy as np
+import ROOT
+
+from Analysis.Machine_Learning import ml_optimize
+
+
+def brute_force(discr, weights, thresholds):
+    """ Weighted events above each threshold, summed one threshold at a time.
+    """
+    return np.array([weights[discr >= threshold].sum() for threshold in thresholds])
+
+
+class TestMLOptimize(unittest.TestCase):
+    """ Test class for the functions defined in ``ml_optimize.py``.
+    """
+
+    def setUp(self):
+        """ Weighted signal and background events in 5 bins of the discriminant,
+            with some signal in the overflow and some background in the underflow.
+            The signal peaks at high values of the discriminant and the background
+            at low ones, so S/sqrt(B) is largest above the last threshold.
+        """
+        self.thresholds = np.linspace(0., 1., 6)[:-1]
+        self.sig_discr = np.array([0.1, 0.3, 0.5, 0.55, 0.7, 0.75, 0.9, 0.95, 1.2])
+        self.sig_weights = np.array([1., 1., 1., 1., 2., 2., 3., 3., 2.])
+        self.bkg_discr = np.array([-0.2, 0.05, 0.15, 0.25, 0.35, 0.45, 0.5, 0.65, 0.85])
+        self.bkg_weights = np.array([4., 3., 3., 3., 3., 2., 1., 1., 0.5])
+        self.histos = {}
+        for name, discr, weights in [("signal", self.sig_discr, self.sig_weights),
+                                     ("background", self.bkg_discr, self.bkg_weights)]:
+            histo = ROOT.TH1D(f"test_{name}", name, 5, 0., 1.)
+            histo.SetDirectory(ROOT.nullptr)
+            for value, weight in zip(discr, weights):
+                histo.Fill(value, weight)
+            self.histos[name] = histo
+
+    def test_yields(self):
+        """ Test that the underflow and overflow are added to the first and last bins.
+        """
+        signal = ml_optimize.discriminant_yields(self.histos["signal"])
+        background = ml_optimize.discriminant_yields(self.histos["background"])
+        self.assertEqual(signal.shape, (1, 5))
+        np.testing.assert_allclose(signal[0], [1., 1., 2., 4., 8.])
+        np.testing.assert_allclose(background[0], [10., 6., 3., 1., 0.5])
+
+    def test_mass_bins(self):
+        """ Test that the events outside of the mass bins are dropped.
+        """
+        histo = ROOT.TH2D("test_mass", "mass", 5, 0., 1., 2, 110., 140.)
+        histo.SetDirectory(ROOT.nullptr)
+        for discr, mass in [(0.1, 115.), (0.3, 125.), (0.9, 125.), (0.9, 150.)]:
+            histo.Fill(discr, mass, 1.)
+        yields = ml_optimize.discriminant_yields(histo)
+        self.assertEqual(yields.shape, (2, 5))
+        np.testing.assert_allclose(yields, [[1., 0., 0., 0., 0.], [0., 1., 0., 0., 1.]])
+
+    def test_scan(self):
+        """ Test the cumulative sums and the significances against a brute-force
+            scan of the thresholds, and the threshold of the best S/sqrt(B).
+        """
+        scan = ml_optimize.significance_scan(
+            ml_optimize.discriminant_yields(self.histos["signal"]),
+            ml_optimize.discriminant_yields(self.histos["background"]))
+        signal = brute_force(np.clip(self.sig_discr, 0., None), self.sig_weights,
+                             self.thresholds)
+        background = brute_force(np.clip(self.bkg_discr, 0., None), self.bkg_weights,
+                                 self.thresholds)
+        np.testing.assert_allclose(scan["signal"], signal)
+        np.testing.assert_allclose(scan["background"], background)
+        np.testing.assert_allclose(scan["s_sqrt_b"], signal / np.sqrt(background))
+        np.testing.assert_allclose(scan["s_sqrt_sb"], signal / np.sqrt(signal + background))
+        asimov = np.sqrt(2. * ((signal + background) * np.log1p(signal / background) - signal))
+        np.testing.assert_allclose(scan["asimov"], asimov)
+        self.assertEqual(int(np.argmax(scan["s_sqrt_b"])), 4)
+
+    def test_min_background(self):
+        """ Test that the thresholds with too little background are skipped.
+        """
+        scan = ml_optimize.significance_scan(
+            ml_optimize.discriminant_yields(self.histos["signal"]),
+            ml_optimize.discriminant_yields(self.histos["background"]), min_background=1.)
+        self.assertEqual(scan["s_sqrt_b"][4], 0.)
+        self.assertEqual(int(np.argmax(scan["s_sqrt_b"])), 3)
+
+    def test_combination(self):
+        """ Test that the significances of the mass bins are combined in quadrature.
+        """
+        signal = np.array([[1., 2., 4.], [2., 1., 1.]])
+        background = np.array([[4., 2., 1.], [9., 4., 1.]])
+        scan = ml_optimize.significance_scan(signal, background)
+        for threshold in range(3):
+            per_bin = [signal[i, threshold:].sum() / np.sqrt(background[i, threshold:].sum())
+                       for i in range(2)]
+            self.assertAlmostEqual(scan["s_sqrt_b"][threshold], np.hypot(*per_bin))
+
+
+if __name__ == "__main__":
+    unittest.main()
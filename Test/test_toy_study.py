@@ -0,0 +1,53 @@
+""" Tests for the summary of the pseudo-experiments defined in ``toy_study.py``.
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+from Analysis import toy_study
+
+
+class TestToyStudy(unittest.TestCase):
+    """ Test class for the functions defined in ``toy_study.py``.
+    """
+
+    def setUp(self):
+        """ Fitted values and uncertainties of four toys of a parameter
+            whose true value is 2, the last of which has no uncertainty.
+        """
+        self.values = np.array([1., 3., 2., 2.])
+        self.errors = np.array([1., 1., 1., 0.])
+
+    def test_seeds(self):
+        """ Test that the seeds of the toys are reproducible, distinct and not 0.
+        """
+        seeds = [toy_study.toy_seed(index) for index in range(100)]
+        self.assertEqual(seeds, [toy_study.toy_seed(index) for index in range(100)])
+        self.assertEqual(len(set(seeds)), 100)
+        self.assertTrue(all(0 < seed < 2**32 for seed in seeds))
+
+    def test_summary(self):
+        """ Test the bias, the pulls and the coverage of the converged toys.
+        """
+        summary = toy_study.summarize_toys(self.values, self.errors, 2., np.zeros(4))
+        self.assertEqual(summary["converged"], 3)
+        self.assertAlmostEqual(summary["bias"], 0.)
+        self.assertAlmostEqual(summary["bias_error"], 1. / math.sqrt(3.))
+        self.assertAlmostEqual(summary["pull_width"], 1.)
+        self.assertAlmostEqual(summary["coverage"], 1.)
+
+    def test_failed_fits(self):
+        """ Test that the toys whose fit failed are excluded.
+        """
+        summary = toy_study.summarize_toys(self.values, self.errors, 2., np.array([0, 0, 4, 0]))
+        self.assertEqual(summary["converged"], 2)
+        self.assertAlmostEqual(summary["pull_mean"], 0.)
+        self.assertAlmostEqual(summary["pull_width"], math.sqrt(2.))
+        self.assertEqual(toy_study.summarize_toys(self.values, self.errors, 2.,
+                                                  np.ones(4)), {"converged": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
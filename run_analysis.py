@@ -6,14 +6,61 @@ import argparse
 import sys
 import time
 
+import ROOT
+
 from Analysis import download_dataset, fit_mass, set_up
 from Analysis.Definitions.eos_link_def import EOS_LINK
-from Analysis.Histogramming import make_histo, ml_histo
-from Analysis.Machine_Learning import ml_evaluation, ml_selection, ml_training
+from Analysis.Histogramming import binning, make_histo, merge_histo, ml_histo
+from Analysis.Machine_Learning import (ml_evaluation, ml_fused, ml_optimize, ml_scan,
+                                       ml_selection, ml_training)
 from Analysis.Plotting import make_plot, ml_plot
 from Analysis.Skimming import skim
 
 
+def run_stage(stage, args, logger, summary):
+    """ Run a step of the analysis measuring its execution time
+    and the bytes read and written through ``TFile``.
+
+    :param stage: Main function of the step
+    :type stage: function
+    :param args: Global configuration of the analysis.
+    :type args: argparse.Namespace
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    :param summary: Measurements of the steps already run, updated in place
+    :type summary: list(dict)
+    """
+
+    bytes_read = ROOT.TFile.GetFileBytesRead()
+    bytes_written = ROOT.TFile.GetFileBytesWritten()
+    start_time = time.time()
+    stage(args, logger)
+    summary.append({
+        "stage": stage.__name__,
+        "time": time.time() - start_time,
+        "read": (ROOT.TFile.GetFileBytesRead() - bytes_read) / 1e6,
+        "written": (ROOT.TFile.GetFileBytesWritten() - bytes_written) / 1e6,
+    })
+
+def log_summary(summary, logger):
+    """ Print the execution time and the I/O of each step.
+    The bytes read from RNTuple datasets aren't counted by ``TFile``.
+
+    :param summary: Measurements of the steps
+    :type summary: list(dict)
+    :param logger: Configured logger for printing messages.
+    :type logger: logging.RootLogger
+    """
+
+    lines = [f"{'stage':<16}{'time [s]':>12}{'read [MB]':>12}{'written [MB]':>14}"]
+    for row in summary:
+        lines.append(f"{row['stage']:<16}{row['time']:>12.1f}"
+                     f"{row['read']:>12.1f}{row['written']:>14.1f}")
+    lines.append(f"{'total':<16}{sum(row['time'] for row in summary):>12.1f}"
+                 f"{sum(row['read'] for row in summary):>12.1f}"
+                 f"{sum(row['written'] for row in summary):>14.1f}")
+    logger.info(">>> Summary of the steps\n%s\n", "\n".join(lines))
+
 def run_analysis (argv):
     """ Main function that runs the whole analysis.
 
@@ -95,30 +142,136 @@ def run_analysis (argv):
                             help="comma separated list of the type of distributions to plot: \
                             data, background, signal, sig_bkg_normalized, total" )
 
+    parser.add_argument("-k", "--storage",   default="ttree", type=str,
+                            help="format of the intermediate datasets written by \
+                            the skimming step: ttree, rntuple" )
+
+    parser.add_argument("-F", "--force",   default=False,   action="store_const",
+                            const=True, help="disables the reuse of cached results \
+                            and recomputes every output")
+
+    parser.add_argument("-K", "--kFolds",   default=1, type=int,
+                            help="number of folds of the k-fold training of the DNN")
+
+    parser.add_argument("--trainingSize",   default=0, type=int,
+                            help="number of signal and of background events of each final state \
+                            drawn for the training of the DNN, all the events if 0")
+
+    parser.add_argument("--significance",   default="asimov", type=str,
+                            help="significance maximized by the cut on the discriminant: \
+                            asimov, s_sqrt_sb, s_sqrt_b")
+
+    parser.add_argument("--massBins",   default=False,   action="store_const",
+                            const=True, help="optimizes the cut on the discriminant \
+                            in bins of the mass of the Higgs candidate")
+
+    parser.add_argument("--scan",   default=False,   action="store_const",
+                            const=True, help="trains the configurations of the DNN \
+                            defined in 'dnn_model_def.py' and ranks them in a leaderboard")
+
+    parser.add_argument("--scanSize",   default=0, type=int,
+                            help="number of configurations randomly sampled from the grid \
+                            of the scan, the whole grid if 0")
+
+    parser.add_argument("--registrySize",   default=5, type=int,
+                            help="maximum number of trained models kept in the registry")
+
+    parser.add_argument("--registryAge",   default=30., type=float,
+                            help="maximum age in days of the trained models kept in the registry")
+
+    parser.add_argument("--inferenceEngine",   default="numpy", type=str,
+                            help="engine used to evaluate the DNN: numpy, tmva")
+
+    parser.add_argument("--validateInference",   default=False,   action="store_const",
+                            const=True, help="compares the NumPy evaluation of the DNN \
+                            with the TMVA reader")
+
+    parser.add_argument("--inGraphDNN",   default=False,   action="store_const",
+                            const=True, help="computes the DNN discriminant inside the \
+                            event loop with generated C++ code instead of storing it")
+
+    parser.add_argument("--bootstrap",   default=0, type=int,
+                            help="number of Poisson bootstrap replicas filled with each histogram")
+
+    parser.add_argument("--binning",   default=False,   action="store_const",
+                            const=True, help="proposes the binning of the histograms from \
+                            the quantiles of the simulated samples and uses it in place of \
+                            the one of 'variables_def.py'")
+
+    parser.add_argument("--partial",    default="", type=str,
+                            help="name of the partial result where the histograms are written, \
+                            merged with the other partial results before the plotting")
+
+    parser.add_argument("--partials",    default="", type=str,
+                            help="comma separated list of the partial results to merge, \
+                            all those in 'Histograms/Partials' if empty")
+
+    parser.add_argument("--cube",   default=False,   action="store_const",
+                            const=True, help="fills a sparse N-dimensional histogram of each \
+                            dataset, from which any projection can be obtained")
+
+    parser.add_argument("--fusedML",   default=False,   action="store_const",
+                            const=True, help="computes the DNN discriminant, the selection \
+                            and the 2D histograms in a single pass over each dataset")
+
+    parser.add_argument("--fitBackend",   default="cpu", type=str,
+                            help="backend evaluating the likelihood of the fits: cpu, legacy")
+
+    parser.add_argument("--validateFit",   default=False,   action="store_const",
+                            const=True, help="compares the fitted parameters with the scalar \
+                            evaluation of the likelihood")
+
+    parser.add_argument("--kdeCache",   default=False,   action="store_const",
+                            const=True, help="replaces the KDE of the background with its \
+                            interpolation on a fine grid, cached on disk")
+
+    parser.add_argument("--toys",   default=0, type=int,
+                            help="number of pseudo-experiments generated and fitted to study \
+                            the fit of the data, none if 0")
+
+    parser.add_argument("--massScan",   default=False,   action="store_const",
+                            const=True, help="scans the mass hypothesis of the Higgs boson \
+                            computing the local significance and the profile likelihood")
+
     args_global = parser.parse_args()
 
     logger_global=set_up.set_up(args_global)
 
+    summary = []
+
     if args_global.download != "":
-        download_dataset.download(args_global, logger_global)
+        run_stage(download_dataset.download, args_global, logger_global, summary)
 
     if args_global.skim:
-        skim.skim(args_global, logger_global)
+        run_stage(skim.skim, args_global, logger_global, summary)
 
     if args_global.ml:
-        ml_training.ml_training(args_global, logger_global)
-        ml_evaluation.ml_evaluation(args_global, logger_global)
-        ml_selection.ml_selection(args_global, logger_global)
-        ml_histo.ml_histo(args_global, logger_global)
-        ml_plot.ml_plot(args_global, logger_global)
+        if args_global.scan:
+            run_stage(ml_scan.ml_scan, args_global, logger_global, summary)
+        run_stage(ml_training.ml_training, args_global, logger_global, summary)
+        if args_global.fusedML:
+            run_stage(ml_optimize.ml_optimize, args_global, logger_global, summary)
+            run_stage(ml_fused.ml_fused, args_global, logger_global, summary)
+        else:
+            if not args_global.inGraphDNN:
+                run_stage(ml_evaluation.ml_evaluation, args_global, logger_global, summary)
+            run_stage(ml_optimize.ml_optimize, args_global, logger_global, summary)
+            run_stage(ml_selection.ml_selection, args_global, logger_global, summary)
+            run_stage(ml_histo.ml_histo, args_global, logger_global, summary)
+        run_stage(ml_plot.ml_plot, args_global, logger_global, summary)
 
     if args_global.graphPlots:
-        make_histo.make_histo(args_global, logger_global)
-        make_plot.make_plot(args_global, logger_global)
+        if args_global.binning:
+            run_stage(binning.make_binning, args_global, logger_global, summary)
+        run_stage(make_histo.make_histo, args_global, logger_global, summary)
+        if args_global.partial:
+            run_stage(merge_histo.merge_histo, args_global, logger_global, summary)
+        run_stage(make_plot.make_plot, args_global, logger_global, summary)
 
     if args_global.invariantMassFit:
-        fit_mass.fit_mass(args_global, logger_global)
+        run_stage(fit_mass.fit_mass, args_global, logger_global, summary)
 
+    log_summary(summary, logger_global)
     logger_global.info(">>> Total execution time: %s s \n", (time.time() - start_time))
 
 